@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +8,30 @@ class Settings(BaseSettings):
     mqtt_endpoint: str = 'localhost'
     auth_private_key_path: str = 'private.pem'
     auth_public_key_path: str = 'public.pem'
+    auth_token_cache_size: int = 4096
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: int | None = None
+    mongo_server_selection_timeout_ms: int = 30_000
+    ingest_queue_max_batches: int = 64
+    ingest_queue_max_bytes: int = 64*1024*1024
+    ingest_queue_policy: Literal['block', 'drop_oldest', 'spill'] = 'block'
+    ingest_spill_path: str = 'ingest_spill'
+    wal_enabled: bool = False
+    """Off by default: it needs a persistent local directory (`wal_path`) and adds an fsync and up to `wal_commit_interval_ms` of latency per group of packets"""
+    wal_path: str = 'ingest_wal'
+    wal_segment_bytes: int = 64*1024*1024
+    wal_commit_interval_ms: int = 20
+    ingest_mode: Literal['in_process', 'external'] = 'in_process'
+    ingest_shard_strategy: Literal['flight_hash', 'shared_subscription'] = 'flight_hash'
+    ingest_shared_subscription_group: str = 'flight_management_ingest'
+    flight_data_compression: bool = False
+    """
+    Stores fixed width batches encoded (see `encode_measurement_batch`). Off by default as it changes
+    the stored format, every document is decoded by its own format, so collections can hold both
+    """
+    hot_window_seconds: float = 60
+    hot_window_max_bytes: int = 256*1024*1024
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', env_prefix='rss_server_')
 
 @lru_cache
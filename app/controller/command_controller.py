@@ -3,16 +3,17 @@ import json
 from typing import Annotated, Optional, cast
 from uuid import UUID
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 
-from app.models.flight_measurement import FlightMeasurementAggregated, FlightMeasurementDB, FlightMeasurementSeriesIdentifier
-from ..middleware.auth.requireAuth import AuthOptional, user_optional, user_required, verify_role
+from app.helper.fast_response import create_fast_response
+from app.models.flight_measurement import FlightMeasurementAggregated, FlightMeasurementDB
+from ..middleware.auth.requireAuth import AuthOptional, FlightReadAccess, flight_read_access, user_optional, user_required, verify_role
 from jsonschema import validate, ValidationError
 from app.models.command import Command
 from app.models.flight import FLIGHT_MINIMUM_HEAD_TIME, FLIGHT_DEFAULT_HEAD_TIME
 from app.services.auth.jwt_user_info import UserInfo
 from app.services.auth.permission_service import has_flight_permission
-from app.services.data_access.flight_data import get_aggregated_flight_data as get_aggregated_flight_data_individual, get_flight_data_in_range, resolutions
+from app.services.data_access.flight_data import get_aggregated_flight_data_documents, get_flight_data_documents_in_range, resolutions
 from app.services.data_access.flight import get_flight, create_or_update_flight
 from app.services.data_access.vessel import get_vessel
 from app.controller.flight_controller import flights_controller
@@ -158,19 +159,22 @@ command_controller = APIRouter(
 #     return 'success'
 
 @flights_controller.get("/{flight_id}/commands")
-async def get_commands(user:AuthOptional,flight_data:uuid.UUID,vessel_part:uuid.UUID=Query(), series_name:str=Query(),start:str=Query(),end:str=Query(),resolution:Optional[str]=Query(default=None)):
+async def get_commands(request:Request,user:AuthOptional,flight_data:uuid.UUID,vessel_part:uuid.UUID=Query(), series_name:str=Query(),start:str=Query(),end:str=Query(),resolution:Optional[str]=Query(default=None)):
+    access = await flight_read_access(flight_data, user)
+
     if resolution:
-        return await get_aggregated(flight_data, vessel_part, series_name, resolution, start, end, user)
+        return await get_aggregated(flight_data, vessel_part, series_name, resolution, start, end, access, request)
     else:
-        return await getRange(flight_data, vessel_part, start, end, user)
+        return await getRange(flight_data, vessel_part, start, end, access, request)
 
 @command_controller.get("/get_aggregated_range/{flight_id}/{vessel_part}/{series_name}/{resolution}/{start}/{end}")
-async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_name: str, resolution: str, start: str, end: str, user: AuthOptional) -> list[FlightMeasurementAggregated]:
+async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_name: str, resolution: str, start: str, end: str, access: FlightReadAccess, request: Request) -> list[FlightMeasurementAggregated]:
     """
     Gets flight measurements for a specific part within the specified range at a specified resolution
     The flight data returned by this method is aggregated at a higher resolution. The avg, min and
     max of the data will be produced efficiently on the server and returned. This method should be
-    used if a large range of data is required.
+    used if a large range of data is required. Answered as json, msgpack or cbor depending on the
+    `Accept` header
     """
 
     if start.endswith('Z'):
@@ -181,31 +185,17 @@ async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_na
     if resolution not in resolutions:
         raise HTTPException(400, f'{resolution} is not supported')
 
-    flight = await get_flight(flight_id)
-
-    if flight is None:
-        raise HTTPException(404, 'Flight does not exist')
-    
-    vessel = await get_vessel(flight.vessel_id)
-
-    if vessel is None:
-        raise HTTPException(404, 'Vessel does not exist')
-    
-    if not has_flight_permission(flight, vessel, 'read', user):
-        raise HTTPException(403, 'You don\'t have the required permission to access the flight')
+    flight, _ = access
 
     measured_parts = flight.measured_parts
 
     vessel_part_str = str(vessel_part)
-    
-    i = 0
-    for id in measured_parts:
-        if id == vessel_part_str:
-            break
-        i += 1
 
-    if i >= len(measured_parts):
-        return list()
+    # The ingest stores the data by the index of the part in the measured part ids
+    if vessel_part_str not in measured_parts or vessel_part_str not in flight.measured_part_ids:
+        return create_fast_response(request, []) # type: ignore
+
+    i = flight.measured_part_ids.index(vessel_part_str)
 
     measurement_schema = measured_parts[str(vessel_part)]
 
@@ -216,49 +206,40 @@ async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_na
         j += 1
 
     if j >= len(measurement_schema):
-        return list()
+        return create_fast_response(request, []) # type: ignore
 
-    values = await get_aggregated_flight_data_individual(flight_id, i, j, datetime.fromisoformat(start), datetime.fromisoformat(end), resolution, measurement_schema, 'commands') # type: ignore
+    values = await get_aggregated_flight_data_documents(flight_id, i, j, datetime.fromisoformat(start), datetime.fromisoformat(end), resolution, 'commands')
 
     for v in values:
-        v.part_id = uuid.UUID(flight.measured_part_ids[v.p_index])
-        v.series_name = measurement_schema[v.m_index].name
+        v['part_id'] = flight.measured_part_ids[v['p_index']]
+        v['series_name'] = measurement_schema[v['m_index']].name
 
-    return values
+    return create_fast_response(request, values) # type: ignore
 
 @command_controller.get("/get_range/{flight_id}/{vessel_part}/{start}/{end}")
-async def getRange(flight_id: uuid.UUID, vessel_part: uuid.UUID, start: str, end: str, user: AuthOptional) -> list[FlightMeasurementDB]:
+async def getRange(flight_id: uuid.UUID, vessel_part: uuid.UUID, start: str, end: str, access: FlightReadAccess, request: Request) -> list[FlightMeasurementDB]:
     """
     Gets flight measurements for a specific part within the specified range.
+    Answered as json, msgpack or cbor depending on the `Accept` header
     """
 
-    series_identifier = FlightMeasurementSeriesIdentifier(_flight_id = flight_id, _vessel_part_id=vessel_part)
-
     if start.endswith('Z'):
         start = start[:-1]
     if end.endswith('Z'):
         end = end[:-1]
 
-    flight = await get_flight(flight_id)
-
-    if flight is None:
-        raise HTTPException(404, 'Flight does not exist')
-    
-    vessel = await get_vessel(flight.vessel_id)
-
-    if vessel is None:
-        raise HTTPException(404, 'Vessel does not exist')
-    
-    if not has_flight_permission(flight, vessel, 'read', user):
-        raise HTTPException(403, 'You don\'t have the required permission to access the flight')
+    flight, _ = access
 
     measured_parts = cast(dict, flight.measured_parts)
 
     # If the part is not part of this flight, there are no
     # values available
-    if str(vessel_part) not in measured_parts:
-        return list()
+    if str(vessel_part) not in measured_parts or str(vessel_part) not in flight.measured_part_ids:
+        return create_fast_response(request, []) # type: ignore
+
+    # The data is stored by the index of the part within the flight
+    part_index = flight.measured_part_ids.index(str(vessel_part))
     
-    values = await get_flight_data_in_range(series_identifier, datetime.fromisoformat(start), datetime.fromisoformat(end), 'commands')
+    values = await get_flight_data_documents_in_range(flight_id, part_index, datetime.fromisoformat(start), datetime.fromisoformat(end), 'commands')
 
-    return values
+    return create_fast_response(request, values) # type: ignore
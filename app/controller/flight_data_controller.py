@@ -1,15 +1,17 @@
 
 from datetime import datetime
-from typing import Optional, cast
+from typing import Annotated, Optional, cast
 import uuid
-from fastapi import APIRouter, HTTPException
-from app.middleware.auth.requireAuth import AuthOptional
-from app.models.flight_measurement import FlightMeasurementAggregated, FlightMeasurementSeriesIdentifier
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from app.helper.downsampling import DownsamplingMethod
+from app.helper.fast_response import create_fast_response
+from app.helper.ndjson import NDJSON_MEDIA_TYPE, decode_continuation_token, encode_continuation_token, encode_ndjson
+from app.middleware.auth.requireAuth import AuthOptional, FlightReadAccess, flight_read_access
+from app.models.flight_measurement import FlightDataBatchQuery, FlightMeasurementAggregated
 from app.models.flight_measurement import FlightMeasurementDB
-from app.services.auth.permission_service import has_flight_permission
-from app.services.data_access.flight import get_flight
-from app.services.data_access.flight_data import get_aggregated_flight_data as get_aggregated_flight_data_individual, get_flight_data_in_range, resolutions
-from app.services.data_access.vessel import get_vessel
+from app.services.data_access.flight_data import get_aggregated_flight_data_documents, get_aggregated_flight_data_for_series, get_downsampled_flight_data, get_flight_data_documents_in_range, resolutions, epoch, stream_flight_data_for_series, stream_flight_data_in_range, to_flight_data_output, STREAM_BATCH_SIZE
+from app.services.flight_data_export import EXPORT_FILE_EXTENSIONS, EXPORT_MEDIA_TYPES, ExportFormat, export_flight_data
 from app.controller.flight_controller import flights_controller
 from fastapi import Query
 
@@ -19,20 +21,106 @@ flight_data_controller = APIRouter(
     dependencies=[],
 )
 
+StreamQuery = Annotated[bool, Query(description='Streams the documents as newline delimited json')]
+BatchSizeQuery = Annotated[int, Query(ge=1, le=10_000, description='Documents fetched from the database per round trip when streaming')]
+LimitQuery = Annotated[Optional[int], Query(ge=1, description='Maximum number of documents to stream, a continuation token is appended if there are more')]
+ContinuationTokenQuery = Annotated[Optional[str], Query(description='Token of a previous streamed page to continue after')]
+MaxPointsQuery = Annotated[Optional[int], Query(ge=4, le=100_000, description='Downsamples the series to about this many samples, e.g. the width of a plot in pixels')]
+DownsamplingQuery = Annotated[DownsamplingMethod, Query(description='Keep the minimum and maximum of every bucket or use largest triangle three buckets')]
+
 @flights_controller.get("/{flight_id}/data")
-async def get_flight_data(user:AuthOptional,flight_data:uuid.UUID,vessel_part:uuid.UUID=Query(), series_name:str=Query(),start:str=Query(),end:str=Query(),resolution:Optional[str]=Query(default=None)):
+async def get_flight_data(request:Request,user:AuthOptional,flight_data:uuid.UUID,vessel_part:uuid.UUID=Query(), series_name:str=Query(),start:str=Query(),end:str=Query(),resolution:Optional[str]=Query(default=None),stream:StreamQuery=False,batch_size:BatchSizeQuery=STREAM_BATCH_SIZE,limit:LimitQuery=None,continuation_token:ContinuationTokenQuery=None,max_points:MaxPointsQuery=None,downsampling:DownsamplingQuery='min_max'):
+    access = await flight_read_access(flight_data, user)
+
     if resolution:
-        return await get_aggregated(flight_data, vessel_part, series_name, resolution, start, end, user)
+        return await get_aggregated(flight_data, vessel_part, series_name, resolution, start, end, access, request)
+    elif max_points is not None:
+        if stream:
+            raise HTTPException(400, 'max_points can\'t be combined with stream')
+
+        return await get_downsampled(flight_data, vessel_part, series_name, start, end, access, request, max_points, downsampling)
     else:
-        return await getRange(flight_data, vessel_part, start, end, user)
+        return await getRange(flight_data, vessel_part, start, end, access, request, stream, batch_size, limit, continuation_token)
+
+@flights_controller.post("/{flight_id}/data")
+async def get_flight_data_batch(flight_id: uuid.UUID, query: FlightDataBatchQuery, access: FlightReadAccess, request: Request) -> list[FlightMeasurementAggregated]:
+    """
+    Gets several aggregated series of a flight within the same range and resolution with a
+    single request. Series that are not part of the flight are left out of the result.
+    Answered as json, msgpack or cbor depending on the `Accept` header
+    """
+
+    if query.resolution not in resolutions:
+        raise HTTPException(400, f'{query.resolution} is not supported')
+
+    flight, _ = access
+
+    part_indices = {part_id: i for i, part_id in enumerate(flight.measured_part_ids)}
+    series_indices = dict[str, dict[str, int]]()
+
+    series = list[tuple[int, int]]()
+
+    for selector in query.series:
+
+        part_id = str(selector.part_id)
+
+        if part_id not in part_indices or part_id not in flight.measured_parts:
+            continue
+
+        if part_id not in series_indices:
+            series_indices[part_id] = {d.name: j for j, d in enumerate(flight.measured_parts[part_id])}
+
+        if selector.series_name not in series_indices[part_id]:
+            continue
+
+        series.append((part_indices[part_id], series_indices[part_id][selector.series_name]))
+
+    values = await get_aggregated_flight_data_for_series(flight_id, list(dict.fromkeys(series)), query.start, query.end, query.resolution)
+
+    for v in values:
+        part_id = flight.measured_part_ids[v['p_index']]
+        v['part_id'] = part_id
+        v['series_name'] = flight.measured_parts[part_id][v['m_index']].name
+
+    return create_fast_response(request, values) # type: ignore
+
+@flights_controller.get("/{flight_id}/export")
+async def export_data(flight_id: uuid.UUID, access: FlightReadAccess, format: ExportFormat = Query(default='arrow'), vessel_part: Optional[uuid.UUID] = Query(default=None), series_name: Optional[str] = Query(default=None), start: Optional[datetime] = Query(default=None), end: Optional[datetime] = Query(default=None)):
+    """
+    Exports the measurements of a flight as an arrow ipc stream or a parquet file. Limited to a
+    part or a single series of it if given. Every series gets typed columns derived from its
+    measurement type next to the time, part id and series name columns
+    """
+
+    flight, _ = access
+
+    series = list[tuple[int, int]]()
+
+    for i, part_id in enumerate(flight.measured_part_ids):
+
+        if part_id not in flight.measured_parts or (vessel_part is not None and part_id != str(vessel_part)):
+            continue
+
+        for j, descriptor in enumerate(flight.measured_parts[part_id]):
+            if series_name is None or descriptor.name == series_name:
+                series.append((i, j))
+
+    documents = stream_flight_data_for_series(flight_id, series, start or epoch, end or datetime.max)
+
+    return StreamingResponse(
+        export_flight_data(flight, series, documents, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{flight_id}.{EXPORT_FILE_EXTENSIONS[format]}"'}
+    )
 
 @flight_data_controller.get("/get_aggregated_range/{flight_id}/{vessel_part}/{series_name}/{resolution}/{start}/{end}")
-async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_name: str, resolution: str, start: str, end: str, user: AuthOptional) -> list[FlightMeasurementAggregated]:
+async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_name: str, resolution: str, start: str, end: str, access: FlightReadAccess, request: Request) -> list[FlightMeasurementAggregated]:
     """
     Gets flight measurements for a specific part within the specified range at a specified resolution
     The flight data returned by this method is aggregated at a higher resolution. The avg, min and
     max of the data will be produced efficiently on the server and returned. This method should be
-    used if a large range of data is required.
+    used if a large range of data is required. Answered as json, msgpack or cbor depending on the
+    `Accept` header
     """
 
     if start.endswith('Z'):
@@ -43,31 +131,17 @@ async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_na
     if resolution not in resolutions:
         raise HTTPException(400, f'{resolution} is not supported')
 
-    flight = await get_flight(flight_id)
-
-    if flight is None:
-        raise HTTPException(404, 'Flight does not exist')
-    
-    vessel = await get_vessel(flight.vessel_id)
-
-    if vessel is None:
-        raise HTTPException(404, 'Vessel does not exist')
-    
-    if not has_flight_permission(flight, vessel, 'read', user):
-        raise HTTPException(403, 'You don\'t have the required permission to access the flight')
+    flight, _ = access
 
     measured_parts = flight.measured_parts
 
     vessel_part_str = str(vessel_part)
-    
-    i = 0
-    for id in measured_parts:
-        if id == vessel_part_str:
-            break
-        i += 1
 
-    if i >= len(measured_parts):
-        return list()
+    # The ingest stores the data by the index of the part in the measured part ids
+    if vessel_part_str not in measured_parts or vessel_part_str not in flight.measured_part_ids:
+        return create_fast_response(request, []) # type: ignore
+
+    i = flight.measured_part_ids.index(vessel_part_str)
 
     measurement_schema = measured_parts[str(vessel_part)]
 
@@ -78,49 +152,118 @@ async def get_aggregated(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_na
         j += 1
 
     if j >= len(measurement_schema):
-        return list()
+        return create_fast_response(request, []) # type: ignore
 
-    values = await get_aggregated_flight_data_individual(flight_id, i, j, datetime.fromisoformat(start), datetime.fromisoformat(end), resolution, measurement_schema) # type: ignore
+    values = await get_aggregated_flight_data_documents(flight_id, i, j, datetime.fromisoformat(start), datetime.fromisoformat(end), resolution)
 
     for v in values:
-        v.part_id = uuid.UUID(flight.measured_part_ids[v.p_index])
-        v.series_name = measurement_schema[v.m_index].name
+        v['part_id'] = flight.measured_part_ids[v['p_index']]
+        v['series_name'] = measurement_schema[v['m_index']].name
 
-    return values
+    return create_fast_response(request, values) # type: ignore
+
+async def get_downsampled(flight_id: uuid.UUID, vessel_part: uuid.UUID, series_name: str, start: str, end: str, access: tuple, request: Request, max_points: int, method: DownsamplingMethod) -> list[FlightMeasurementDB]:
+    """
+    Gets the measurements of a series within the range reduced to about `max_points` samples,
+    so the response has the same size no matter how long the range is while peaks stay visible
+    """
+
+    if start.endswith('Z'):
+        start = start[:-1]
+    if end.endswith('Z'):
+        end = end[:-1]
+
+    flight, _ = access
+
+    measured_parts = flight.measured_parts
+
+    vessel_part_str = str(vessel_part)
+
+    # The ingest stores the data by the index of the part in the measured part ids
+    if vessel_part_str not in measured_parts or vessel_part_str not in flight.measured_part_ids:
+        return create_fast_response(request, []) # type: ignore
+
+    i = flight.measured_part_ids.index(vessel_part_str)
+
+    j = next((j for j, descriptor in enumerate(measured_parts[vessel_part_str]) if descriptor.name == series_name), None)
+
+    if j is None:
+        return create_fast_response(request, []) # type: ignore
+
+    values = await get_downsampled_flight_data(flight_id, i, j, datetime.fromisoformat(start), datetime.fromisoformat(end), max_points, method)
+
+    for v in values:
+        v['part_id'] = vessel_part_str
+        v['series_name'] = series_name
+
+    return create_fast_response(request, values) # type: ignore
 
 @flight_data_controller.get("/get_range/{flight_id}/{vessel_part}/{start}/{end}")
-async def getRange(flight_id: uuid.UUID, vessel_part: uuid.UUID, start: str, end: str, user: AuthOptional) -> list[FlightMeasurementDB]:
+async def getRange(flight_id: uuid.UUID, vessel_part: uuid.UUID, start: str, end: str, access: FlightReadAccess, request: Request, stream: StreamQuery = False, batch_size: BatchSizeQuery = STREAM_BATCH_SIZE, limit: LimitQuery = None, continuation_token: ContinuationTokenQuery = None) -> list[FlightMeasurementDB]:
     """
     Gets flight measurements for a specific part within the specified range.
+    With `stream` the documents are sent as newline delimited json while they are read
+    from the database. If there are more than `limit` documents, the last line is a
+    `{"continuation_token": ...}` to pass in the next request. Otherwise answered as json,
+    msgpack or cbor depending on the `Accept` header
     """
 
-    series_identifier = FlightMeasurementSeriesIdentifier(_flight_id = flight_id, _vessel_part_id=vessel_part)
+    after = None
+
+    if continuation_token is not None:
+        try:
+            after = decode_continuation_token(continuation_token)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
 
     if start.endswith('Z'):
         start = start[:-1]
     if end.endswith('Z'):
         end = end[:-1]
 
-    flight = await get_flight(flight_id)
-
-    if flight is None:
-        raise HTTPException(404, 'Flight does not exist')
-    
-    vessel = await get_vessel(flight.vessel_id)
-
-    if vessel is None:
-        raise HTTPException(404, 'Vessel does not exist')
-    
-    if not has_flight_permission(flight, vessel, 'read', user):
-        raise HTTPException(403, 'You don\'t have the required permission to access the flight')
+    flight, _ = access
 
     measured_parts = cast(dict, flight.measured_parts)
 
     # If the part is not part of this flight, there are no
     # values available
-    if str(vessel_part) not in measured_parts:
-        return list()
+    if str(vessel_part) not in measured_parts or str(vessel_part) not in flight.measured_part_ids:
+        return Response(media_type=NDJSON_MEDIA_TYPE) if stream else create_fast_response(request, []) # type: ignore
+
+    # The data is stored by the index of the part within the flight
+    part_index = flight.measured_part_ids.index(str(vessel_part))
+
+    if stream:
+        return stream_range(flight_id, part_index, datetime.fromisoformat(start), datetime.fromisoformat(end), batch_size, limit, after) # type: ignore
     
-    values = await get_flight_data_in_range(series_identifier, datetime.fromisoformat(start), datetime.fromisoformat(end))
+    values = await get_flight_data_documents_in_range(flight_id, part_index, datetime.fromisoformat(start), datetime.fromisoformat(end))
+
+    return create_fast_response(request, values) # type: ignore
+
+def stream_range(flight_id: uuid.UUID, part_index: int, start: datetime, end: datetime, batch_size: int, limit: int | None, after) -> StreamingResponse:
+
+    streamed = 0
+    last = None
+    more = False
+
+    async def documents():
+        nonlocal streamed, last, more
+
+        # One more than the limit is read to know whether there is a next page
+        async for d in stream_flight_data_in_range(flight_id, part_index, start, end, batch_size=batch_size, limit=None if limit is None else limit + 1, after=after):
+
+            if limit is not None and streamed >= limit:
+                more = True
+                break
+
+            streamed += 1
+            last = d
+            yield d
+
+    def trailer():
+        if not more or last is None:
+            return None
+
+        return {'continuation_token': encode_continuation_token(last['_start_time'], last['_id'])}
 
-    return values
+    return StreamingResponse(encode_ndjson(documents(), to_flight_data_output, batch_size, trailer), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException
+from app.middleware.auth.requireAuth import AuthRequired, verify_role
+from app.mqtt.init_mqtt import processors, write_ahead_log
+from app.services.auth.token_cache import verified_token_cache
+from app.services.data_access.flight_data import insert_metrics
+from app.services.data_access.flight_data_rollup import rollup_coverage
+from app.services.data_access.mongodb.mongodb_connection import get_client, get_pool_metrics
+from app.services.flight_access_cache import flight_access_cache
+from app.services.flight_heartbeat import flight_heartbeat
+from app.services.hot_window import hot_window
+from app.services.live_telemetry import live_telemetry
+from app.services.flight_schema_cache import flight_schema_cache
+
+health_controller = APIRouter(
+    prefix="/v1/health",
+    tags=["v1/health"],
+    dependencies=[],
+)
+
+@health_controller.get("/")
+async def get_health() -> dict[str, str]:
+    """
+    Returns ok if the server is running and can reach the database
+    """
+
+    try:
+        await get_client().admin.command('ping')
+    except Exception as e:
+        raise HTTPException(503, f'Database not reachable: {e}')
+
+    return {'status': 'ok'}
+
+@health_controller.get("/metrics")
+async def get_metrics(user: AuthRequired) -> dict[str, dict]:
+    """
+    Returns runtime metrics of the server, e.g. the usage of the database connection pool.
+    Requires the admin role
+    """
+
+    verify_role(user, 'admin')
+
+    return {
+        'mongo_pool': get_pool_metrics(),
+        'flight_schema_cache': flight_schema_cache.get_metrics(),
+        'flight_access_cache': flight_access_cache.get_metrics(),
+        'auth_token_cache': verified_token_cache.get_metrics(),
+        'flight_heartbeat': flight_heartbeat.get_metrics(),
+        'live_telemetry': live_telemetry.get_metrics(),
+        'hot_window': hot_window.get_metrics(),
+        'ingest_queues': {p.table: p.ingest_queue.get_metrics() for p in processors},
+        'flight_data_inserts': insert_metrics.get_metrics(),
+        'flight_data_rollups': rollup_coverage.get_metrics(),
+        'write_ahead_log': write_ahead_log.get_metrics() if write_ahead_log is not None else {},
+    }
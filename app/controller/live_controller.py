@@ -0,0 +1,162 @@
+import asyncio
+from typing import Optional
+import uuid
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
+import orjson
+from pydantic import ValidationError
+import socketio
+
+from app.controller.flight_controller import flights_controller
+from app.middleware.auth.requireAuth import FlightReadAccess, try_authenticate_socket
+from app.models.flight_measurement import LiveSubscriptionQuery
+from app.services.auth.jwt_user_info import get_socket_user_info, remove_socket_user_info
+from app.services.auth.permission_service import has_flight_permission
+from app.services.flight_access_cache import flight_access_cache
+from app.services.live_telemetry import LIVE_KEEPALIVE_INTERVAL, LIVE_UNAVAILABLE_MESSAGE, LiveSubscription, get_live_series, is_live_available, live_telemetry
+
+SSE_MEDIA_TYPE = 'text/event-stream'
+
+#region Server sent events
+
+@flights_controller.get("/{flight_id}/live")
+async def get_live_measurements(flight_id: uuid.UUID, access: FlightReadAccess, part_id: Optional[uuid.UUID] = Query(default=None), series_name: Optional[str] = Query(default=None), rate: Optional[float] = Query(default=None, gt=0, description='Maximum samples per second sent of every series')):
+    """
+    Streams the measurements of a flight as server sent events while they are received. Every
+    `measurements` event holds a batch of one series, decimated to `rate` if given. If the
+    client doesn't keep up, the oldest batches are dropped, `dropped` counts them. Responds
+    with 503 if the measurements are ingested by external workers
+    """
+
+    if not is_live_available():
+        raise HTTPException(503, LIVE_UNAVAILABLE_MESSAGE)
+
+    flight, _ = access
+
+    try:
+        series = get_live_series(flight, str(part_id) if part_id is not None else None, series_name)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    subscription = LiveSubscription(flight_id, series, rate)
+
+    async def events():
+
+        live_telemetry.subscribe(subscription)
+
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), LIVE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+                    continue
+
+                yield b'event: measurements\ndata: ' + orjson.dumps(message) + b'\n\n'
+        finally:
+            live_telemetry.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type=SSE_MEDIA_TYPE, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+#endregion
+
+#region Socket.io
+
+live_socket = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+
+live_socket_app = socketio.ASGIApp(live_socket, socketio_path='live/socket.io')
+"""Mounted at `/live`, clients connect with the path `/live/socket.io`"""
+
+socket_subscriptions = dict[str, dict[str, tuple[LiveSubscription, asyncio.Task]]]()
+"""Subscriptions and their sending task by subscription id of every connected socket"""
+
+async def send_live_measurements(sid: str, subscription_id: str, subscription: LiveSubscription):
+
+    while True:
+        message = await subscription.get()
+        message['subscription_id'] = subscription_id
+
+        await live_socket.emit('measurements', message, to=sid)
+
+def close_subscription(sid: str, subscription_id: str) -> bool:
+
+    entry = socket_subscriptions.get(sid, dict()).pop(subscription_id, None)
+
+    if entry is None:
+        return False
+
+    subscription, task = entry
+
+    live_telemetry.unsubscribe(subscription)
+    task.cancel()
+
+    return True
+
+@live_socket.event
+async def connect(sid: str, environ: dict, auth: dict | None = None):
+    """Authenticates with the `token` of the handshake, clients without a token connect anonymously"""
+
+    try:
+        try_authenticate_socket(sid, auth or {})
+    except HTTPException as e:
+        raise ConnectionRefusedError(e.detail)
+
+    socket_subscriptions[sid] = dict()
+
+@live_socket.event
+async def disconnect(sid: str):
+
+    for subscription_id in list(socket_subscriptions.get(sid, dict())):
+        close_subscription(sid, subscription_id)
+
+    socket_subscriptions.pop(sid, None)
+    remove_socket_user_info(sid)
+
+@live_socket.event
+async def subscribe(sid: str, data: dict) -> dict:
+    """
+    Subscribes to the live measurements of a flight (see `LiveSubscriptionQuery`), they are
+    sent as `measurements` events. Acknowledged with the `subscription_id` or an `error`
+    """
+
+    if not is_live_available():
+        return {'error': LIVE_UNAVAILABLE_MESSAGE}
+
+    try:
+        query = LiveSubscriptionQuery(**data)
+    except (ValidationError, TypeError) as e:
+        return {'error': f'Invalid subscription: {e}'}
+
+    flight, vessel = await flight_access_cache.get(query.flight_id)
+
+    if flight is None or vessel is None:
+        return {'error': 'Flight does not exist'}
+
+    if not has_flight_permission(flight, vessel, 'read', get_socket_user_info(sid)): # type: ignore
+        return {'error': 'You don\'t have the required permission to access the flight'}
+
+    try:
+        series = get_live_series(flight, str(query.part_id) if query.part_id is not None else None, query.series_name)
+    except ValueError as e:
+        return {'error': str(e)}
+
+    if sid not in socket_subscriptions:
+        return {'error': 'Not connected'}
+
+    subscription_id = str(uuid.uuid4())
+    subscription = LiveSubscription(flight.id, series, query.rate)
+
+    live_telemetry.subscribe(subscription)
+    socket_subscriptions[sid][subscription_id] = (subscription, asyncio.create_task(send_live_measurements(sid, subscription_id, subscription)))
+
+    return {'subscription_id': subscription_id}
+
+@live_socket.event
+async def unsubscribe(sid: str, data: dict) -> dict:
+
+    if not isinstance(data, dict) or not close_subscription(sid, str(data.get('subscription_id'))):
+        return {'error': 'Subscription does not exist'}
+
+    return {'subscription_id': data['subscription_id']}
+
+#endregion
@@ -0,0 +1,172 @@
+import re
+from typing import Any
+import numpy as np
+
+from app.helper.binary_format_encoder import DOUBLE_SIZE, PayloadCodec, get_shape_key
+
+STRUCT_TO_NUMPY = {
+    'b': 'i1',
+    'B': 'u1',
+    '?': '?',
+    'h': '>i2',
+    'H': '>u2',
+    'i': '>i4',
+    'I': '>u4',
+    'l': '>i4',
+    'L': '>u4',
+    'q': '>i8',
+    'Q': '>u8',
+    'e': '>f2',
+    'f': '>f4',
+    'd': '>f8',
+}
+
+STRUCT_TOKEN = re.compile(r'(\d*)(.)')
+
+batch_dtypes = dict[tuple[Any, int], np.dtype | None]()
+
+class DecodedBatch:
+    """
+    All packets of one measurement series decoded at once. Only produced for
+    shapes where every packet in the batch has the same layout
+    """
+
+    def __init__(self, rows: np.ndarray, single_value: bool) -> None:
+
+        self.rows = rows
+        """Structured array with a time field and one field per value"""
+
+        self.single_value = single_value
+
+        times = rows['time']
+        self.start = float(times.min())
+        self.end = float(times.max())
+
+    def to_tuples(self) -> list[tuple]:
+        """Returns the (time, value) tuples in the same format as `decode_payload`"""
+        return rows_to_tuples(self.rows, self.single_value)
+
+    def get_tuple(self, index: int) -> tuple:
+        """Returns the (time, value) tuple of a single row"""
+
+        index = index % len(self.rows)
+
+        return rows_to_tuples(self.rows[index:index+1], self.single_value)[0]
+
+    def aggregate(self) -> tuple[Any, Any, Any]:
+        """Returns (min, avg, max) of the values, or (None, None, None) if the series has multiple values"""
+
+        if not self.single_value:
+            return (None, None, None)
+
+        values = self.rows['value']
+
+        if values.ndim > 1:
+            return (None, None, None)
+
+        if values.dtype == np.bool_:
+            values = values.astype(np.int8)
+
+        return (values.min().item(), float(values.mean(dtype=np.float64)), values.max().item())
+
+def rows_to_tuples(rows: np.ndarray, single_value: bool) -> list[tuple]:
+
+    if single_value:
+        return list(zip(rows['time'].tolist(), rows['value'].tolist()))
+
+    return [(r[0], r[1:]) for r in rows.tolist()]
+
+def get_struct_fields(fmt: str) -> list[str] | None:
+    """Translates a struct format into numpy field types, None if a character has no numpy equivalent"""
+
+    fields = list()
+
+    for count, char in STRUCT_TOKEN.findall(fmt):
+
+        if char not in STRUCT_TO_NUMPY:
+            return None
+
+        fields.extend([STRUCT_TO_NUMPY[char]]*int(count or 1))
+
+    return fields
+
+def get_batch_dtype(codec: PayloadCodec, packet_size: int) -> np.dtype | None:
+
+    key = (get_shape_key(codec.shape), packet_size)
+
+    if key in batch_dtypes:
+        return batch_dtypes[key]
+
+    dtype = create_batch_dtype(codec, packet_size)
+    batch_dtypes[key] = dtype
+
+    return dtype
+
+def create_batch_dtype(codec: PayloadCodec, packet_size: int) -> np.dtype | None:
+
+    shape = codec.shape
+
+    if not isinstance(shape, str) or shape == '[str]':
+        return None
+
+    # Plain struct shape
+    if codec.value_struct is not None:
+
+        fields = get_struct_fields(shape)
+
+        if fields is None:
+            return None
+
+        if len(fields) == 1:
+            return np.dtype([('time', '>f8'), ('value', fields[0])])
+
+        return np.dtype([('time', '>f8')] + [(f'v{i}', f) for i, f in enumerate(fields)])
+
+    # Top level array of single values, fixed width if all packets of the batch have the same length
+    if shape.startswith('[') and not shape[1:-1].startswith('['):
+
+        fields = get_struct_fields(shape[1:-1])
+
+        if fields is None or len(fields) != 1:
+            return None
+
+        element_size = np.dtype(fields[0]).itemsize
+
+        if (packet_size - DOUBLE_SIZE) % element_size != 0:
+            return None
+
+        return np.dtype([('time', '>f8'), ('value', fields[0], ((packet_size - DOUBLE_SIZE)//element_size,))])
+
+    return None
+
+def decode_batch(codec: PayloadCodec, payloads: list[bytes]) -> DecodedBatch | None:
+    """
+    Decodes all payloads with a single `numpy.frombuffer` call. Returns None if the
+    shape or the packets are not fixed width, in which case `decode_payload` has to be used
+    """
+
+    if len(payloads) < 1:
+        return None
+
+    packet_size = len(payloads[0])
+
+    if codec.packet_size is not None and packet_size != codec.packet_size:
+        return None
+
+    for p in payloads:
+        if len(p) != packet_size:
+            return None
+
+    return decode_packed_batch(codec, b''.join(payloads), packet_size)
+
+def decode_packed_batch(codec: PayloadCodec, data: bytes, packet_size: int) -> DecodedBatch | None:
+    """Decodes packets of `packet_size` bytes each that were already concatenated"""
+
+    dtype = get_batch_dtype(codec, packet_size)
+
+    if dtype is None:
+        return None
+
+    rows = np.frombuffer(data, dtype=dtype)
+
+    return DecodedBatch(rows, 'value' in dtype.names and len(dtype.names) == 2) # type: ignore
@@ -1,7 +1,7 @@
 import base64
 import struct
 import sys
-from typing import Any, Collection, Iterable
+from typing import Any, Callable, Collection, Iterable
 
 INT_SIZE = struct.calcsize('i')
 DOUBLE_SIZE = struct.calcsize('d')
@@ -103,11 +103,7 @@ def calc_payload_size(shape: type | str | list[tuple[str, str]] | tuple[str, str
 
 def decode_payload(shape: str | list[tuple[str, str]], payload: bytes):
 
-    time = struct.unpack_from('!d', payload, 0)[0]
-
-    res, offset = decode_payload_internal(shape, payload, DOUBLE_SIZE)
-
-    return time, res
+    return get_codec(shape).decode(payload)
 
 def decode_payload_internal(shape: str | list[tuple[str, str]] | tuple[str, str], payload: bytes, offset: int, top_level: bool = True):
 
@@ -158,4 +154,189 @@ def decode_payload_internal(shape: str | list[tuple[str, str]] | tuple[str, str]
             res.append(resi)
         return res, offset
     
-    raise Exception()
\ No newline at end of file
+    raise Exception()
+
+#region Compiled codecs
+
+PayloadShape = None | str | list[tuple[str, str]] | tuple[str, str]
+
+Reader = Callable[[bytes, int], tuple[Any, int]]
+"""Reads one value from the payload at the offset and returns it together with the new offset"""
+
+TIME_STRUCT = struct.Struct('!d')
+INT_STRUCT = struct.Struct('!i')
+
+class PayloadCodec:
+    """
+    Decoder for a single shape descriptor. The shape is interpreted once when the codec
+    is compiled (see `get_codec`), decoding a packet then only runs the precompiled plan.
+    Produces the same results as `decode_payload`
+    """
+
+    def __init__(self, shape: PayloadShape, decode: Callable[[bytes], tuple[float, Any]], value_struct: struct.Struct | None = None) -> None:
+
+        self.shape = shape
+
+        self.decode = decode
+        """Decodes a packet into a (time, value) tuple"""
+
+        self.value_struct = value_struct
+        """Struct of the value if the shape is a plain struct shape, None otherwise"""
+
+        self.packet_size = None if value_struct is None else DOUBLE_SIZE + value_struct.size
+        """Size of every packet for fixed width shapes, None if the size depends on the payload"""
+
+compiled_codecs = dict[Any, PayloadCodec]()
+
+def get_shape_key(shape: PayloadShape):
+    """Returns a hashable representation of the shape"""
+
+    if shape is None or isinstance(shape, str):
+        return shape
+
+    return repr(shape)
+
+def get_codec(shape: PayloadShape) -> PayloadCodec:
+    """Gets the compiled codec for the shape, compiling it on first use"""
+
+    key = get_shape_key(shape)
+
+    codec = compiled_codecs.get(key)
+
+    if codec is None:
+        codec = compile_codec(shape)
+        compiled_codecs[key] = codec
+
+    return codec
+
+def compile_codec(shape: PayloadShape) -> PayloadCodec:
+
+    if isinstance(shape, str) and shape.startswith('!'):
+        shape = shape[1:]
+
+    # Hot path: plain struct, time and value are unpacked in a single call
+    if isinstance(shape, str) and not shape.startswith('['):
+
+        value_struct = struct.Struct(f'!{shape}')
+        packet_struct = struct.Struct(f'!d{shape}')
+        unpack_from = packet_struct.unpack_from
+
+        if get_value_count(value_struct) == 1:
+            def decode_single(payload: bytes):
+                time, value = unpack_from(payload, 0)
+                return time, value
+            return PayloadCodec(shape, decode_single, value_struct)
+
+        def decode_struct(payload: bytes):
+            values = unpack_from(payload, 0)
+            return values[0], values[1:]
+        return PayloadCodec(shape, decode_struct, value_struct)
+
+    read_top_level = compile_top_level_reader(shape)
+
+    def decode(payload: bytes):
+        time, = TIME_STRUCT.unpack_from(payload, 0)
+        return time, read_top_level(payload, DOUBLE_SIZE)[0]
+
+    return PayloadCodec(shape, decode)
+
+def get_value_count(s: struct.Struct):
+    return len(s.unpack(bytes(s.size)))
+
+def compile_top_level_reader(shape: PayloadShape) -> Reader:
+    """
+    Top level arrays and strings take up the rest of the payload and
+    therefore have no length prefix
+    """
+
+    if shape == '[str]':
+        def read_str(payload: bytes, offset: int):
+            return payload[offset:].decode(), len(payload)
+        return read_str
+
+    if isinstance(shape, str) and shape.startswith('['):
+
+        element_shape = shape[1:-1]
+
+        # Fixed size elements can be unpacked at once
+        if not element_shape.startswith('['):
+            element_struct = struct.Struct(f'!{element_shape}')
+            element_size = element_struct.size
+            iter_unpack = element_struct.iter_unpack
+            single = get_value_count(element_struct) == 1
+
+            def read_struct_array(payload: bytes, offset: int):
+                count = (len(payload) - offset)//element_size
+                end = offset + count*element_size
+                values = iter_unpack(memoryview(payload)[offset:end])
+                return ([v[0] for v in values] if single else list(values)), end
+            return read_struct_array
+
+        read_element = compile_reader(element_shape)
+
+        def read_array(payload: bytes, offset: int):
+            res = list()
+            while offset < len(payload):
+                value, offset = read_element(payload, offset)
+                res.append(value)
+            return res, offset
+        return read_array
+
+    return compile_reader(shape)
+
+def compile_reader(shape: PayloadShape) -> Reader:
+    """Compiles the reader of a nested (non top level) shape"""
+
+    if shape == '[str]':
+        def read_str(payload: bytes, offset: int):
+            str_len, = INT_STRUCT.unpack_from(payload, offset)
+            offset += INT_SIZE
+            return payload[offset:offset+str_len].decode(), offset + str_len
+        return read_str
+
+    if isinstance(shape, str):
+
+        if shape.startswith('['):
+            read_element = compile_reader(shape[1:-1])
+
+            def read_array(payload: bytes, offset: int):
+                count, = INT_STRUCT.unpack_from(payload, offset)
+                offset += INT_SIZE
+                res = list()
+                for _ in range(count):
+                    value, offset = read_element(payload, offset)
+                    res.append(value)
+                return res, offset
+            return read_array
+
+        value_struct = struct.Struct(f'!{shape}')
+        size = value_struct.size
+        unpack_from = value_struct.unpack_from
+
+        if get_value_count(value_struct) == 1:
+            def read_single(payload: bytes, offset: int):
+                return unpack_from(payload, offset)[0], offset + size
+            return read_single
+
+        def read_struct(payload: bytes, offset: int):
+            return unpack_from(payload, offset), offset + size
+        return read_struct
+
+    if isinstance(shape, tuple):
+        return compile_reader(shape[1])
+
+    if isinstance(shape, Collection):
+        # Flatten the nested shape into a plan of readers executed in order
+        plan = [compile_reader(s) for s in shape]
+
+        def read_fields(payload: bytes, offset: int):
+            res = list()
+            for read in plan:
+                value, offset = read(payload, offset)
+                res.append(value)
+            return res, offset
+        return read_fields
+
+    raise Exception(f'Unsupported shape: {shape}')
+
+#endregion
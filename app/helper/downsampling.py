@@ -0,0 +1,133 @@
+from typing import Literal
+import numpy as np
+
+DownsamplingMethod = Literal['min_max', 'lttb']
+
+MIN_POINTS = 4
+"""Smallest number of points a series can be downsampled to"""
+
+def get_numeric_values(values: list) -> np.ndarray | None:
+    """Values as float64, `None` if they are not single numbers (strings, several fields)"""
+
+    try:
+        array = np.asarray(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        return None
+
+    return array if array.ndim == 1 else None
+
+def downsample_stride(count: int, max_points: int) -> np.ndarray:
+    """Evenly spaced indices, used for values that can't be compared"""
+
+    if count <= max_points:
+        return np.arange(count)
+
+    return np.unique(np.linspace(0, count - 1, max_points).round().astype(np.int64))
+
+def downsample_min_max(times: np.ndarray, values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Splits the time range into `max_points/2` equally wide buckets and keeps the smallest and
+    largest value of every bucket, so peaks stay visible. Returns the indices of the kept
+    samples ordered by time. Times have to be sorted
+    """
+
+    count = len(times)
+
+    if count <= max_points:
+        return np.arange(count)
+
+    bucket_count = max(1, max_points//2)
+    span = times[-1] - times[0]
+
+    if span <= 0:
+        return downsample_stride(count, max_points)
+
+    buckets = np.minimum(((times - times[0])/span*bucket_count).astype(np.int64), bucket_count - 1)
+
+    # Sorted by bucket, then by value: the first of a bucket is its minimum, the last its maximum
+    order = np.lexsort((values, buckets))
+    sorted_buckets = buckets[order]
+
+    firsts = np.flatnonzero(np.diff(sorted_buckets, prepend=-1))
+    lasts = np.append(firsts[1:] - 1, count - 1)
+
+    return np.unique(np.concatenate([order[firsts], order[lasts]]))
+
+def downsample_lttb(times: np.ndarray, values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest triangle three buckets: keeps the first and last sample and from every bucket
+    in between the sample spanning the largest triangle with the previously kept sample and
+    the average of the next bucket. Returns the indices of the kept samples. Times have to
+    be sorted
+    """
+
+    count = len(times)
+
+    if count <= max_points:
+        return np.arange(count)
+
+    # Bucket bounds of the samples between the first and the last
+    bounds = np.linspace(1, count - 1, max_points - 1).astype(np.int64)
+
+    # Averages of every bucket, the last sample is the "next bucket" of the last one
+    sums_t = np.add.reduceat(times[1:count-1], bounds[:-1] - 1)
+    sums_v = np.add.reduceat(values[1:count-1], bounds[:-1] - 1)
+    sizes = np.diff(bounds)
+
+    avg_t = np.append(sums_t/sizes, times[-1])
+    avg_v = np.append(sums_v/sizes, values[-1])
+
+    kept = np.empty(max_points, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = count - 1
+
+    previous = 0
+
+    for i in range(max_points - 2):
+
+        start, end = bounds[i], bounds[i + 1]
+
+        t = times[start:end]
+        v = values[start:end]
+
+        areas = np.abs((times[previous] - avg_t[i + 1])*(v - values[previous]) - (times[previous] - t)*(avg_v[i + 1] - values[previous]))
+
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+
+    return kept
+
+def downsample_indices(times: np.ndarray, values: np.ndarray | None, max_points: int, method: DownsamplingMethod = 'min_max') -> np.ndarray:
+    """
+    Returns the indices of the samples kept when reducing a series to at most about
+    `max_points`. Times have to be sorted, `values` is `None` if they are not single
+    numbers, they are then reduced to evenly spaced samples
+    """
+
+    max_points = max(max_points, MIN_POINTS)
+
+    if values is None:
+        return downsample_stride(len(times), max_points)
+
+    if method == 'lttb':
+        return downsample_lttb(times, values, max_points)
+
+    return downsample_min_max(times, values, max_points)
+
+def downsample_measurements(measurements: list, max_points: int, method: DownsamplingMethod = 'min_max') -> list:
+    """
+    Reduces the (time, value) measurements of a series to at most about `max_points`
+    while keeping its shape (see `downsample_indices`)
+    """
+
+    if len(measurements) <= max(max_points, MIN_POINTS):
+        return measurements
+
+    times = np.fromiter((m[0] for m in measurements), dtype=np.float64, count=len(measurements))
+    order = np.argsort(times, kind='stable')
+
+    measurements = [measurements[i] for i in order]
+
+    indices = downsample_indices(times[order], get_numeric_values([m[1] for m in measurements]), max_points, method)
+
+    return [measurements[i] for i in indices]
@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+import io
+from typing import Any, Literal
+from uuid import UUID
+from bson import ObjectId
+import cbor2
+from fastapi import Request, Response
+import msgpack
+import orjson
+
+ResponseFormat = Literal['json', 'msgpack', 'cbor']
+
+RESPONSE_MEDIA_TYPES: dict[str, ResponseFormat] = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/cbor': 'cbor',
+}
+"""Media types of the `Accept` header that can be answered, everything else gets json"""
+
+FORMAT_MEDIA_TYPES: dict[ResponseFormat, str] = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+    'cbor': 'application/cbor',
+}
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+def plain_default(obj: Any):
+    """Converts the values that come out of the database, which the encoders don't know"""
+
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+
+    if isinstance(obj, (UUID, ObjectId)):
+        return str(obj)
+
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+
+    raise TypeError(f'{type(obj)} is not serializable')
+
+def cbor_default(encoder, obj: Any):
+    encoder.encode(plain_default(obj))
+
+def encode_cbor(content: Any) -> bytes:
+
+    fp = io.BytesIO()
+    encoder = cbor2.CBOREncoder(fp, default=cbor_default, timezone=timezone.utc, datetime_as_timestamp=False)
+
+    # cbor2 encodes UUIDs as tagged byte strings, they are strings in json and msgpack
+    encoder._encoders[UUID] = cbor_default
+
+    encoder.encode(content)
+
+    return fp.getvalue()
+
+def get_response_format(accept: str | None) -> ResponseFormat:
+    """Picks the supported media type of the `Accept` header with the highest quality"""
+
+    if not accept:
+        return 'json'
+
+    best: ResponseFormat = 'json'
+    best_quality = -1.0
+
+    for media_range in accept.split(','):
+
+        media_type, *params = [p.strip() for p in media_range.split(';')]
+        quality = 1.0
+
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0
+
+        # q=0 means not acceptable
+        if media_type in RESPONSE_MEDIA_TYPES and quality > 0 and quality > best_quality:
+            best = RESPONSE_MEDIA_TYPES[media_type]
+            best_quality = quality
+
+    return best
+
+def encode_content(content: Any, format: ResponseFormat) -> bytes:
+
+    if format == 'msgpack':
+        return msgpack.packb(content, default=plain_default, datetime=False) # type: ignore
+
+    if format == 'cbor':
+        return encode_cbor(content)
+
+    return orjson.dumps(content, default=plain_default, option=ORJSON_OPTIONS)
+
+def create_fast_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """
+    Encodes plain dicts and lists as json (orjson), msgpack or cbor depending on the `Accept`
+    header. Skips the validation of the response model, the content has to be in the
+    shape of the declared model already
+    """
+
+    format = get_response_format(request.headers.get('accept'))
+
+    return Response(encode_content(content, format), status_code=status_code, media_type=FORMAT_MEDIA_TYPES[format])
@@ -0,0 +1,169 @@
+from typing import Any
+import numpy as np
+import zstandard
+
+from app.helper.batch_decoder import DecodedBatch, decode_packed_batch, rows_to_tuples
+from app.helper.binary_format_encoder import get_codec
+from app.helper.payload_batch import decode_payloads, get_stored_shape
+
+"""
+### Encoded measurement batches:
+
+Instead of an array of `[time, value]` pairs, fixed width batches can be stored as one
+compressed binary. Every field of the decoded rows (see `DecodedBatch`) is stored as a
+column of its bit pattern:
+
+- `time`: delta of delta of the float64 bits. Sampling times increase and share their
+  exponent, so for a steady sampling rate almost all values are 0
+- values: xor with the previous row (like Gorilla), slowly changing values leave most
+  bits 0
+
+The columns are byte shuffled (all first bytes, all second bytes, ...) and compressed with
+zstd. The document keeps `encoding.version`, documents without it store plain arrays
+"""
+
+MEASUREMENT_ENCODING_VERSION = 1
+
+ZSTD_LEVEL = 3
+
+#region Transforms
+
+def get_unsigned_dtype(dtype: np.dtype) -> np.dtype:
+    return np.dtype(f'u{dtype.itemsize}')
+
+def shuffle(column: np.ndarray) -> bytes:
+    """Groups the bytes of the values by their position within the value"""
+
+    itemsize = column.dtype.itemsize
+    return np.ascontiguousarray(column.view(np.uint8).reshape(-1, itemsize).T).tobytes()
+
+def unshuffle(data: bytes, dtype: np.dtype) -> np.ndarray:
+
+    itemsize = dtype.itemsize
+    return np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T).view(dtype).reshape(-1)
+
+def encode_delta_of_delta(bits: np.ndarray) -> np.ndarray:
+    """Unsigned arithmetic wraps around, so the transform is lossless for any bit pattern"""
+
+    if len(bits) < 3:
+        return bits.copy()
+
+    deltas = np.diff(bits)
+    return np.concatenate([bits[:1], deltas[:1], np.diff(deltas)])
+
+def decode_delta_of_delta(encoded: np.ndarray) -> np.ndarray:
+
+    if len(encoded) < 3:
+        return encoded.copy()
+
+    deltas = np.cumsum(encoded[1:], dtype=encoded.dtype)
+    return np.concatenate([encoded[:1], encoded[0] + np.cumsum(deltas, dtype=encoded.dtype)])
+
+def encode_xor(bits: np.ndarray) -> np.ndarray:
+
+    encoded = bits.copy()
+    encoded[1:] ^= bits[:-1]
+
+    return encoded
+
+def decode_xor(encoded: np.ndarray) -> np.ndarray:
+    return np.bitwise_xor.accumulate(encoded, axis=0)
+
+#endregion
+
+#region Batches
+
+def get_native_dtype(dtype: np.dtype) -> np.dtype:
+    """Rows are big endian as received, the columns are stored in native byte order"""
+    return np.dtype([(name, dtype[name].newbyteorder('=')) for name in dtype.names]) # type: ignore
+
+def encode_measurement_batch(batch: DecodedBatch) -> dict:
+    """Encodes the rows of a decoded batch, the result is stored as the `encoding` of a document"""
+
+    rows = batch.rows.astype(get_native_dtype(batch.rows.dtype))
+
+    fields = list()
+    chunks = list[bytes]()
+
+    for name in rows.dtype.names: # type: ignore
+
+        column = rows[name]
+        base = column.dtype.base
+
+        bits = np.ascontiguousarray(column).view(get_unsigned_dtype(base))
+
+        encoded = encode_delta_of_delta(bits) if name == 'time' else encode_xor(bits.reshape(len(rows), -1)).reshape(-1)
+
+        fields.append([name, base.str, int(np.prod(column.shape[1:], dtype=np.int64))])
+        chunks.append(shuffle(encoded))
+
+    return {
+        'version': MEASUREMENT_ENCODING_VERSION,
+        'count': len(rows),
+        'single_value': batch.single_value,
+        'fields': fields,
+        'data': zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(b''.join(chunks)),
+    }
+
+def decode_measurement_batch(encoding: dict) -> np.ndarray:
+    """Decodes an encoded batch back into its rows"""
+
+    if encoding['version'] != MEASUREMENT_ENCODING_VERSION:
+        raise ValueError(f'Unsupported measurement encoding version {encoding["version"]}')
+
+    count = encoding['count']
+    data = zstandard.ZstdDecompressor().decompress(bytes(encoding['data']))
+
+    dtype = np.dtype([(name, base, (size,)) if size != 1 else (name, base) for name, base, size in encoding['fields']])
+    rows = np.empty(count, dtype=dtype)
+
+    offset = 0
+
+    for name, base, size in encoding['fields']:
+
+        base = np.dtype(base)
+        unsigned = get_unsigned_dtype(base)
+        length = count*size*base.itemsize
+
+        encoded = unshuffle(data[offset:offset+length], unsigned)
+        offset += length
+
+        bits = decode_delta_of_delta(encoded) if name == 'time' else decode_xor(encoded.reshape(count, size)).reshape(-1)
+
+        rows[name] = bits.view(base).reshape(rows[name].shape)
+
+    return rows
+
+#endregion
+
+def get_stored_measurements(d: dict) -> list:
+    """
+    Returns the (time, value) measurements of a stored document. Raw payload batches
+    and encoded batches are decoded here, older documents store them as they are
+    """
+
+    if 'payloads' in d:
+        return decode_payloads(get_stored_shape(d['shape']), bytes(d['payloads']), d.get('payload_size'), d.get('payload_sizes'))
+
+    if 'encoding' in d:
+        encoding: dict[str, Any] = d['encoding']
+        return rows_to_tuples(decode_measurement_batch(encoding), encoding['single_value'])
+
+    return d['measurements']
+
+def get_stored_batch(d: dict) -> DecodedBatch | None:
+    """
+    Decodes encoded and fixed width raw payload batches of a stored document into their rows
+    without creating a tuple per measurement. None for documents storing (time, value) lists
+    or payloads that are not fixed width, `get_stored_measurements` has to be used for them
+    """
+
+    if 'encoding' in d:
+        encoding: dict[str, Any] = d['encoding']
+        rows = decode_measurement_batch(encoding)
+        return DecodedBatch(rows, encoding['single_value']) if len(rows) > 0 else None
+
+    if 'payloads' in d and d.get('payload_size') is not None:
+        return decode_packed_batch(get_codec(get_stored_shape(d['shape'])), bytes(d['payloads']), d['payload_size'])
+
+    return None
@@ -0,0 +1,62 @@
+import base64
+from datetime import datetime
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Callable
+from bson import ObjectId
+import orjson
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+def json_default(obj: Any):
+
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+
+    return str(obj)
+
+def encode_line(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=json_default, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+
+async def encode_ndjson(documents: AsyncIterable[Any], encode: Callable[[Any], Any], batch_size: int, trailer: Callable[[], Any] | None = None) -> AsyncIterator[bytes]:
+    """
+    Encodes the documents as one json line each. Lines are sent in chunks of `batch_size`
+    documents, so only one chunk is held in memory at a time. `trailer` is called at the
+    end and can return a last line (e.g. a continuation token)
+    """
+
+    chunk = list[bytes]()
+
+    async for d in documents:
+
+        chunk.append(encode_line(encode(d)))
+
+        if len(chunk) >= batch_size:
+            yield b''.join(chunk)
+            chunk = list()
+
+    if trailer is not None:
+        last = trailer()
+
+        if last is not None:
+            chunk.append(encode_line(last))
+
+    if len(chunk) > 0:
+        yield b''.join(chunk)
+
+#region Continuation tokens
+
+def encode_continuation_token(start_time: datetime, _id: ObjectId) -> str:
+    """Token pointing after a document in a stream sorted by start time and id"""
+
+    return base64.urlsafe_b64encode(json.dumps([start_time.isoformat(), str(_id)]).encode()).decode()
+
+def decode_continuation_token(token: str) -> tuple[datetime, ObjectId]:
+    """Raises a `ValueError` if the token is invalid"""
+
+    try:
+        start_time, _id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(start_time), ObjectId(_id)
+    except Exception as e:
+        raise ValueError(f'Invalid continuation token: {e}')
+
+#endregion
@@ -0,0 +1,80 @@
+import struct
+from typing import Any
+
+from app.helper.batch_decoder import DecodedBatch, decode_batch, decode_packed_batch
+from app.helper.binary_format_encoder import TIME_STRUCT, PayloadCodec, PayloadShape, get_codec
+
+"""
+### Payload batches:
+
+The payloads of a batch stored as received, concatenated into one blob. If all payloads
+have the same size only that size is stored, otherwise the size of every payload
+(`!I` each) is stored next to the blob
+"""
+
+def pack_payloads(payloads: list[bytes]) -> tuple[bytes, int | None, bytes | None]:
+    """Returns the blob, the size of every payload if it is fixed and the packed sizes otherwise"""
+
+    size = len(payloads[0])
+
+    if all(len(p) == size for p in payloads):
+        return b''.join(payloads), size, None
+
+    return b''.join(payloads), None, struct.pack(f'!{len(payloads)}I', *[len(p) for p in payloads])
+
+def unpack_payloads(data: bytes, payload_size: int | None, payload_sizes: bytes | None) -> list[bytes]:
+
+    if payload_size is not None:
+        return [data[o:o+payload_size] for o in range(0, len(data), payload_size)]
+
+    assert payload_sizes is not None
+
+    payloads = list[bytes]()
+    offset = 0
+
+    for size, in struct.iter_unpack('!I', payload_sizes):
+        payloads.append(data[offset:offset+size])
+        offset += size
+
+    return payloads
+
+def summarize_payloads(codec: PayloadCodec, payloads: list[bytes], batch: DecodedBatch | None = None) -> tuple[float, float, tuple[Any, Any, Any], tuple, tuple]:
+    """
+    Returns the start, end, (min, avg, max), first and last measurement of the payloads without
+    decoding all of them. Only fixed width shapes are aggregated (with a single numpy decode,
+    `batch` if the caller already decoded them)
+    """
+
+    if batch is None:
+        batch = decode_batch(codec, payloads)
+
+    if batch is not None:
+        start, end, agg = batch.start, batch.end, batch.aggregate()
+    else:
+        times = [TIME_STRUCT.unpack_from(p, 0)[0] for p in payloads]
+        start, end, agg = min(times), max(times), (None, None, None)
+
+    return start, end, agg, codec.decode(payloads[0]), codec.decode(payloads[-1])
+
+def get_stored_shape(shape: Any) -> PayloadShape:
+    """Named fields are read back from the database as lists instead of tuples"""
+
+    if isinstance(shape, list):
+        return [tuple(f) for f in shape] # type: ignore
+
+    return shape
+
+def decode_payloads(shape: PayloadShape, data: bytes, payload_size: int | None, payload_sizes: bytes | None) -> list[tuple]:
+    """Decodes a payload batch into (time, value) tuples like `decode_payload`"""
+
+    codec = get_codec(shape)
+
+    if payload_size is not None:
+        batch = decode_packed_batch(codec, data, payload_size)
+
+        if batch is not None:
+            return batch.to_tuples()
+
+    decode = codec.decode
+
+    return [decode(p) for p in unpack_payloads(data, payload_size, payload_sizes)]
@@ -7,9 +7,12 @@ from app.controller.vessel_controller import vessel_controller,vessels_controlle
 from app.controller.user_controller import user_controller
 from app.controller.flight_data_controller import flight_data_controller
 from app.controller.flight_controller import flight_controller, flights_controller
+from app.controller.health_controller import health_controller
+from app.controller.live_controller import live_socket_app
 # from app.mqtt.oauth_plugin import OAuthPlugin
 from app.mqtt.init_mqtt import start_mqtt, stop_mqtt
-from app.services.data_access.mongodb.mongodb_connection import init_app
+from app.services.flight_heartbeat import flight_heartbeat
+from app.services.data_access.mongodb.mongodb_connection import close_db_client, init_app, init_db_client
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.types import Message
@@ -41,13 +44,23 @@ class GZipedMiddleware(BaseHTTPMiddleware):
 @asynccontextmanager
 async def _lifetime(app: FastAPI):
 
-    endpoint = get_settings().mqtt_endpoint
+    settings = get_settings()
+
+    # With external ingest workers (see app.mqtt.ingest_worker) this process only serves the api
+    run_ingest = settings.ingest_mode == 'in_process'
     
+    await init_db_client()
+
     try:
-        start_mqtt(app, endpoint)
+        if run_ingest:
+            start_mqtt(app, settings.mqtt_endpoint)
+            flight_heartbeat.start()
         yield
     finally:
-        stop_mqtt()
+        if run_ingest:
+            await stop_mqtt()
+            await flight_heartbeat.stop()
+        close_db_client()
 
 
 # Init fast api
@@ -64,6 +77,9 @@ app.include_router(flights_controller) # /v1/
 app.include_router(flight_controller)
 app.include_router(flight_data_controller)
 app.include_router(user_controller)
+app.include_router(health_controller)
+
+app.mount('/live', live_socket_app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1,10 +1,15 @@
 from functools import wraps
 from typing import Annotated, Union
 import inspect
+from uuid import UUID
 from fastapi import Depends, HTTPException, Header
 from socketio import Server
-from ...services.auth.jwt_auth_service import validate_access_token
-from ...services.auth.jwt_user_info import UserInfo, get_socket_user_info, set_socket_user_info, user_from_token
+from ...models.flight import Flight
+from ...models.vessel import Vessel
+from ...services.auth.permission_service import has_flight_permission
+from ...services.flight_access_cache import flight_access_cache
+from ...services.auth.token_cache import verified_token_cache
+from ...services.auth.jwt_user_info import UserInfo, get_socket_user_info, set_socket_user_info
 
 def try_get_bearer(x_access_token: Annotated[Union[str, None], Header(alias='Authorization')] = None) -> Union[str, None]:
 
@@ -34,6 +39,27 @@ def user_required(bearer: Annotated[Union[str, None], Depends(try_get_bearer)])
 AuthOptional = Annotated[UserInfo, Depends(user_optional)]
 AuthRequired = Annotated[UserInfo, Depends(user_required)]
 
+async def get_flight_access(flight_id: UUID, permission: str, user: Union[UserInfo, None]) -> tuple[Flight, Vessel]:
+    '''Returns the flight and its vessel if the user has the permission on the flight, they are read from the `flight_access_cache`'''
+
+    flight, vessel = await flight_access_cache.get(flight_id)
+
+    if flight is None:
+        raise HTTPException(404, 'Flight does not exist')
+
+    if vessel is None:
+        raise HTTPException(404, 'Vessel does not exist')
+
+    if not has_flight_permission(flight, vessel, permission, user): # type: ignore
+        raise HTTPException(403, 'You don\'t have the required permission to access the flight')
+
+    return flight, vessel
+
+async def flight_read_access(flight_id: UUID, user: AuthOptional) -> tuple[Flight, Vessel]:
+    return await get_flight_access(flight_id, 'read', user)
+
+FlightReadAccess = Annotated[tuple[Flight, Vessel], Depends(flight_read_access)]
+
 def verify_role(user_info: UserInfo, role: str):
 
     if role not in user_info.roles:
@@ -68,8 +94,7 @@ def get_user_from_bearer(token: str) -> UserInfo:
     """
     
     try:
-        decoded_token = validate_access_token(token)
-        return user_from_token(decoded_token)
+        return verified_token_cache.get(token)
     except Exception as err:
         raise HTTPException(401, f'Invalid token: {err}')
 
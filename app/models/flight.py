@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from datetime import timezone
-from typing import Dict, Union
+from typing import Dict, Literal, Union
 from uuid import UUID, uuid4
 from pydantic import BaseModel, Field
 
@@ -74,6 +74,13 @@ class Flight(AwareDatetimeModel):
     The permission everyone has regardless of if they are logged in or not
     """
 
+    storage_mode: Literal['decoded', 'raw'] = 'decoded'
+    """
+    How the measurements of the flight are stored. `decoded` stores every measurement as a
+    (time, value) pair, `raw` stores the received payloads as they are and only decodes them
+    when they are read. Meant for high rate sensors whose data is rarely read
+    """
+
 
 class UpdateFlight(BaseModel):
     name: str
@@ -15,6 +15,42 @@ class FlightMeasurementSeriesIdentifier(BaseModel):
 
     vessel_part_id: UUID = Field(alias='_vessel_part_id', alias_priority=1, default=None)
 
+class FlightMeasurementSeriesSelector(BaseModel):
+    """
+    Selects a measurement series of a flight by its part and name
+    """
+
+    part_id: UUID
+
+    series_name: str
+
+class FlightDataBatchQuery(BaseModel):
+    """
+    Query for several series of a flight within the same range and resolution
+    """
+
+    series: list[FlightMeasurementSeriesSelector]
+
+    start: datetime.datetime
+
+    end: datetime.datetime
+
+    resolution: str
+
+class LiveSubscriptionQuery(BaseModel):
+    """
+    Subscribes to the live measurements of a flight, optionally only of a part or a single series
+    """
+
+    flight_id: UUID
+
+    part_id: UUID | None = None
+
+    series_name: str | None = None
+
+    rate: float | None = Field(default=None, gt=0)
+    """Maximum samples per second sent of every series, all samples are sent if not set"""
+
 class FlightMeasurementDescriptor(BaseModel):
     """
     Describes a field in the measured data
@@ -56,6 +92,9 @@ class FlightMeasurementAggregated(AwareDatetimeModel):
 
     max: list[NumericalMeasurementTypes] | NumericalMeasurementTypes | None
 
+    count: int = 0
+    """Number of samples the aggregate was computed from"""
+
     first: Tuple[float, list[MeasurementTypes] | MeasurementTypes] 
 
     last:  Tuple[float, list[MeasurementTypes] | MeasurementTypes]
@@ -0,0 +1,269 @@
+import asyncio
+from collections import deque
+import os
+import pickle
+import time
+from typing import Awaitable, Callable, Literal
+
+VesselBuffer = dict[str, dict[str, list[bytes]]]
+
+IngestPolicy = Literal['block', 'drop_oldest', 'spill']
+
+MAX_QUEUED_BATCHES = 64
+MAX_QUEUED_BYTES = 64*1024*1024
+
+
+class IngestBatch:
+
+    def __init__(self, flight_uuid: str, buffer: VesselBuffer, size: int, wal_records: dict[int, list[int]] | None = None) -> None:
+        self.flight_uuid = flight_uuid
+        self.buffer = buffer
+        self.size = size
+
+        self.wal_records = wal_records
+        """Write ahead log record indices per segment of the packets of the batch"""
+
+class IngestQueue:
+    """
+    Bounded queue between the measurement buffers and the database. A fixed number
+    of workers write the batches, the queue limits how many batches and bytes can be
+    waiting or in flight. If the limits are reached the policy decides what happens:
+
+    - `block`: the batch is accepted, but `on_backpressure(True)` is called so the
+      producer stops reading until there is room again (`on_backpressure(False)`)
+    - `drop_oldest`: the oldest waiting batch is discarded, the new one if all batches
+      are being written
+    - `spill`: the batch is written to disk and loaded back once there is room. Until
+      all spilled batches are loaded back, new batches are spilled as well
+    """
+
+    def __init__(self, name: str, handler: Callable[[str, VesselBuffer], Awaitable], workers: int, max_batches: int = MAX_QUEUED_BATCHES, max_bytes: int = MAX_QUEUED_BYTES, policy: IngestPolicy = 'block', spill_path: str = 'ingest_spill') -> None:
+
+        self.name = name
+        self.handler = handler
+        self.worker_count = workers
+        self.max_batches = max_batches
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_path = os.path.join(spill_path, name)
+
+        self.on_backpressure: Callable[[bool], None] | None = None
+
+        self.on_batch_done: Callable[[IngestBatch], None] | None = None
+        """Called once a batch was written to the database or deliberately dropped"""
+
+        self.load_leftovers = True
+        """Whether spilled batches of a previous run are loaded on start"""
+
+        self.batches = deque[IngestBatch]()
+        self.spilled = deque[str]()
+        self.workers = list[asyncio.Task]()
+        self.batch_available: asyncio.Event | None = None
+        self.idle: asyncio.Event | None = None
+
+        self.total_batches = 0
+        """Batches waiting or being written"""
+
+        self.total_bytes = 0
+        """Bytes waiting or being written"""
+
+        self.paused = False
+
+        self.written_batches = 0
+        self.failed_batches = 0
+        self.dropped_batches = 0
+        self.spilled_batches = 0
+        self.max_depth = 0
+
+    def is_full(self):
+        return self.total_batches >= self.max_batches or self.total_bytes >= self.max_bytes
+
+    def start(self):
+
+        self.batch_available = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+        if self.policy == 'spill':
+            self.load_leftover_spills()
+
+        self.workers = [asyncio.create_task(self.run_worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+
+        for w in self.workers:
+            w.cancel()
+
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = list()
+
+    def put(self, flight_uuid: str, buffer: VesselBuffer, size: int, wal_records: dict[int, list[int]] | None = None):
+
+        batch = IngestBatch(flight_uuid, buffer, size, wal_records)
+
+        # Once anything is spilled, later batches queue up behind it so they are written in order
+        if self.policy == 'spill' and (self.is_full() or len(self.spilled) > 0):
+            self.spill(batch)
+            self.load_spills()
+            return
+
+        if self.policy == 'drop_oldest':
+
+            while self.is_full() and len(self.batches) > 0:
+                dropped = self.batches.popleft()
+                self.total_batches -= 1
+                self.total_bytes -= dropped.size
+                self.drop(dropped)
+
+            # All batches are being written, the new one is the oldest waiting
+            if self.is_full():
+                self.drop(batch)
+                return
+
+        self.enqueue(batch)
+
+        if self.policy == 'block' and not self.paused and self.is_full():
+            self.set_paused(True)
+
+    def drop(self, batch: IngestBatch):
+
+        self.dropped_batches += 1
+
+        if self.on_batch_done is not None:
+            self.on_batch_done(batch)
+
+    def enqueue(self, batch: IngestBatch):
+
+        self.batches.append(batch)
+        self.total_batches += 1
+        self.total_bytes += batch.size
+        self.max_depth = max(self.max_depth, self.total_batches)
+
+        if self.idle is not None:
+            self.idle.clear()
+
+        if self.batch_available is not None:
+            self.batch_available.set()
+
+    def set_paused(self, paused: bool):
+
+        self.paused = paused
+
+        if self.on_backpressure is not None:
+            self.on_backpressure(paused)
+
+    async def run_worker(self):
+
+        assert self.batch_available is not None
+
+        while True:
+
+            while len(self.batches) < 1:
+                self.batch_available.clear()
+                await self.batch_available.wait()
+
+            batch = self.batches.popleft()
+
+            try:
+                await self.handler(batch.flight_uuid, batch.buffer)
+                self.written_batches += 1
+
+                if self.on_batch_done is not None:
+                    self.on_batch_done(batch)
+            except Exception as e:
+                self.failed_batches += 1
+                print(f'Failed to write {self.name} batch of flight {batch.flight_uuid}: {e}')
+            finally:
+                self.batch_done(batch)
+
+    def batch_done(self, batch: IngestBatch):
+
+        self.total_batches -= 1
+        self.total_bytes -= batch.size
+
+        self.load_spills()
+
+        if self.paused and not self.is_full():
+            self.set_paused(False)
+
+        if self.total_batches < 1 and len(self.spilled) < 1 and self.idle is not None:
+            self.idle.set()
+
+    async def join(self):
+        """Waits until all batches (including spilled ones) are written"""
+
+        if self.idle is not None and self.total_batches + len(self.spilled) > 0:
+            await self.idle.wait()
+
+    #region Spilling
+
+    def spill(self, batch: IngestBatch):
+
+        os.makedirs(self.spill_path, exist_ok=True)
+
+        path = os.path.join(self.spill_path, f'{time.time_ns()}.batch')
+
+        with open(path, 'wb') as f:
+            pickle.dump((batch.flight_uuid, batch.buffer, batch.size, batch.wal_records), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.spilled.append(path)
+        self.spilled_batches += 1
+
+        if self.idle is not None:
+            self.idle.clear()
+
+    def load_spills(self):
+        """Loads spilled batches in order while there is room"""
+
+        while len(self.spilled) > 0 and not self.is_full():
+            self.load_spill()
+
+    def load_spill(self):
+
+        path = self.spilled.popleft()
+
+        with open(path, 'rb') as f:
+            flight_uuid, buffer, size, wal_records = pickle.load(f)
+
+        os.remove(path)
+
+        self.enqueue(IngestBatch(flight_uuid, buffer, size, wal_records))
+
+    def load_leftover_spills(self):
+        """Picks up batches that were spilled but not written before the last shutdown"""
+
+        if not os.path.isdir(self.spill_path):
+            return
+
+        for file in sorted(os.listdir(self.spill_path)):
+
+            if not file.endswith('.batch'):
+                continue
+
+            path = os.path.join(self.spill_path, file)
+
+            # Also stored in the write ahead log, which is replayed instead
+            if not self.load_leftovers:
+                os.remove(path)
+                continue
+
+            self.spilled.append(path)
+
+        self.load_spills()
+
+    #endregion
+
+    def get_metrics(self) -> dict[str, int | bool | str]:
+        return {
+            'policy': self.policy,
+            'queued_batches': len(self.batches),
+            'in_flight_batches': self.total_batches,
+            'in_flight_bytes': self.total_bytes,
+            'max_depth': self.max_depth,
+            'spilled_pending': len(self.spilled),
+            'paused': self.paused,
+            'written_batches': self.written_batches,
+            'failed_batches': self.failed_batches,
+            'dropped_batches': self.dropped_batches,
+            'spilled_batches': self.spilled_batches,
+        }
@@ -0,0 +1,89 @@
+"""
+### Ingest workers:
+
+Runs the mqtt ingest in separate processes, so decoding and writing measurements can
+use more than one core. The api is then started with `RSS_SERVER_INGEST_MODE=external`
+so it doesn't ingest itself.
+
+Every worker has its own mqtt client, measurement processors and mongo client. The packets
+are split between the workers either by the hash of the flight id (every worker receives
+all packets and drops the ones of other flights, default) or through an mqtt shared
+subscription (`ingest_shard_strategy = shared_subscription`) if the broker supports it.
+The topic scheme `<flight>/m|c/<part>/<measurement>` stays the same.
+
+Usage: `python -m app.mqtt.ingest_worker --workers 4`
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+
+from app.config import get_settings
+from app.mqtt.init_mqtt import configure_worker, start_mqtt, stop_mqtt
+from app.services.data_access.mongodb.mongodb_connection import close_db_client, init_connection_string, init_db_client
+from app.services.flight_heartbeat import flight_heartbeat
+
+
+async def worker_main(index: int, count: int):
+
+    init_connection_string()
+    await init_db_client()
+
+    configure_worker(index, count)
+
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for s in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(s, stop.set)
+
+    print(f'Ingest worker {index + 1}/{count} starting')
+
+    try:
+        start_mqtt(None, get_settings().mqtt_endpoint) # type: ignore
+        flight_heartbeat.start()
+        await stop.wait()
+    finally:
+        await stop_mqtt()
+        await flight_heartbeat.stop()
+        close_db_client()
+
+def run_worker(index: int, count: int):
+    asyncio.run(worker_main(index, count))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Runs the mqtt ingest in separate worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--worker-index', type=int, default=None, help='Only run the worker with this index (e.g. one container per worker)')
+    args = parser.parse_args()
+
+    if args.worker_index is not None:
+        run_worker(args.worker_index, args.workers)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, args=(i, args.workers), name=f'ingest-worker-{i}') for i in range(args.workers)]
+
+    for w in workers:
+        w.start()
+
+    def terminate(signum, frame):
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        # The workers received the interrupt as well and shut down on their own
+        for w in workers:
+            w.join()
+
+if __name__ == '__main__':
+    main()
@@ -1,126 +1,389 @@
 import asyncio
+import os
+import socket
 import threading
-from time import sleep
+import zlib
+from time import monotonic
 from fastapi import FastAPI
 import paho.mqtt.client as mqtt
 
+from app.config import get_settings
 from app.mqtt.measurments import MeasurmentProcessor
+from app.mqtt.write_ahead_log import WriteAheadLog
 from app.services.auth.jwt_auth_service import get_self_access_token
 
-MAX_PACKETS = 2000
+MISC_INTERVAL = 1 # Interval of the mqtt housekeeping (keep alive pings, retries)
 RETRY_DELAY = 5 # Retry delay on failed connection
+READING_PAUSE_SHARE = 0.5 # Share of the keepalive reads can stay paused by backpressure at once
 
-packet_received = False
 mqtt_stop_token = False
-mqtt_thread: threading.Thread | None = None
+mqtt_task: asyncio.Task | None = None
+mqtt_client: mqtt.Client | None = None
 
-flight_data_measurement_processor = MeasurmentProcessor('flight_data', False)
-commands_measurement_processor = MeasurmentProcessor('commands', True)
+def create_processor(table: str, is_commands: bool):
+    settings = get_settings()
+    return MeasurmentProcessor(
+        table,
+        is_commands,
+        max_queued_batches=settings.ingest_queue_max_batches,
+        max_queued_bytes=settings.ingest_queue_max_bytes,
+        ingest_policy=settings.ingest_queue_policy,
+        spill_path=settings.ingest_spill_path,
+        compress_measurements=settings.flight_data_compression
+    )
+
+flight_data_measurement_processor = create_processor('flight_data', False)
+commands_measurement_processor = create_processor('commands', True)
+
+processors = [flight_data_measurement_processor, commands_measurement_processor]
+
+def create_write_ahead_log():
+    settings = get_settings()
+
+    if not settings.wal_enabled:
+        return None
+
+    return WriteAheadLog(settings.wal_path, settings.wal_segment_bytes, settings.wal_commit_interval_ms/1000)
+
+write_ahead_log = create_write_ahead_log()
+
+shard: tuple[int, int] | None = None
+"""(index, count) of this ingest worker, None if all packets are processed in this process"""
+
+def configure_worker(index: int, count: int):
+    """
+    Configures this process as one of `count` ingest workers. Every worker needs its own
+    spill and write ahead log directories as the files are replayed on startup
+    """
+
+    global shard
+
+    shard = (index, count)
+
+    settings = get_settings()
+    worker_dir = f'worker-{index}'
+
+    for p in processors:
+        p.ingest_queue.spill_path = os.path.join(settings.ingest_spill_path, worker_dir, p.table)
+
+    if write_ahead_log is not None:
+        write_ahead_log.path = os.path.join(settings.wal_path, worker_dir)
+
+def is_own_flight(flight_uuid: str):
+    """With flight hash sharding each worker only processes the flights that hash to its index"""
+
+    if shard is None or get_settings().ingest_shard_strategy != 'flight_hash':
+        return True
+
+    return zlib.crc32(flight_uuid.encode()) % shard[1] == shard[0]
 
 
 """
-### MQTT thread:
+### MQTT loop:
+
+The mqtt client runs on the same asyncio loop as the api. Instead of polling, the client
+socket is registered with the loop (`add_reader`/`add_writer`), so packets are read as
+soon as they arrive and writes happen when the socket is ready. The measurement processors
+flush their buffers into a bounded ingest queue (see `IngestQueue`) that is written by a
+fixed number of workers on the same loop.
 
-The mqtt client is running on a seperate thread to not interfere with other server tasks
-The mqtt loop repeatatly checks if the stop token has been set to true, if so it stops
-the mqtt loop.
+If the queue is full and the policy is `block`, the client socket is removed from the loop
+until the queue has room again. The broker then has to hold on to the packets, which is
+the backpressure from the database to the vessels.
 
-This way either new mqtt measurements are received **or** mongodb tasks are exectued. This is
-useful as it creates back pressure, where if the mongodb tasks take long no new tasks are
-received either
+If the write ahead log is enabled, every packet is appended to it and only buffered once
+its group commit is on disk. Records of the log that are still on disk and not released at
+startup (i.e. the server crashed) are replayed into the processors before connecting to the
+broker.
+
+`stop_mqtt` disconnects the client and drains the buffers of all processors
 """
 
-def mqtt_main(host):
+class AsyncioMqttHelper:
+    """
+    Connects the socket callbacks of the paho client to the asyncio loop. Backpressure
+    pauses reading the socket, the housekeeping (`misc_loop`) keeps running. Paho
+    disconnects if the ping response isn't read within the keepalive, so reads paused for
+    `READING_PAUSE_SHARE` of the keepalive are resumed for one housekeeping interval
+    """
 
-    global mqtt_stop_token
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client) -> None:
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.client = client
+        self.misc_task: asyncio.Task | None = None
+        self.disconnected = loop.create_future()
+        self.sock = None
 
-    while not mqtt_stop_token:
+        self.reading_paused = False
+        """Whether backpressure asks to stop reading"""
 
-        try:
-            # Initialize the MQTT client
-            client = mqtt.Client()
+        self.reading = False
+        """Whether the socket is currently read"""
 
-            setup_callbacks(client)
+        self.paused_since: float | None = None
+        self.keepalive_reads = 0
 
-            client.username_pw_set('server', get_self_access_token())
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
 
-            client.connect(host)
+    def run_on_loop(self, f, *args):
+        """The client connects on an executor thread, all loop operations have to happen on the loop"""
 
-            asyncio.run(mqtt_asyncio_loop(client))
-        except Exception as e:
-            print(f'Mqtt failed: {e}. Retrying in {RETRY_DELAY}s')
-            sleep(RETRY_DELAY)
-    
-    print('Mqtt shutting down')
+        if threading.get_ident() == self.loop_thread:
+            f(*args)
+        else:
+            self.loop.call_soon_threadsafe(f, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048)
+        self.run_on_loop(self.register_socket, sock)
+
+    def register_socket(self, sock):
+        self.sock = sock
+        self.reading = False
+        self.paused_since = monotonic()
 
-async def mqtt_asyncio_loop(client: mqtt.Client):
+        self.set_reading(not self.reading_paused)
+
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def set_reading(self, reading: bool):
+        """Adds or removes the reader of the socket"""
+
+        if self.sock is None or reading == self.reading:
+            return
+
+        self.reading = reading
+        self.paused_since = None if reading else monotonic()
+
+        if reading:
+            self.loop.add_reader(self.sock, self.client.loop_read)
+        else:
+            self.loop.remove_reader(self.sock)
+
+    def set_reading_paused(self, paused: bool):
+        self.reading_paused = paused
+        self.set_reading(not paused)
+
+    def keep_alive_while_paused(self):
+        """Reads for one housekeeping interval once reads were paused for `READING_PAUSE_SHARE` of the keepalive"""
+
+        if not self.reading_paused:
+            return
+
+        if self.reading:
+            self.set_reading(False)
+        elif self.paused_since is not None and monotonic() - self.paused_since >= self.client.keepalive*READING_PAUSE_SHARE:
+            self.keepalive_reads += 1
+            self.set_reading(True)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.run_on_loop(self.unregister_socket, sock)
+
+    def unregister_socket(self, sock):
+        self.sock = None
+        self.reading = False
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+
+        if not self.disconnected.done():
+            self.disconnected.set_result(None)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.run_on_loop(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.run_on_loop(self.loop.remove_writer, sock)
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            self.keep_alive_while_paused()
+            await asyncio.sleep(MISC_INTERVAL)
+
+async def mqtt_main(host):
 
     global mqtt_stop_token
-    global packet_received
+    global mqtt_client
+
+    loop = asyncio.get_running_loop()
+
+    helper: AsyncioMqttHelper | None = None
+    paused_queues = set[str]()
+
+    def on_backpressure(name: str, paused: bool):
+
+        if paused:
+            paused_queues.add(name)
+        else:
+            paused_queues.discard(name)
 
-    while not mqtt_stop_token:
+        if helper is not None:
+            helper.set_reading_paused(len(paused_queues) > 0)
 
-        if not packet_received:
-            await asyncio.sleep(0.2)
+    for p in processors:
+        p.ingest_queue.on_backpressure = lambda paused, name=p.table: on_backpressure(name, paused)
 
-        packet_received = False
+        if write_ahead_log is not None:
+            p.ingest_queue.on_batch_done = lambda batch: write_ahead_log.release(batch.wal_records) # type: ignore
+            p.ingest_queue.load_leftovers = False
 
-        client.loop_read(MAX_PACKETS)
-        client.loop_write()
-        client.loop_misc()
+        p.start()
 
+    if write_ahead_log is not None:
+        write_ahead_log.open()
+        replayed = write_ahead_log.replay(route_message)
+
+        if replayed > 0:
+            print(f'Replayed {replayed} packets from the write ahead log')
+
+        write_ahead_log.on_durable = route_message
+        write_ahead_log.start()
+
+    try:
+        while not mqtt_stop_token:
+
+            try:
+                # Initialize the MQTT client
+                client = mqtt.Client()
+
+                setup_callbacks(client)
+
+                helper = AsyncioMqttHelper(loop, client)
+                helper.reading_paused = len(paused_queues) > 0
+
+                client.username_pw_set('server', get_self_access_token())
+
+                mqtt_client = client
+
+                # Connecting blocks until the broker answers, so it happens off the loop
+                await loop.run_in_executor(None, client.connect, host)
+
+                await helper.disconnected
+            except Exception as e:
+                print(f'Mqtt failed: {e}. Retrying in {RETRY_DELAY}s')
+
+            mqtt_client = None
+
+            if not mqtt_stop_token:
+                await asyncio.sleep(RETRY_DELAY)
+    finally:
+        # Packets waiting for their group commit are passed on before the buffers are drained
+        if write_ahead_log is not None:
+            await write_ahead_log.stop()
+
+        # Make sure nothing that was received is left in the buffers
+        await asyncio.gather(*[p.stop() for p in processors])
+
+        if write_ahead_log is not None:
+            await write_ahead_log.close()
+
+    print('Mqtt shutting down')
 
 def start_mqtt(app: FastAPI, host):
 
-    global mqtt_thread
+    global mqtt_task
     global mqtt_stop_token
 
-    if mqtt_thread is not None:
-        mqtt_stop_token = True
-        mqtt_thread.join()
-        
+    if mqtt_task is not None:
+        mqtt_task.cancel()
+
     mqtt_stop_token = False
-    mqtt_thread = threading.Thread(None, mqtt_main, args=(host,))
-    mqtt_thread.start()
+    mqtt_task = asyncio.get_event_loop().create_task(mqtt_main(host))
 
-def stop_mqtt():
+async def stop_mqtt():
 
-    global mqtt_thread
+    global mqtt_task
     global mqtt_stop_token
 
     mqtt_stop_token = True
 
-    if mqtt_thread is not None:
-        mqtt_thread.join()
+    if mqtt_client is not None:
+        mqtt_client.disconnect()
 
-def on_message(client, userdata, msg: mqtt.MQTTMessage):
+    if mqtt_task is None:
+        return
 
-    global packet_received
+    # Interrupt waiting for a connection or the retry delay, the buffers are still drained
+    mqtt_task.cancel()
 
-    packet_received = True
+    try:
+        await mqtt_task
+    except asyncio.CancelledError:
+        pass
 
-    split_topic = msg.topic.split('/')
+    mqtt_task = None
+
+def get_processor(split_topic: list[str]) -> MeasurmentProcessor | None:
+
+    if len(split_topic) < 4 or not is_own_flight(split_topic[0]):
+        return None
 
     if split_topic[1] == 'm':
-        flight_data_measurement_processor.process_measurements(split_topic[0], split_topic[2], split_topic[3], msg.payload)
-        return
-    
+        return flight_data_measurement_processor
+
     if split_topic[1] == 'c':
-        commands_measurement_processor.process_measurements(split_topic[0], split_topic[2], split_topic[3], msg.payload)
+        return commands_measurement_processor
+
+    return None
+
+def route_message(topic: str, payload: bytes, wal_record: tuple[int, int] | None = None) -> bool:
+    """Passes the packet to the matching processor, returns False if the topic isn't a measurement topic"""
+
+    split_topic = topic.split('/')
+
+    processor = get_processor(split_topic)
+
+    if processor is None:
+        return False
+
+    processor.process_measurements(split_topic[0], split_topic[2], split_topic[3], payload, wal_record)
+    return True
+
+def on_message(client, userdata, msg: mqtt.MQTTMessage):
+
+    split_topic = msg.topic.split('/')
+
+    processor = get_processor(split_topic)
+
+    if processor is None:
+        if len(split_topic) < 2 or split_topic[1] not in ('m', 'c'):
+            print(f'{msg.topic}: {msg.payload}')
+        return
+
+    # Buffered once the group commit wrote it (see `WriteAheadLog.on_durable`)
+    if write_ahead_log is not None:
+        write_ahead_log.append(msg.topic, msg.payload)
         return
 
-    print(f'{msg.topic}: {msg.payload}')
+    processor.process_measurements(split_topic[0], split_topic[2], split_topic[3], msg.payload)
 
 # The callback for when the client receives a CONNACK response from the broker
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected to mqtt broker successfully!")
-        client.subscribe('#') # Subscribe to all topics
+        client.subscribe(get_subscriptions())
         return
     print('connection error')
     client.username_pw_set('server', get_self_access_token())
 
 
+def get_subscriptions() -> list[tuple[str, int]]:
+
+    settings = get_settings()
+
+    # Shared subscriptions let the broker distribute the packets between the workers
+    if shard is not None and settings.ingest_shard_strategy == 'shared_subscription':
+        group = settings.ingest_shared_subscription_group
+        return [(f'$share/{group}/+/m/#', 0), (f'$share/{group}/+/c/#', 0)]
+
+    return [('#', 0)] # Subscribe to all topics
+
 def on_disconnect(client, properties, reason_code):
     print(f'Disconnected from mqtt broker, code: {reason_code}')
 
@@ -130,3 +393,4 @@ def setup_callbacks(client: mqtt.Client):
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
+
@@ -3,35 +3,75 @@ import asyncio
 from datetime import datetime, timezone
 import struct
 import time
+import numpy as np
 from typing import Any, Collection, Tuple
 
-from app.helper.binary_format_encoder import decode_payload
-from app.models.flight import FLIGHT_DEFAULT_HEAD_TIME, FLIGHT_MINIMUM_HEAD_TIME
+from app.helper.batch_decoder import DecodedBatch, decode_batch
+from app.helper.binary_format_encoder import PayloadCodec, get_codec
+from app.helper.measurement_encoding import encode_measurement_batch
+from app.helper.payload_batch import pack_payloads, summarize_payloads
+from app.mqtt.ingest_queue import MAX_QUEUED_BATCHES, MAX_QUEUED_BYTES, IngestPolicy, IngestQueue
 from uuid import UUID
 
-from app.models.flight_measurement import FlightMeasurementDB
-from app.services.data_access.flight import create_or_update_flight, get_flight
-from app.services.data_access.flight_data import insert_flight_data
+from app.services.data_access.flight_data import build_encoded_flight_data_document, build_flight_data_document, build_raw_flight_data_document, insert_flight_data_documents
+from app.services.data_access.flight_data_rollup import add_batch_buckets, add_document_buckets, add_measurement_buckets, create_rollup_levels
+from app.services.flight_heartbeat import flight_heartbeat
+from app.services.flight_schema_cache import flight_schema_cache
+from app.services.hot_window import hot_window
+from app.services.live_telemetry import live_telemetry
 
 
 CLEAR_INTERVAL = 0.5
+"""Maximum time measurements of a flight stay in the buffer before they are flushed"""
+
+MAX_BUFFERED_BYTES = 4*1024*1024
+"""A flight's buffer is flushed immediately once it holds this many bytes"""
+
+MAX_BUFFERED_PACKETS = 20_000
+"""A flight's buffer is flushed immediately once it holds this many packets"""
+
+MAX_CONCURRENT_FLUSHES = 8
+"""Number of workers of a processor that write buffers to the database at the same time"""
+
 FLOAT_SIZE = struct.calcsize('f')
 
 class MeasurmentProcessor:
 
-    def __init__(self, table: str, is_commands: bool) -> None:
+    def __init__(self, table: str, is_commands: bool, flush_interval: float = CLEAR_INTERVAL, max_buffered_bytes: int = MAX_BUFFERED_BYTES, max_buffered_packets: int = MAX_BUFFERED_PACKETS, max_concurrent_flushes: int = MAX_CONCURRENT_FLUSHES, max_queued_batches: int = MAX_QUEUED_BATCHES, max_queued_bytes: int = MAX_QUEUED_BYTES, ingest_policy: IngestPolicy = 'block', spill_path: str = 'ingest_spill', compress_measurements: bool = False) -> None:
 
         self.table = table
         self.is_commands = is_commands
+
+        self.flush_interval = flush_interval
+        self.max_buffered_bytes = max_buffered_bytes
+        self.max_buffered_packets = max_buffered_packets
+
+        self.compress_measurements = compress_measurements
+        """Whether fixed width batches are stored encoded (see `encode_measurement_batch`)"""
         
         self.measurement_buffers = dict[str, dict[str, dict[str, list[bytes]]]]()
+        self.buffered_bytes = dict[str, int]()
+        self.buffered_packets = dict[str, int]()
         self.last_cleared = dict[str, float]()
 
+        self.wal_records = dict[str, dict[int, list[int]]]()
+        """Write ahead log record indices per segment of the buffered packets of every flight"""
 
-    def process_measurements(self, flight_uuid: str, part: str, measurement_index: str, paylaod: bytes):
+        self.ingest_queue = IngestQueue(table, self.write_buffer, max_concurrent_flushes, max_queued_batches, max_queued_bytes, ingest_policy, spill_path)
+        """Flushed buffers waiting to be written to the database"""
+
+        self.scheduler: asyncio.Task | None = None
+
+
+    def process_measurements(self, flight_uuid: str, part: str, measurement_index: str, paylaod: bytes, wal_record: tuple[int, int] | None = None):
 
         if flight_uuid not in self.measurement_buffers:
             self.measurement_buffers[flight_uuid] = dict()
+            self.buffered_bytes[flight_uuid] = 0
+            self.buffered_packets[flight_uuid] = 0
+
+            if flight_uuid not in self.last_cleared:
+                self.last_cleared[flight_uuid] = time.time()
         
         vessel_buffer = self.measurement_buffers[flight_uuid]
 
@@ -45,42 +85,97 @@ class MeasurmentProcessor:
 
         part_buffer[measurement_index].append(paylaod)
 
-        if flight_uuid not in self.last_cleared:
-            self.last_cleared[flight_uuid] = time.time()
-            return
-        
-        time_since_last_cleared = (time.time() - self.last_cleared[flight_uuid])
-        
-        if time_since_last_cleared  < CLEAR_INTERVAL:
-            return
+        self.buffered_bytes[flight_uuid] += len(paylaod)
+        self.buffered_packets[flight_uuid] += 1
+
+        if wal_record is not None:
+            self.wal_records.setdefault(flight_uuid, dict()).setdefault(wal_record[0], list()).append(wal_record[1])
 
-        self.measurement_buffers[flight_uuid] = dict() # swap buffer first for subsequent measuremetns
+        if self.buffered_bytes[flight_uuid] >= self.max_buffered_bytes or self.buffered_packets[flight_uuid] >= self.max_buffered_packets:
+            self.flush(flight_uuid)
+
+    def flush(self, flight_uuid: str):
+        """Hands the current buffer of the flight over to be written to the database"""
+
+        vessel_buffer = self.measurement_buffers.pop(flight_uuid, None) # swap buffer first for subsequent measuremetns
+        size = self.buffered_bytes.pop(flight_uuid, 0)
+        self.buffered_packets.pop(flight_uuid, None)
+        wal_records = self.wal_records.pop(flight_uuid, None)
         self.last_cleared[flight_uuid] = time.time()
 
-        asyncio.get_event_loop().create_task(self.clear_measurement_buffer(flight_uuid, vessel_buffer))
+        if vessel_buffer is None:
+            return
+
+        self.ingest_queue.put(flight_uuid, vessel_buffer, size, wal_records)
+
+    async def write_buffer(self, flight_uuid: str, vessel_buffer: dict[str, dict[str, list[bytes]]]):
+        await self.clear_measurement_buffer(flight_uuid, vessel_buffer)
+
+    def flush_due(self):
+        """Flushes all flights whose buffer is older than the flush interval"""
+
+        now = time.time()
+
+        for flight_uuid in list(self.measurement_buffers):
+            if now - self.last_cleared[flight_uuid] >= self.flush_interval:
+                self.flush(flight_uuid)
+
+    async def run_flush_scheduler(self):
+
+        while True:
+            await asyncio.sleep(self.flush_interval/2)
+            self.flush_due()
+
+    def start(self):
+        """Starts the flush scheduler and the workers writing to the database"""
+
+        self.ingest_queue.start()
+        self.scheduler = asyncio.create_task(self.run_flush_scheduler())
+
+    async def stop(self):
+        """Writes everything that is still buffered and stops"""
+
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+            self.scheduler = None
+
+        await self.drain()
+        await self.ingest_queue.stop()
+
+    async def drain(self):
+        """Flushes all buffers and waits until everything was written"""
+
+        for flight_uuid in list(self.measurement_buffers):
+            self.flush(flight_uuid)
+
+        await self.ingest_queue.join()
 
-        # asyncio.create_task()
-        
     async def clear_measurement_buffer(self, flight_uuid: str, vessel_buffer: dict[str, dict[str, list[bytes]]]):
 
 
-        flight = await get_flight(UUID(flight_uuid))
+        flight = await flight_schema_cache.get(UUID(flight_uuid))
 
         if flight is None:
             print(f'invalid flight: {flight_uuid}')
             return
         
-        # In case the end of the flight is coming near extend it
-        if flight.end is not None and (flight.end.timestamp() - datetime.now(timezone.utc).timestamp()) < FLIGHT_MINIMUM_HEAD_TIME.total_seconds():
-            flight.end = datetime.now(timezone.utc) + FLIGHT_DEFAULT_HEAD_TIME
-            flight.end = flight.end.replace(tzinfo=timezone.utc)
-            await create_or_update_flight(flight)
+        # Keep the flight alive while it is sending data
+        flight_heartbeat.beat(flight.id)
         
-        # parsed = FlightMeasurementCompactSchema().load_list_safe(FlightMeasurementCompact, parsed_data)
+        preparation_start_time = time.time()
+
+        flight_id = UUID(flight_uuid)
+
+        documents = list()
 
-        # after_parse_time = time.time()
+        # Kept in the hot window only once they are in the database
+        hot_batches = list[tuple[int, int, DecodedBatch]]()
 
-        db_objects = list()
+        # Computed from the decoded rows, before they are encoded
+        rollups = create_rollup_levels()
+
+        # Measurements are decoded for live subscribers only if they are not decoded anyway
+        live = not self.is_commands and live_telemetry.has_subscribers(flight_id)
 
         for part_index, part_buffer in vessel_buffer.items():
 
@@ -91,38 +186,133 @@ class MeasurmentProcessor:
 
                 descriptor = descriptors[int(measurment_index)].payload_schema if self.is_commands else descriptors[int(measurment_index)].type # type: ignore
 
-                mesaurement_tuples = list[Tuple]()
-
-                start = 1e22
-                end = 0
-
-                for m in measurements:
-
-                    time, res = decode_payload(descriptor, m)  # type: ignore
-
-                    mesaurement_tuples.append((time, res))
-
-                    if time < start:
-                        start = time
-
-                    if time > end:
-                        end = time
-
-                agg = aggregate_measurements(descriptor, mesaurement_tuples) # type: ignore
-
-                db_object = FlightMeasurementDB(
-                    p_index=int(part_index),
-                    m_index=int(measurment_index),
-                    measurements=mesaurement_tuples,
-                    _start_time=datetime.fromtimestamp(start, tz=timezone.utc),
-                    _end_time=datetime.fromtimestamp(end, tz=timezone.utc),
-                    min = agg[0],
-                    avg = agg[1],
-                    max = agg[2],
-                )
-                db_objects.append(db_object)
-
-        await insert_flight_data(db_objects, UUID(flight_uuid), self.table)
+                codec = get_codec(descriptor)
+
+                batch = decode_batch(codec, measurements)
+
+                if flight.storage_mode == 'raw':
+                    document = build_raw_document(flight_id, int(part_index), int(measurment_index), descriptor, codec, measurements, batch)
+                    documents.append(document)
+
+                    if batch is not None:
+                        add_batch_buckets(rollups, flight_id, int(part_index), int(measurment_index), batch)
+                    else:
+                        add_document_buckets(rollups, document)
+
+                    # Raw batches are not decoded, so they can't be kept in the hot window
+                    hot_window.mark_uncovered(self.table, flight_id, int(part_index), int(measurment_index), document['_end_time'].timestamp())
+
+                    if live:
+                        live_telemetry.publish(flight, int(part_index), int(measurment_index), batch.to_tuples() if batch is not None else decode_measurements(codec, measurements)[0])
+
+                    continue
+
+                if batch is not None:
+                    hot_batches.append((int(part_index), int(measurment_index), batch))
+                    add_batch_buckets(rollups, flight_id, int(part_index), int(measurment_index), batch)
+
+                if batch is not None and self.compress_measurements:
+                    documents.append(build_encoded_flight_data_document(
+                        flight_id,
+                        int(part_index),
+                        int(measurment_index),
+                        encode_measurement_batch(batch),
+                        datetime.fromtimestamp(batch.start, tz=timezone.utc),
+                        datetime.fromtimestamp(batch.end, tz=timezone.utc),
+                        *batch.aggregate(),
+                        batch.get_tuple(0),
+                        batch.get_tuple(-1),
+                    ))
+
+                    if live:
+                        live_telemetry.publish(flight, int(part_index), int(measurment_index), batch.to_tuples())
+
+                    continue
+
+                if batch is not None:
+                    mesaurement_tuples = batch.to_tuples()
+                    start = batch.start
+                    end = batch.end
+                    agg = batch.aggregate()
+                else:
+                    mesaurement_tuples, start, end = decode_measurements(codec, measurements)
+                    agg = aggregate_measurements(descriptor, mesaurement_tuples) # type: ignore
+                    add_measurement_buckets(rollups, flight_id, int(part_index), int(measurment_index), mesaurement_tuples, agg[0] is not None)
+                    hot_window.mark_uncovered(self.table, flight_id, int(part_index), int(measurment_index), end)
+
+                documents.append(build_flight_data_document(
+                    flight_id,
+                    int(part_index),
+                    int(measurment_index),
+                    mesaurement_tuples,
+                    datetime.fromtimestamp(start, tz=timezone.utc),
+                    datetime.fromtimestamp(end, tz=timezone.utc),
+                    agg[0],
+                    agg[1],
+                    agg[2],
+                ))
+
+                if live:
+                    live_telemetry.publish(flight, int(part_index), int(measurment_index), mesaurement_tuples)
+
+        try:
+            await insert_flight_data_documents(documents, self.table, time.time() - preparation_start_time, rollups)
+        except Exception:
+            # Ranges of the series are read from the database, which is missing the batches
+            for p_index, m_index, batch in hot_batches:
+                hot_window.mark_uncovered(self.table, flight_id, p_index, m_index, batch.end)
+            raise
+
+        for p_index, m_index, batch in hot_batches:
+            hot_window.append(self.table, flight_id, p_index, m_index, batch)
+
+def build_raw_document(flight_id: UUID, p_index: int, m_index: int, descriptor: Any, codec: PayloadCodec, measurements: list[bytes], batch: DecodedBatch | None = None):
+    """Stores the payloads as received, only the bounds and aggregates are computed"""
+
+    start, end, agg, first, last = summarize_payloads(codec, measurements, batch)
+    payloads, payload_size, payload_sizes = pack_payloads(measurements)
+
+    return build_raw_flight_data_document(
+        flight_id,
+        p_index,
+        m_index,
+        descriptor,
+        payloads,
+        payload_size,
+        payload_sizes,
+        len(measurements),
+        datetime.fromtimestamp(start, tz=timezone.utc),
+        datetime.fromtimestamp(end, tz=timezone.utc),
+        agg[0],
+        agg[1],
+        agg[2],
+        first,
+        last,
+    )
+
+def decode_measurements(codec: PayloadCodec, measurements: list[bytes]):
+    """Decodes the packets one by one, used for shapes that are not fixed width"""
+
+    decode = codec.decode
+
+    mesaurement_tuples = list[Tuple]()
+
+    start = 1e22
+    end = 0
+
+    for m in measurements:
+
+        time, res = decode(m)
+
+        mesaurement_tuples.append((time, res))
+
+        if time < start:
+            start = time
+
+        if time > end:
+            end = time
+
+    return mesaurement_tuples, start, end
 
 def aggregate_measurements(descriptor: str | list[tuple[str, str]], tuples: list[tuple[float, Any]]):
 
@@ -133,24 +323,12 @@ def aggregate_measurements(descriptor: str | list[tuple[str, str]], tuples: list
         descriptor = descriptor.replace('!', '')
 
     # Default case: 
-    if len(descriptor) > 1:
+    if len(descriptor) > 1 or len(tuples) < 1:
         return (None, None, None)
     
-    is_bool = descriptor == '?'
-
-    min = 1e100
-    max = 0
-    avg = 0
-
-    for time, value in tuples:
-        v = (1 if value else 0) if is_bool else value
-        if v < min:
-            min = v
-        if v > max:
-            max = v
-        avg += v
+    values = np.fromiter((v for _, v in tuples), dtype=np.int8 if descriptor == '?' else np.float64, count=len(tuples))
 
-    return (min, avg/len(tuples), max)
+    return (values.min().item(), float(values.mean()), values.max().item())
 
 def can_aggregate(descriptor: str):
 
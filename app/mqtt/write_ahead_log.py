@@ -0,0 +1,430 @@
+import asyncio
+import os
+import struct
+from typing import Callable, Iterator
+import zlib
+import numpy as np
+
+RECORD_HEADER = struct.Struct('!IIH')
+"""Record header: payload length, crc32 of topic and payload, topic length"""
+
+WAL_SEGMENT_BYTES = 64*1024*1024
+WAL_COMMIT_INTERVAL = 0.02
+
+SEGMENT_SUFFIX = '.wal'
+RELEASED_SUFFIX = '.released'
+
+RELEASED_DTYPE = np.dtype('<u4')
+"""Released record indices are appended to the `.released` file of their segment as little endian uint32"""
+
+WalRecord = tuple[int, int]
+"""(segment, index of the record within the segment)"""
+
+
+class WriteAheadLog:
+    """
+    Append only log of the raw mqtt packets on local disk, so buffered measurements
+    survive a crash of the server.
+
+    Packets are appended to an in memory buffer and written to the current segment
+    file in groups every `commit_interval` seconds (group commit, one write and one
+    fsync per group). Only once a group is on disk its packets are passed on to
+    `on_durable`, so nothing is buffered that could be lost. Segments are rotated after
+    `segment_bytes`.
+
+    Every record is identified by its segment and index (`WalRecord`). Records written
+    to the database are released (see `release`), their indices are appended to the
+    `.released` file of the segment with the next group commit. Once all records of a
+    segment are released the segment is deleted, the current one is rotated first.
+    Segments still on disk at startup are replayed without their released records
+    (see `replay`). Releases of the last `commit_interval` before a crash can be lost,
+    those records are written again
+    """
+
+    def __init__(self, path: str, segment_bytes: int = WAL_SEGMENT_BYTES, commit_interval: float = WAL_COMMIT_INTERVAL) -> None:
+
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.commit_interval = commit_interval
+
+        self.segment_id = 0
+        self.segment_size = 0
+        self.segment_records = 0
+
+        self.on_durable: Callable[[str, bytes, WalRecord], object] | None = None
+        """Called with every packet once it is written to disk"""
+
+        self.pending = list[tuple[int, bytearray]]()
+        """Records not yet written to disk, grouped by segment"""
+
+        self.pending_packets = list[tuple[str, bytes, WalRecord]]()
+        """Packets of the pending records, passed on to `on_durable` after the commit"""
+
+        self.pending_releases = dict[int, list[int]]()
+        """Released record indices per segment not yet written to the `.released` files"""
+
+        self.unwritten = set[int]()
+        """Segments with records that are pending or currently being written"""
+
+        self.outstanding = dict[int, int]()
+        """Number of records per segment that are not in the database yet"""
+
+        self.file = None
+        self.file_segment = -1
+
+        self.commit_task: asyncio.Task | None = None
+        self.commit_lock = asyncio.Lock()
+
+        self.appended_records = 0
+        self.commits = 0
+        self.truncated_segments = 0
+
+    def segment_path(self, segment: int):
+        return os.path.join(self.path, f'{segment:020d}{SEGMENT_SUFFIX}')
+
+    def released_path(self, segment: int):
+        return os.path.join(self.path, f'{segment:020d}{RELEASED_SUFFIX}')
+
+    def existing_segments(self) -> list[int]:
+
+        if not os.path.isdir(self.path):
+            return list()
+
+        return sorted(int(f[:-len(SEGMENT_SUFFIX)]) for f in os.listdir(self.path) if f.endswith(SEGMENT_SUFFIX))
+
+    #region Writing
+
+    def open(self):
+
+        os.makedirs(self.path, exist_ok=True)
+
+        existing = self.existing_segments()
+
+        # Releases written while their segment was deleted
+        for f in os.listdir(self.path):
+            if f.endswith(RELEASED_SUFFIX) and int(f[:-len(RELEASED_SUFFIX)]) not in existing:
+                os.remove(os.path.join(self.path, f))
+
+        # Never append to a segment of a previous run, it might end with a torn record
+        self.segment_id = existing[-1] + 1 if len(existing) > 0 else 0
+        self.segment_size = 0
+        self.segment_records = 0
+
+    def rotate(self):
+        self.segment_id += 1
+        self.segment_size = 0
+        self.segment_records = 0
+
+    def append(self, topic: str, payload: bytes) -> WalRecord:
+        """Appends the packet, it is passed on to `on_durable` once it is written"""
+
+        encoded_topic = topic.encode()
+        crc = zlib.crc32(payload, zlib.crc32(encoded_topic))
+        record_size = RECORD_HEADER.size + len(encoded_topic) + len(payload)
+
+        if self.segment_size > 0 and self.segment_size + record_size > self.segment_bytes:
+            self.rotate()
+
+        if len(self.pending) < 1 or self.pending[-1][0] != self.segment_id:
+            self.pending.append((self.segment_id, bytearray()))
+            self.unwritten.add(self.segment_id)
+
+        chunk = self.pending[-1][1]
+        chunk += RECORD_HEADER.pack(len(payload), crc, len(encoded_topic))
+        chunk += encoded_topic
+        chunk += payload
+
+        record = (self.segment_id, self.segment_records)
+
+        self.segment_size += record_size
+        self.segment_records += 1
+        self.outstanding[self.segment_id] = self.outstanding.get(self.segment_id, 0) + 1
+        self.appended_records += 1
+
+        self.pending_packets.append((topic, payload, record))
+
+        return record
+
+    async def commit(self):
+        """
+        Writes and syncs all pending records and releases, then passes the packets on. If
+        writing fails the records that didn't make it to disk stay pending and are written
+        with the next commit
+        """
+
+        failure: Exception | None = None
+
+        async with self.commit_lock:
+
+            if len(self.pending) < 1 and len(self.pending_releases) < 1:
+                return
+
+            chunks, self.pending = self.pending, list()
+            packets, self.pending_packets = self.pending_packets, list()
+            releases, self.pending_releases = self.pending_releases, dict()
+
+            # Written chunks are removed from `remaining` by the writer thread
+            remaining = list(chunks)
+
+            try:
+                await asyncio.to_thread(self.write_chunks, remaining)
+                await asyncio.to_thread(self.write_releases, releases)
+            except Exception as e:
+                failure = e
+
+            failed_segments = {segment for segment, _ in remaining}
+
+            if failure is not None:
+                self.requeue(remaining, [p for p in packets if p[2][0] in failed_segments], releases)
+                packets = [p for p in packets if p[2][0] not in failed_segments]
+
+            for segment, _ in chunks:
+                if segment not in failed_segments and all(s != segment for s, _ in self.pending):
+                    self.unwritten.discard(segment)
+
+            if failure is None:
+                self.commits += 1
+
+        if self.on_durable is not None:
+            for topic, payload, record in packets:
+                self.on_durable(topic, payload, record)
+
+        self.truncate()
+
+        if failure is not None:
+            raise failure
+
+    def requeue(self, chunks: list[tuple[int, bytearray]], packets: list[tuple[str, bytes, WalRecord]], releases: dict[int, list[int]]):
+        """Puts what a failed commit didn't write in front of what was appended in the meantime"""
+
+        # Records appended meanwhile to the same segment continue its last chunk
+        if len(chunks) > 0 and len(self.pending) > 0 and chunks[-1][0] == self.pending[0][0]:
+            chunks[-1][1].extend(self.pending.pop(0)[1])
+
+        self.pending = chunks + self.pending
+        self.pending_packets = packets + self.pending_packets
+
+        # Releases that were already written are harmless to write again
+        for segment, indices in releases.items():
+            self.pending_releases.setdefault(segment, list()).extend(indices)
+
+    def write_chunks(self, chunks: list[tuple[int, bytearray]]):
+        """
+        Writes the chunks in order and removes them from `chunks` once they are synced. A
+        chunk that fails is cut off the segment again, so it isn't written twice by the retry
+        """
+
+        while len(chunks) > 0:
+
+            segment, data = chunks[0]
+
+            if self.file_segment != segment:
+                self.close_file()
+                self.file = open(self.segment_path(segment), 'ab')
+                self.file_segment = segment
+
+            assert self.file is not None
+            size = self.file.tell()
+
+            try:
+                self.file.write(data)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception:
+                self.close_file()
+                os.truncate(self.segment_path(segment), size)
+                raise
+
+            chunks.pop(0)
+
+    def write_releases(self, releases: dict[int, list[int]]):
+
+        for segment, indices in releases.items():
+
+            # Deleted in the meantime, all of its records are released
+            if not os.path.exists(self.segment_path(segment)):
+                continue
+
+            with open(self.released_path(segment), 'ab') as f:
+                f.write(np.asarray(indices, dtype=RELEASED_DTYPE).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close_file(self):
+
+        if self.file is not None:
+            self.file.close()
+
+        self.file = None
+        self.file_segment = -1
+
+    async def run_commits(self):
+
+        while True:
+            await asyncio.sleep(self.commit_interval)
+
+            try:
+                await self.commit()
+            except Exception as e:
+                print(f'Failed to write the write ahead log: {e}')
+
+    def start(self):
+        self.commit_task = asyncio.create_task(self.run_commits())
+
+    async def stop(self):
+        """Stops the group commits and passes on all packets received so far"""
+
+        if self.commit_task is not None:
+            self.commit_task.cancel()
+            self.commit_task = None
+
+        await self.commit()
+
+    async def close(self):
+        """Writes the remaining releases, called once the buffers are drained"""
+
+        await self.commit()
+
+        self.truncate()
+        self.close_file()
+
+    #endregion
+
+    #region Truncation
+
+    def release(self, records: dict[int, list[int]] | None):
+        """Marks records (indices by segment) as written to the database"""
+
+        if records is None:
+            return
+
+        for segment, indices in records.items():
+
+            if segment not in self.outstanding:
+                continue
+
+            self.outstanding[segment] -= len(indices)
+            self.pending_releases.setdefault(segment, list()).extend(indices)
+
+        self.truncate()
+
+    def truncate(self):
+        """Deletes all segments that are completely in the database"""
+
+        # The writer thread owns the file during a commit, the commit truncates once it is done
+        if self.commit_lock.locked():
+            return
+
+        for segment, count in list(self.outstanding.items()):
+
+            if count > 0 or segment in self.unwritten:
+                continue
+
+            # Later records go to a new segment, so the released one isn't replayed
+            if segment == self.segment_id:
+                self.rotate()
+
+            del self.outstanding[segment]
+            self.pending_releases.pop(segment, None)
+
+            if segment == self.file_segment:
+                self.close_file()
+
+            try:
+                os.remove(self.segment_path(segment))
+                self.truncated_segments += 1
+            except FileNotFoundError:
+                pass
+
+            try:
+                os.remove(self.released_path(segment))
+            except FileNotFoundError:
+                pass
+
+    #endregion
+
+    #region Replay
+
+    def read_released(self, segment: int) -> set[int]:
+        """Indices of the released records of a segment, a torn last index is ignored"""
+
+        try:
+            with open(self.released_path(segment), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return set()
+
+        data = data[:len(data) - len(data) % RELEASED_DTYPE.itemsize]
+
+        return set(np.frombuffer(data, dtype=RELEASED_DTYPE).tolist())
+
+    def read_segment(self, segment: int) -> Iterator[tuple[str, bytes]]:
+        """Reads the records of a segment, stops at the first incomplete or corrupt record"""
+
+        with open(self.segment_path(segment), 'rb') as f:
+            data = f.read()
+
+        offset = 0
+
+        while offset + RECORD_HEADER.size <= len(data):
+
+            payload_len, crc, topic_len = RECORD_HEADER.unpack_from(data, offset)
+            topic_start = offset + RECORD_HEADER.size
+            payload_start = topic_start + topic_len
+            end = payload_start + payload_len
+
+            if end > len(data):
+                return
+
+            topic = data[topic_start:payload_start]
+            payload = data[payload_start:end]
+
+            if zlib.crc32(payload, zlib.crc32(topic)) != crc:
+                return
+
+            yield topic.decode(), payload
+
+            offset = end
+
+    def replay(self, handle_record: Callable[[str, bytes, WalRecord], bool]) -> int:
+        """
+        Passes every record of the segments left from a previous run that was not
+        released to `handle_record` (topic, payload, record). The segments are deleted
+        like any other once all records handled are released. Returns the number of
+        records replayed
+        """
+
+        replayed = 0
+
+        for segment in self.existing_segments():
+
+            if segment >= self.segment_id:
+                continue
+
+            released = self.read_released(segment)
+            count = 0
+
+            for index, (topic, payload) in enumerate(self.read_segment(segment)):
+                if index not in released and handle_record(topic, payload, (segment, index)):
+                    count += 1
+
+            self.outstanding[segment] = self.outstanding.get(segment, 0) + count
+            replayed += count
+
+        self.truncate()
+
+        return replayed
+
+    #endregion
+
+    def get_metrics(self) -> dict[str, int]:
+        return {
+            'segment': self.segment_id,
+            'segments_on_disk': len(self.outstanding),
+            'outstanding_records': sum(self.outstanding.values()),
+            'pending_bytes': sum(len(c) for _, c in self.pending),
+            'pending_releases': sum(len(i) for i in self.pending_releases.values()),
+            'appended_records': self.appended_records,
+            'commits': self.commits,
+            'truncated_segments': self.truncated_segments,
+        }
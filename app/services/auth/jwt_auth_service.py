@@ -1,6 +1,8 @@
 import datetime
 from functools import lru_cache
 import cryptography
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
 import jwt
 import time
 
@@ -32,6 +34,12 @@ def get_public_key():
     
   return public_key
 
+@lru_cache
+def get_public_key_object() -> RSAPublicKey:
+  '''The parsed public key, so the pem is not parsed again for every verification'''
+
+  return load_pem_public_key(get_public_key().encode()) # type: ignore
+
 
 def generate_access_token(user: User, resources: list[tuple[str, str]]):
   payload = {
@@ -74,4 +82,4 @@ def validate_access_token(token: str):
 
   # token =  jwt.decode(token, get_public_key(), algorithms=['RS256'], issuer=ISSUER, options={"require": ["exp", "iss"]}, verify=False)
 
-  return jwt.decode(token, get_public_key(), algorithms=['RS256'], issuer=ISSUER, options={"require": ["exp", "iss"]}, verify=True)
\ No newline at end of file
+  return jwt.decode(token, get_public_key_object(), algorithms=['RS256'], issuer=ISSUER, options={"require": ["exp", "iss"]}, verify=True)
\ No newline at end of file
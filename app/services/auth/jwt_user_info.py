@@ -37,6 +37,12 @@ def set_socket_user_info(user: UserInfo, sid: str):
 
     socket_users[sid] = user
 
+def remove_socket_user_info(sid: str):
+
+    global socket_users
+
+    socket_users.pop(sid, None)
+
 def get_socket_user_info(sid: str) -> Union[UserInfo, None]:
     """
     Retrieves the user information from the global context if available
@@ -81,4 +81,4 @@ def modify_flight_permission(flight: Flight, permission: str, user_id: UUID):
     if permission == 'none':
         del flight.permissions[str(user_id)]
     else:
-        flight.permissions[str(user_id)] = permission
\ No newline at end of file
+        flight.permissions[str(user_id)] = permission
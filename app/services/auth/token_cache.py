@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+import time
+
+from app.config import get_settings
+from app.services.auth.jwt_auth_service import validate_access_token
+from app.services.auth.jwt_user_info import UserInfo, user_from_token
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of bearer tokens whose signature was already verified, so polling clients
+    don't run the RS256 verification on every request. Keyed by the sha256 digest of the
+    token, entries are only used until the `exp` of the token. Every worker process keeps
+    its own cache, the lock makes it safe for the dependencies run in the thread pool
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict[bytes, tuple[float, UserInfo]]()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verification_count = 0
+        self.verification_time = 0.0
+
+    def get(self, token: str) -> UserInfo:
+        """Returns the user of the token, raises the errors of `validate_access_token` if it is invalid"""
+
+        digest = sha256(token.encode()).digest()
+
+        with self.lock:
+            entry = self.entries.get(digest)
+
+            if entry is not None and time.time() < entry[0]:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+
+            self.entries.pop(digest, None)
+            self.misses += 1
+
+        start_time = time.perf_counter()
+
+        try:
+            decoded_token = validate_access_token(token)
+        finally:
+            self.record_verification(time.perf_counter() - start_time)
+
+        user = user_from_token(decoded_token)
+
+        with self.lock:
+            self.entries[digest] = (float(decoded_token['exp']), user)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return user
+
+    def record_verification(self, duration: float):
+        with self.lock:
+            self.verification_count += 1
+            self.verification_time += duration
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_metrics(self) -> dict[str, float]:
+
+        with self.lock:
+            requests = self.hits + self.misses
+
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/requests if requests > 0 else 0,
+                'verifications': self.verification_count,
+                'avg_verification_ms': 1000*self.verification_time/self.verification_count if self.verification_count > 0 else 0,
+            }
+
+verified_token_cache = VerifiedTokenCache(get_settings().auth_token_cache_size)
@@ -1,10 +1,17 @@
 from datetime import datetime
-from typing import Any, List, Literal, Sequence, cast
+from typing import Any, AsyncIterator, List, Literal, Sequence, cast
 from uuid import UUID
+from bson import Binary, ObjectId
 from motor.core import AgnosticCollection, AgnosticDatabase
 from pymongo import ASCENDING, DESCENDING
-from app.models.flight_measurement import FlightMeasurementAggregated, FlightMeasurementDB, FlightMeasurementSeriesIdentifier
+from pymongo.errors import OperationFailure
+import numpy as np
+from app.helper.batch_decoder import DecodedBatch, rows_to_tuples
+from app.helper.downsampling import DownsamplingMethod, downsample_indices, downsample_measurements
+from app.helper.measurement_encoding import get_stored_batch, get_stored_measurements
 from app.services.data_access.common.collection_managment import get_or_init_collection
+from app.services.data_access.flight_data_rollup import RollupLevels, bulk_delete_rollups_by_flight_ids, compute_rollup_buckets, get_or_init_rollup_collection, get_rollup_level, rollup_coverage, update_rollups
+from app.services.hot_window import hot_window, to_datetime
 from time import time
 
 #region Constants
@@ -13,45 +20,111 @@ epoch = datetime(1970, 1, 1)
 
 resolutions: Sequence[Literal['decisecond', 'second', 'minute', 'hour', 'day', 'month']] = ['decisecond', 'second', 'minute', 'hour', 'day', 'month']
 
-project_stage = { 
-    '$project': {
-        'dateParts': {
-            '$dateToParts': {
-                'date': '$_start_time'
-            }
-        }, 
-        'first': { '$arrayElemAt': [ "$measurements", 0 ] },
-        'last': { '$arrayElemAt': [ "$measurements", -1 ] },
-        'p_index': "$metadata.p_index",
-        'm_index': "$metadata.m_index",
-        'min': '$min',
-        'avg': '$avg',
-        'max': '$max',
-        '_start_time': '$_start_time',
-        '_end_time': '$_end_time'
+RESOLUTION_UNITS: dict[str, tuple[str, int]] = {
+    'decisecond': ('millisecond', 100),
+    'second': ('second', 1),
+    'minute': ('minute', 1),
+    'hour': ('hour', 1),
+    'day': ('day', 1),
+    'month': ('month', 1),
+    'year': ('year', 1),
+}
+"""`$dateTrunc` unit and bin size of every resolution"""
+
+SERIES_INDEX = [
+    ("metadata._flight_id", DESCENDING),
+    ("metadata.p_index", ASCENDING),
+    ("metadata.m_index", ASCENDING),
+    ("_start_time", ASCENDING),
+]
+"""
+Index of the flight data and rollup collections. Series are only identified by their
+indices within the flight, so queries for a whole flight, all measurements of a part or
+a single series all use a prefix of it, the time range then narrows the range scan
+"""
+
+LEGACY_SERIES_INDEX = [
+    ("metadata._flight_id", DESCENDING),
+    ("metadata.part_id", ASCENDING),
+    ("metadata.m_index", ASCENDING),
+]
+"""Former index on `metadata.part_id`, which was never written"""
+
+raw_accumulators = {
+    '_start_time': {'$min': '$_start_time'},
+    '_end_time': {'$max': '$_start_time'},
+    'min': {'$min': '$min'},
+    'max': {'$max': '$max'},
+    # Batches stored before the count and sum were recorded are derived from the average
+    'count': {'$sum': { '$ifNull': ['$count', { '$size': '$measurements' }] }},
+    'sum': {'$sum': { '$ifNull': ['$sum', { '$multiply': ['$avg', { '$size': '$measurements' }] }] }},
+    # Raw payload and encoded batches store their first and last measurement
+    'first': { '$first': { '$ifNull': ['$first', { '$arrayElemAt': [ "$measurements", 0 ] }] } },
+    'last': { '$last': { '$ifNull': ['$last', { '$arrayElemAt': [ "$measurements", -1 ] }] } },
+}
+"""Group accumulators over the raw flight data batches"""
+
+rollup_accumulators = {
+    '_start_time': {'$min': '$_start_time'},
+    '_end_time': {'$max': '$_start_time'},
+    'min': {'$min': '$min'},
+    'max': {'$max': '$max'},
+    'count': {'$sum': '$count'},
+    'sum': {'$sum': '$sum'},
+    'first': { '$first': '$first' },
+    'last': { '$last': '$last' },
+}
+"""Group accumulators over the rollup buckets"""
+
+RANGE_SORT = [('_start_time', ASCENDING), ('_id', ASCENDING)]
+"""Order of range queries, the id makes it stable for continuation tokens"""
+
+SERIES_SORT = [('metadata.p_index', ASCENDING), ('metadata.m_index', ASCENDING), ('_start_time', ASCENDING)]
+"""Order of series exports, follows the series index"""
+
+STREAM_BATCH_SIZE = 256
+"""Documents fetched from the database per round trip when streaming"""
+
+weighted_avg_stage = {
+    '$set': {
+        'avg': { '$cond': [{ '$eq': ['$min', None] }, None, { '$divide': ['$sum', '$count'] }] }
     }
 }
+"""Average of the grouped batches or buckets weighted by their number of samples"""
 
 #endregion
 
 #region Helper
 
-def get_date_grouping(resolution: str):
-    date_id = {
-        'year': '$dateParts.year', 
-        'month': '$dateParts.month', 
-        'day': '$dateParts.day', 
-        'hour': '$dateParts.hour', 
-        'minute': '$dateParts.minute', 
-        'second': '$dateParts.second',
-        'decisecond': { '$floor': { '$divide': ['$dateParts.millisecond', 100]}}
-    }
+def get_date_truncation(resolution: str):
+    unit, bin_size = RESOLUTION_UNITS[resolution]
+    return { '$dateTrunc': { 'date': '$_start_time', 'unit': unit, 'binSize': bin_size } }
+
+def get_series_match_stage(flight_id: UUID, part_index: int | None, measurement_index: int | None, start: datetime, end: datetime):
+    """Matches the series of a flight in the range, leaving out an index selects all parts or measurements"""
+
+    match: dict[str, Any] = { 'metadata._flight_id': {'$eq': flight_id} }
 
-    for r in resolutions:
-        if r == resolution:
-            return date_id
-        date_id.popitem()
-    return date_id
+    if part_index is not None:
+        match['metadata.p_index'] = {'$eq': part_index }
+
+    if measurement_index is not None:
+        match['metadata.m_index'] = {'$eq': measurement_index }
+
+    match['_start_time'] = { '$gte': start, '$lt': end }
+
+    return { '$match': match }
+
+def get_multi_series_match_stage(flight_id: UUID, series: list[tuple[int, int]], start: datetime, end: datetime):
+    """Matches a list of (part index, measurement index) series of a flight in the range"""
+
+    return {
+        '$match': {
+            'metadata._flight_id': {'$eq': flight_id},
+            '$or': [{ 'metadata.p_index': p_index, 'metadata.m_index': m_index } for p_index, m_index in series],
+            '_start_time': { '$gte': start, '$lt': end }
+        }
+    }
 
 def debsonify_measurements(measurements: list[dict]):
     for r in measurements:
@@ -71,138 +144,416 @@ async def get_or_init_flight_data_collection(table: str = 'flight_data') -> Agno
             'metaField': 'metadata',
             'granularity': 'seconds'
         }) # type: ignore
-        await collection.create_index([
-            ("metadata._flight_id", DESCENDING),
-            ("metadata.part_id", ASCENDING),
-            ("metadata.m_index", ASCENDING),
-        ])
+        await collection.create_index(SERIES_INDEX)
         return collection
 
     col = await get_or_init_collection(table, create_collection)
+
+    if table not in indexed_collections:
+        await migrate_series_index(col)
+        indexed_collections.add(table)
+
     return col
 
+indexed_collections = set[str]()
+"""Flight data collections whose index was checked since the start of the server"""
+
+async def migrate_series_index(collection: AgnosticCollection):
+    """Replaces the index of collections created before the series index was changed"""
+
+    await collection.create_index(SERIES_INDEX)
+
+    try:
+        await collection.drop_index(LEGACY_SERIES_INDEX)
+    except OperationFailure:
+        pass
+
 #endregion
 
-async def insert_flight_data(measurements: list[FlightMeasurementDB], flight_id: UUID, table: str = 'flight_data'):
+class InsertMetrics:
+    """Timings of the flight data inserts"""
+
+    def __init__(self) -> None:
+        self.batches = 0
+        self.documents = 0
+        self.preparation_time = 0.0
+        self.db_time = 0.0
+        self.last_preparation_time = 0.0
+        self.last_db_time = 0.0
+
+    def record(self, documents: int, preparation_time: float, db_time: float):
+        self.batches += 1
+        self.documents += documents
+        self.preparation_time += preparation_time
+        self.db_time += db_time
+        self.last_preparation_time = preparation_time
+        self.last_db_time = db_time
+
+    def get_metrics(self) -> dict[str, float | int]:
+        return {
+            'batches': self.batches,
+            'documents': self.documents,
+            'preparation_ms_total': int(self.preparation_time*1000),
+            'db_ms_total': int(self.db_time*1000),
+            'db_ms_avg': int(self.db_time*1000/self.batches) if self.batches > 0 else 0,
+            'last_preparation_ms': int(self.last_preparation_time*1000),
+            'last_db_ms': int(self.last_db_time*1000),
+        }
+
+insert_metrics = InsertMetrics()
+
+def build_flight_data_document(flight_id: UUID, p_index: int, m_index: int, measurements: list, start_time: datetime, end_time: datetime, min: Any, avg: Any, max: Any) -> dict:
+    """
+    Builds the document as it is stored in the flight data collection, without
+    going through `FlightMeasurementDB`. Meant for the ingest where the data was
+    just decoded and therefore only needs a cheap check of the layout
+    """
+
+    if not isinstance(p_index, int) or not isinstance(m_index, int):
+        raise ValueError(f'Invalid series index ({p_index}, {m_index})')
+
+    if not isinstance(start_time, datetime) or not isinstance(end_time, datetime):
+        raise ValueError('Start and end time have to be datetimes')
+
+    if not isinstance(measurements, list) or len(measurements) < 1 or not isinstance(measurements[0], tuple):
+        raise ValueError('Measurements have to be a non empty list of (time, value) tuples')
 
-    insert_start_time = time()
+    count = len(measurements)
+
+    return {
+        'measurements': measurements,
+        '_start_time': start_time,
+        '_end_time': end_time,
+        'min': min,
+        'avg': avg,
+        'max': max,
+        'count': count,
+        'sum': avg*count if avg is not None else None,
+        'metadata': {'_flight_id': flight_id, 'p_index': p_index, 'm_index': m_index}
+    }
+
+def build_encoded_flight_data_document(flight_id: UUID, p_index: int, m_index: int, encoding: dict, start_time: datetime, end_time: datetime, min: Any, avg: Any, max: Any, first: tuple, last: tuple) -> dict:
+    """
+    Builds a document that stores the measurements as an encoded batch (see
+    `encode_measurement_batch`) instead of an array of (time, value) pairs
+    """
+
+    if not isinstance(p_index, int) or not isinstance(m_index, int):
+        raise ValueError(f'Invalid series index ({p_index}, {m_index})')
+
+    count = encoding['count']
+
+    if count < 1:
+        raise ValueError('An encoded batch needs at least one measurement')
+
+    return {
+        'encoding': {**encoding, 'data': Binary(encoding['data'])},
+        '_start_time': start_time,
+        '_end_time': end_time,
+        'min': min,
+        'avg': avg,
+        'max': max,
+        'count': count,
+        'sum': avg*count if avg is not None else None,
+        'first': first,
+        'last': last,
+        'metadata': {'_flight_id': flight_id, 'p_index': p_index, 'm_index': m_index}
+    }
+
+def build_raw_flight_data_document(flight_id: UUID, p_index: int, m_index: int, shape: Any, payloads: bytes, payload_size: int | None, payload_sizes: bytes | None, count: int, start_time: datetime, end_time: datetime, min: Any, avg: Any, max: Any, first: tuple, last: tuple) -> dict:
+    """
+    Builds a document that stores the payloads of a batch as received (see `pack_payloads`).
+    The measurements are only decoded when they are read (see `get_stored_measurements`)
+    """
+
+    if not isinstance(p_index, int) or not isinstance(m_index, int):
+        raise ValueError(f'Invalid series index ({p_index}, {m_index})')
+
+    if count < 1:
+        raise ValueError('A raw batch needs at least one payload')
+
+    return {
+        'payloads': Binary(payloads),
+        'payload_size': payload_size,
+        'payload_sizes': Binary(payload_sizes) if payload_sizes is not None else None,
+        'shape': shape,
+        '_start_time': start_time,
+        '_end_time': end_time,
+        'min': min,
+        'avg': avg,
+        'max': max,
+        'count': count,
+        'sum': avg*count if avg is not None else None,
+        'first': first,
+        'last': last,
+        'metadata': {'_flight_id': flight_id, 'p_index': p_index, 'm_index': m_index}
+    }
+
+async def insert_flight_data_documents(documents: list[dict], table: str = 'flight_data', preparation_time: float = 0, rollups: RollupLevels | None = None):
+    """
+    Inserts documents created by `build_flight_data_document` and merges them into the rollups.
+    The ingest passes the `rollups` it computed from the decoded batches, otherwise they are
+    computed from the documents
+    """
+
+    if len(documents) < 1:
+        return
 
     collection = await get_or_init_flight_data_collection(table)
 
-    # Convert into a datetime object, because mongodb
-    # suddenly wants datetime objects instead of strings here
-    measurements_raw = [m.model_dump(by_alias=True) for m in measurements]
+    series = {(d['metadata']['_flight_id'], d['metadata']['p_index'], d['metadata']['m_index']) for d in documents}
 
-    for m in measurements_raw:
-        m['_start_time'] = m['_start_time']
-        m['metadata'] = {'_flight_id': flight_id, 'p_index': m['p_index'], 'm_index': m['m_index']}
-        del m['p_index']
-        del m['m_index']
+    # Before the insert, so there is no data of a series without coverage
+    await rollup_coverage.register(table, series)
 
     write_start_time = time()
 
-    res = await collection.insert_many(measurements_raw) # type: ignore
+    await collection.insert_many(documents) # type: ignore
+
+    insert_metrics.record(len(documents), preparation_time, time() - write_start_time)
+
+    try:
+        await update_rollups(rollups if rollups is not None else compute_rollup_buckets(documents), table)
+    except Exception as e:
+        await rollup_coverage.mark_incomplete(table, series, e)
+
+
+def get_range_query(flight_id: UUID, part_index: int, start: datetime, end: datetime, after: tuple[datetime, ObjectId] | None = None, measurement_index: int | None = None) -> dict:
+
+    query = get_series_match_stage(flight_id, part_index, measurement_index, start, end)['$match']
+
+    # Continue after the last document of the previous page
+    if after is not None:
+        after_time, after_id = after
+        query['$or'] = [{ '_start_time': { '$gt': after_time } }, { '_start_time': after_time, '_id': { '$gt': after_id } }]
+
+    return query
+
+def to_flight_data_output(d: dict) -> dict:
+    """Converts a stored document to the fields of `FlightMeasurementDB`"""
+
+    return {
+        'p_index': d['metadata']['p_index'],
+        'm_index': d['metadata']['m_index'],
+        'measurements': get_stored_measurements(d),
+        '_start_time': d['_start_time'],
+        '_end_time': d['_end_time'],
+        'min': d.get('min'),
+        'avg': d.get('avg'),
+        'max': d.get('max'),
+    }
 
-    after_write_time = time()
-    preparation_time = write_start_time - insert_start_time
-    db_time = after_write_time - write_start_time
+async def get_flight_data_documents_in_range(flight_id: UUID, part_index: int, start: datetime, end: datetime, table: str = 'flight_data', measurement_index: int | None = None) -> list[dict]:
+    """
+    The stored documents of a part in the range as plain dicts (fields of `FlightMeasurementDB`),
+    so responses skip the model validation. Ranges within the hot window are answered from memory
+    """
 
-    # current_app.logger.debug(f'Pushed {len(measurements)} compact measurements. Total: {int((preparation_time + db_time)*1000)}ms; Preparation {int((preparation_time)*1000)}ms; DB: {int((db_time)*1000)}ms;')
+    hot = hot_window.get_range(table, flight_id, part_index, start, end, measurement_index)
 
+    if hot is not None:
+        return hot
 
-async def get_flight_data_in_range(series_identifier: FlightMeasurementSeriesIdentifier, start: datetime, end: datetime, table: str = 'flight_data') -> list[FlightMeasurementDB]:
     collection = await get_or_init_flight_data_collection(table)
 
     # Get all measurements in the date range
-    res = await collection.find({'_start_time': { '$gte': start, '$lt': end }, 'metadata._flight_id': {'$eq': series_identifier.flight_id}, 'metadata.part_id': {'$eq': series_identifier.vessel_part_id}  }).to_list(1000)
+    res = await collection.find(get_range_query(flight_id, part_index, start, end, measurement_index=measurement_index)).sort(RANGE_SORT).to_list(None)
 
-    debsonify_measurements(res)
+    return [to_flight_data_output(r) for r in res]
 
-    for m in res:
-        del m['_id']
-        m['part_id'] = series_identifier.vessel_part_id
-        
-        if isinstance(m['_start_time'], datetime):
-            m['_start_time'] = m['_start_time'].isoformat()
-        if isinstance(m['_end_time'], datetime):
-            m['_end_time'] = m['_end_time'].isoformat()
+def get_downsampling_values(batch: DecodedBatch) -> np.ndarray | None:
+    """Values of the rows as float64, `None` if they are not single numbers"""
 
-        del m['metadata']
+    if not batch.single_value or batch.rows['value'].ndim > 1:
+        return None
 
-    return [FlightMeasurementDB(**r) for r in res]
+    return batch.rows['value'].astype(np.float64)
 
-async def get_aggregated_flight_data(flight_id: UUID, part_index: int | None, measurement_index: int | None, start: datetime, end: datetime, resolution: Literal['year', 'month', 'day', 'hour', 'minute', 'second', 'decisecond'], schemas: Any, table: str = 'flight_data') -> list[FlightMeasurementAggregated]:
+def downsample_batches(batches: list[DecodedBatch], max_points: int, method: DownsamplingMethod) -> dict | None:
+    """
+    Downsamples the decoded rows of a series, only the kept rows are converted to tuples.
+    `None` if the batches don't share one layout
+    """
 
-    match_stage = {
-        '$match': {
-            '_start_time': { '$gte': start, '$lt': end },
-            'metadata._flight_id': {'$eq': flight_id}
-        }
+    if any(b.rows.dtype != batches[0].rows.dtype or b.single_value != batches[0].single_value for b in batches):
+        return None
+
+    rows = np.concatenate([b.rows for b in batches])
+    rows = rows[np.argsort(rows['time'], kind='stable')]
+
+    batch = DecodedBatch(rows, batches[0].single_value)
+    indices = downsample_indices(rows['time'], get_downsampling_values(batch), max_points, method)
+    agg = batch.aggregate()
+
+    return {
+        'measurements': rows_to_tuples(rows[indices], batch.single_value),
+        '_start_time': to_datetime(batch.start),
+        '_end_time': to_datetime(batch.end),
+        'min': agg[0],
+        'avg': agg[1],
+        'max': agg[2],
     }
 
-    if part_index is not None:
-        match_stage['$match']['metadata.p_index'] = {'$eq': part_index }
+def downsample_documents(documents: list[dict], max_points: int, method: DownsamplingMethod) -> dict:
+    """Downsamples the (time, value) measurements of documents that can't be decoded into rows"""
 
-    if measurement_index is not None:
-        match_stage['$match']['metadata.m_index'] = {'$eq': measurement_index }
+    aggregated = [d for d in documents if d['min'] is not None and len(d['measurements']) > 0]
+    count = sum(len(d['measurements']) for d in aggregated)
+
+    return {
+        'measurements': downsample_measurements([m for d in documents for m in d['measurements']], max_points, method),
+        '_start_time': min(d['_start_time'] for d in documents),
+        '_end_time': max(d['_end_time'] for d in documents),
+        'min': min(d['min'] for d in aggregated) if count > 0 else None,
+        'avg': sum(d['avg']*len(d['measurements']) for d in aggregated)/count if count > 0 else None,
+        'max': max(d['max'] for d in aggregated) if count > 0 else None,
+    }
+
+async def get_downsampled_flight_data(flight_id: UUID, part_index: int, measurement_index: int, start: datetime, end: datetime, max_points: int, method: DownsamplingMethod = 'min_max', table: str = 'flight_data') -> list[dict]:
+    """
+    Reads a series in the range and reduces its samples to about `max_points` (see
+    `downsample_indices`). Returns a single document with the fields of
+    `FlightMeasurementDB`, min, avg and max are the ones of all samples. The samples are
+    downsampled as decoded rows (hot window, encoded and fixed width raw batches), only
+    documents storing (time, value) lists are read as tuples
+    """
+
+    hot = hot_window.get_covered_rows(table, flight_id, part_index, measurement_index, start, end)
+
+    if hot is not None:
+        documents = list[dict]()
+        batches: list[DecodedBatch | None] = [DecodedBatch(rows, ring.single_value) for _, _, ring, rows in hot]
+    else:
+        collection = await get_or_init_flight_data_collection(table)
+        documents = await collection.find(get_range_query(flight_id, part_index, start, end, measurement_index=measurement_index)).sort(RANGE_SORT).to_list(None)
+        batches = [get_stored_batch(d) for d in documents]
+
+    if len(batches) < 1:
+        return list()
+
+    downsampled = downsample_batches(cast(list[DecodedBatch], batches), max_points, method) if all(b is not None for b in batches) else None
+
+    if downsampled is None:
+        downsampled = downsample_documents([to_flight_data_output(d) for d in documents], max_points, method)
+
+    return [{'p_index': part_index, 'm_index': measurement_index, **downsampled}]
+
+async def stream_flight_data_in_range(flight_id: UUID, part_index: int, start: datetime, end: datetime, table: str = 'flight_data', batch_size: int = STREAM_BATCH_SIZE, limit: int | None = None, after: tuple[datetime, ObjectId] | None = None) -> AsyncIterator[dict]:
+    """
+    Iterates the stored documents of a part in the range sorted by their start time. The
+    cursor fetches `batch_size` documents at a time, so the range is never held in memory
+    as a whole. `after` is the (start time, id) of the last document already returned
+    """
+
+    async for d in stream_flight_data_documents(get_range_query(flight_id, part_index, start, end, after), RANGE_SORT, table, batch_size, limit):
+        yield d
+
+async def stream_flight_data_for_series(flight_id: UUID, series: list[tuple[int, int]], start: datetime, end: datetime, table: str = 'flight_data', batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[dict]:
+    """Iterates the stored documents of the series one series after another, in the order of the series index"""
+
+    if len(series) < 1:
+        return
+
+    async for d in stream_flight_data_documents(get_multi_series_match_stage(flight_id, series, start, end)['$match'], SERIES_SORT, table, batch_size):
+        yield d
+
+async def stream_flight_data_documents(query: dict, sort: list, table: str = 'flight_data', batch_size: int = STREAM_BATCH_SIZE, limit: int | None = None) -> AsyncIterator[dict]:
+
+    collection = await get_or_init_flight_data_collection(table)
+
+    cursor = collection.find(query).sort(sort).batch_size(batch_size)
+
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    async for d in cursor:
+        yield d
+
+async def get_aggregated_flight_data_documents(flight_id: UUID, part_index: int | None, measurement_index: int | None, start: datetime, end: datetime, resolution: str, table: str = 'flight_data') -> list[dict]:
+    """
+    The aggregated measurements as plain dicts (fields of `FlightMeasurementAggregated`), so
+    responses skip the model validation. Ranges within the hot window are aggregated in memory
+    """
+
+    hot = hot_window.get_aggregated(table, flight_id, part_index, measurement_index, start, end, resolution)
+
+    if hot is not None:
+        return hot
+
+    return await aggregate_flight_data(get_series_match_stage(flight_id, part_index, measurement_index, start, end), resolution, table)
+
+async def get_aggregated_flight_data_for_series(flight_id: UUID, series: list[tuple[int, int]], start: datetime, end: datetime, resolution: str, table: str = 'flight_data') -> list[dict]:
+    """Aggregates several (part index, measurement index) series of a flight in a single request"""
+
+    if len(series) < 1:
+        return list()
+
+    return await aggregate_flight_data(get_multi_series_match_stage(flight_id, series, start, end), resolution, table)
+
+async def aggregate_flight_data(match_stage: dict, resolution: str, table: str = 'flight_data') -> list[dict]:
+    """
+    Aggregates the matched flight data at the resolution. Reads the coarsest rollup that fits the
+    resolution and only aggregates the raw data if there is none (e.g. for deciseconds) or the
+    rollups don't contain all matched series completely (see `RollupCoverage`)
+    """
+
+    rollup_level = get_rollup_level(resolution)
+    flight_data = await get_or_init_flight_data_collection(table)
+
+    if rollup_level is not None and await rollup_coverage.is_covered(table, match_stage['$match'], flight_data):
+        return await aggregate_series(await get_or_init_rollup_collection(table, rollup_level), match_stage, resolution, rollup_accumulators)
+
+    return await aggregate_series(flight_data, match_stage, resolution, raw_accumulators)
+
+async def aggregate_series(collection: AgnosticCollection, match_stage: dict, resolution: str, accumulators: dict) -> list[dict]:
+    """
+    Groups the matched documents by series and time at the resolution. All series of the
+    match are aggregated in the same request, each group keeps its part and measurement index.
+    Returns the fields of `FlightMeasurementAggregated`
+    """
+
+    # Sorted so first and last of a group are the earliest and latest document
+    sort_stage = { '$sort': { '_start_time': 1 } }
 
     group_stage = {
         '$group': {
             '_id': {
-                'date': get_date_grouping(resolution),
-                'p_index': '$p_index',
-                'm_index': '$m_index'
+                'p_index': '$metadata.p_index',
+                'm_index': '$metadata.m_index',
+                'date': get_date_truncation(resolution)
             },
-            '_start_time': {'$min': '$_start_time'},
-            '_end_time': {'$max': '$_start_time'},
-            'min': {'$min': '$min'},
-            'avg': {'$avg': '$avg'},
-            'max': {'$max': '$max'},
-            'first': { '$first': '$first' },
-            'last': { '$last': '$last' },
+            **accumulators
         }
     }
 
+    pipeline = [match_stage, sort_stage, group_stage, weighted_avg_stage, { '$sort': { '_start_time': 1 } }]
 
-    # project_aggregated_stage = {
-    #     '$project': {
-    #         'measurements_aggregated': { 
-    #         },
-    #         '_start_time': '$_start_time',
-    #         '_end_time': '$_end_time'
-    #     }
-    # }
-
-    # project_aggregated_stage['$project']['measurements_aggregated'].update(get_aggregated_result_projection(schemas))
+    res = await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
 
-    collection = await get_or_init_flight_data_collection(table)
-
-    res = await collection.aggregate([match_stage, project_stage, group_stage]).to_list(1000)
-
-    # res = list(collection.aggregate(dummy))
-    
-    # debsonify_measurements(res)
-    
     for m in res:
         m['p_index'] = m['_id']['p_index']
         m['m_index'] = m['_id']['m_index']
-        m['_start_time'] = m['_start_time'].isoformat()
-        m['_end_time'] = m['_end_time'].isoformat()
+        m['measurements'] = []
         m['series_name'] = None
         m['part_id'] = None
         del m['_id']
-            
-    return [FlightMeasurementAggregated(**r) for r in res]
+        del m['sum']
+
+    return res
 
 async def bulk_delete_flight_data_by_flight_ids(_ids: List[UUID]) -> bool:
     flight_data_collection = await get_or_init_flight_data_collection("flight_data")
     results = await flight_data_collection.delete_many({'metadata._flight_id': {'$in': _ids}})
+    await bulk_delete_rollups_by_flight_ids(_ids, "flight_data")
+    hot_window.remove_flights(_ids, "flight_data")
     
     return results.deleted_count > 0
 
 async def bulk_delete_flight_commands_by_flight_ids(_ids: List[UUID]) -> bool:
     commands_collection = await get_or_init_flight_data_collection("commands")  
     results = await commands_collection.delete_many({'metadata._flight_id': {'$in': _ids}})
+    await bulk_delete_rollups_by_flight_ids(_ids, "commands")
+    hot_window.remove_flights(_ids, "commands")
 
     return results.deleted_count > 0
         
@@ -0,0 +1,593 @@
+import asyncio
+from datetime import datetime, timezone
+import math
+from time import monotonic
+from typing import Any, Callable, List
+from uuid import UUID
+from bson import ObjectId
+from motor.core import AgnosticCollection, AgnosticDatabase
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from app.helper.batch_decoder import DecodedBatch, decode_packed_batch, rows_to_tuples
+from app.helper.binary_format_encoder import TIME_STRUCT, get_codec
+from app.helper.measurement_encoding import decode_measurement_batch
+from app.helper.payload_batch import get_stored_shape, unpack_payloads
+from app.services.data_access.common.collection_managment import get_or_init_collection
+
+#region Constants
+
+ROLLUP_LEVELS: dict[str, int] = {'1s': 1, '10s': 10, '1min': 60}
+"""Bucket width in seconds of every rollup level, ordered from the finest to the coarsest"""
+
+RESOLUTION_SECONDS: dict[str, float] = {
+    'decisecond': 0.1,
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    'month': 86400,
+    'year': 86400,
+}
+"""Width of a resolution in seconds, months and years are aligned to days"""
+
+ROLLUP_BACKFILL_IDLE = 60
+"""Seconds without new data before the rollups of an incomplete series are rebuilt"""
+
+ROLLUP_BACKFILL_BATCH_SIZE = 256
+"""Flight data documents fetched per round trip when rebuilding rollups"""
+
+ROLLUP_COVERAGE_TTL = 10
+"""Seconds the incomplete series are used before they are loaded again, other processes can mark series incomplete"""
+
+COVERAGE_MIGRATION_ID = 'migration'
+"""`_id` of the coverage document recording whether series stored before the coverage was tracked were marked"""
+
+#endregion
+
+#region Helper
+
+def get_rollup_table(table: str, level: str):
+    return f'{table}_rollup_{level}'
+
+def get_coverage_table(table: str):
+    return f'{table}_rollup_coverage'
+
+def get_series_filter(flight_id: UUID, p_index: int, m_index: int) -> dict:
+    return {'metadata._flight_id': flight_id, 'metadata.p_index': p_index, 'metadata.m_index': m_index}
+
+def get_rollup_level(resolution: str) -> str | None:
+    """Returns the coarsest rollup level whose buckets fit evenly into the resolution"""
+
+    width = RESOLUTION_SECONDS.get(resolution)
+
+    if width is None:
+        return None
+
+    best = None
+
+    for level, level_width in ROLLUP_LEVELS.items():
+        if width >= level_width and width % level_width == 0:
+            best = level
+
+    return best
+
+#endregion
+
+#region Collection management
+
+async def get_or_init_rollup_collection(table: str, level: str) -> AgnosticCollection:
+
+    async def create_collection(db: AgnosticDatabase, n: str):
+        collection = await db.create_collection(n) # type: ignore
+        await collection.create_index([
+            ("metadata._flight_id", DESCENDING),
+            ("metadata.p_index", ASCENDING),
+            ("metadata.m_index", ASCENDING),
+            ("_start_time", ASCENDING),
+        ], unique=True)
+        return collection
+
+    return await get_or_init_collection(get_rollup_table(table, level), create_collection)
+
+async def get_or_init_coverage_collection(table: str) -> AgnosticCollection:
+
+    async def create_collection(db: AgnosticDatabase, n: str):
+        collection = await db.create_collection(n) # type: ignore
+        await collection.create_index([
+            ("metadata._flight_id", DESCENDING),
+            ("metadata.p_index", ASCENDING),
+            ("metadata.m_index", ASCENDING),
+        ], unique=True)
+        await collection.create_index([("complete", ASCENDING)])
+
+        # Series stored until now are marked in the background (see `RollupCoverage.migrate`)
+        await collection.insert_one({'_id': COVERAGE_MIGRATION_ID, 'done': False, 'before': ObjectId()})
+
+        return collection
+
+    return await get_or_init_collection(get_coverage_table(table), create_collection)
+
+#endregion
+
+#region Bucketing
+
+class RollupBucket:
+    """Aggregate of all measurements of a series within one bucket of a rollup level"""
+
+    def __init__(self, count: int, sum: Any, min: Any, max: Any, first: tuple, last: tuple) -> None:
+        self.count = count
+        self.numeric = sum is not None
+        self.sum = sum
+        self.min = min
+        self.max = max
+        self.first = first
+        self.last = last
+
+    def merge(self, other: 'RollupBucket'):
+
+        self.count += other.count
+
+        if self.numeric and other.numeric:
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+        if other.first[0] < self.first[0]:
+            self.first = other.first
+
+        if other.last[0] >= self.last[0]:
+            self.last = other.last
+
+SeriesBuckets = dict[tuple[UUID, int, int, int], RollupBucket]
+"""Buckets by (flight id, part index, measurement index, bucket start in seconds)"""
+
+RollupLevels = dict[str, SeriesBuckets]
+"""Buckets of every rollup level"""
+
+def create_rollup_levels() -> RollupLevels:
+    return {level: SeriesBuckets() for level in ROLLUP_LEVELS}
+
+def get_series_buckets(times: np.ndarray, values: np.ndarray | None, get_tuples: Callable[[np.ndarray], list], width: int) -> tuple[list[int], list[RollupBucket]]:
+    """
+    Buckets the samples of one series without iterating them in Python: the samples are
+    sorted by bucket and time, the bounds of every bucket are found with `np.diff` and the
+    aggregates are reduced with `ufunc.reduceat`. Only the first and last sample of every
+    bucket are converted to tuples (`get_tuples` with their indices). `values` is None for
+    series that are not single numbers, those buckets only count
+    """
+
+    starts = np.floor(times/width).astype(np.int64)*width
+    order = np.lexsort((times, starts))
+    sorted_starts = starts[order]
+
+    firsts = np.flatnonzero(np.diff(sorted_starts, prepend=sorted_starts[0] - 1))
+    lasts = np.append(firsts[1:], len(order)) - 1
+    counts = (lasts - firsts + 1).tolist()
+
+    first_tuples = get_tuples(order[firsts])
+    last_tuples = get_tuples(order[lasts])
+
+    if values is None:
+        aggregates = [(None, None, None)]*len(firsts)
+    else:
+        # Booleans are summed as integers
+        sorted_values = values[order].astype(np.int8) if values.dtype == np.bool_ else values[order]
+
+        aggregates = zip(
+            np.add.reduceat(sorted_values.astype(np.float64), firsts).tolist(),
+            np.minimum.reduceat(sorted_values, firsts).tolist(),
+            np.maximum.reduceat(sorted_values, firsts).tolist(),
+        )
+
+    return sorted_starts[firsts].tolist(), [RollupBucket(c, agg[0], agg[1], agg[2], f, l) for c, agg, f, l in zip(counts, aggregates, first_tuples, last_tuples)]
+
+def add_series_buckets(levels: RollupLevels, flight_id: UUID, p_index: int, m_index: int, times: np.ndarray, values: np.ndarray | None, get_tuples: Callable[[np.ndarray], list]):
+    """Merges the samples of a series into the buckets of all levels"""
+
+    if len(times) < 1:
+        return
+
+    for level, width in ROLLUP_LEVELS.items():
+
+        buckets = levels[level]
+
+        for start, bucket in zip(*get_series_buckets(times, values, get_tuples, width)):
+
+            key = (flight_id, p_index, m_index, start)
+            existing = buckets.get(key)
+
+            if existing is None:
+                buckets[key] = bucket
+            else:
+                existing.merge(bucket)
+
+def add_rows_buckets(levels: RollupLevels, flight_id: UUID, p_index: int, m_index: int, rows: np.ndarray, single_value: bool, numeric: bool = True):
+    """Adds the rows of a decoded batch (see `DecodedBatch`), only single numbers are aggregated"""
+
+    values = rows['value'] if numeric and single_value and rows['value'].ndim == 1 else None
+
+    add_series_buckets(levels, flight_id, p_index, m_index, rows['time'], values, lambda indices: rows_to_tuples(rows[indices], single_value))
+
+def add_batch_buckets(levels: RollupLevels, flight_id: UUID, p_index: int, m_index: int, batch: DecodedBatch):
+    add_rows_buckets(levels, flight_id, p_index, m_index, batch.rows, batch.single_value)
+
+def add_measurement_buckets(levels: RollupLevels, flight_id: UUID, p_index: int, m_index: int, measurements: list, numeric: bool):
+    """Adds (time, value) measurements of shapes that can't be decoded into rows"""
+
+    times = np.fromiter((m[0] for m in measurements), dtype=np.float64, count=len(measurements))
+    values = np.asarray([m[1] for m in measurements]) if numeric else None
+
+    add_series_buckets(levels, flight_id, p_index, m_index, times, values, lambda indices: [tuple(measurements[i]) for i in indices.tolist()])
+
+def add_document_buckets(levels: RollupLevels, d: dict):
+    """Adds a stored flight data document, encoded and raw payload batches are decoded into rows"""
+
+    metadata = d['metadata']
+    flight_id, p_index, m_index = metadata['_flight_id'], metadata['p_index'], metadata['m_index']
+
+    # Only series of single numbers are aggregated
+    numeric = d.get('min') is not None
+
+    if 'encoding' in d:
+        encoding = d['encoding']
+        add_rows_buckets(levels, flight_id, p_index, m_index, decode_measurement_batch(encoding), encoding['single_value'], numeric)
+        return
+
+    if 'payloads' in d:
+        codec = get_codec(get_stored_shape(d['shape']))
+        data = bytes(d['payloads'])
+        payload_size = d.get('payload_size')
+
+        batch = decode_packed_batch(codec, data, payload_size) if payload_size is not None else None
+
+        if batch is not None:
+            add_rows_buckets(levels, flight_id, p_index, m_index, batch.rows, batch.single_value, numeric)
+            return
+
+        # Payloads that are not fixed width are only decoded for the first and last of every bucket
+        payloads = unpack_payloads(data, payload_size, d.get('payload_sizes'))
+        times = np.fromiter((TIME_STRUCT.unpack_from(p, 0)[0] for p in payloads), dtype=np.float64, count=len(payloads))
+
+        add_series_buckets(levels, flight_id, p_index, m_index, times, None, lambda indices: [codec.decode(payloads[i]) for i in indices.tolist()])
+        return
+
+    add_measurement_buckets(levels, flight_id, p_index, m_index, d['measurements'], numeric)
+
+def compute_rollup_buckets(documents: list[dict]) -> RollupLevels:
+    """Computes the buckets of all rollup levels for flight data documents"""
+
+    levels = create_rollup_levels()
+
+    for d in documents:
+        add_document_buckets(levels, d)
+
+    return levels
+
+def get_rollup_update(key: tuple[UUID, int, int, int], bucket: RollupBucket) -> UpdateOne:
+    """Creates the upsert merging the bucket into the stored one"""
+
+    flight_id, p_index, m_index, bucket_start = key
+
+    merged: dict[str, Any] = {
+        'count': {'$add': [{'$ifNull': ['$count', 0]}, bucket.count]},
+        'first': {'$cond': [
+            {'$lt': [bucket.first[0], {'$ifNull': [{'$arrayElemAt': ['$first', 0]}, math.inf]}]},
+            {'$literal': list(bucket.first)},
+            '$first'
+        ]},
+        'last': {'$cond': [
+            {'$gte': [bucket.last[0], {'$ifNull': [{'$arrayElemAt': ['$last', 0]}, -math.inf]}]},
+            {'$literal': list(bucket.last)},
+            '$last'
+        ]},
+    }
+
+    if bucket.numeric:
+        merged['sum'] = {'$add': [{'$ifNull': ['$sum', 0]}, bucket.sum]}
+        merged['min'] = {'$min': ['$min', bucket.min]}
+        merged['max'] = {'$max': ['$max', bucket.max]}
+
+    pipeline: list[dict] = [{'$set': merged}]
+
+    if bucket.numeric:
+        pipeline.append({'$set': {'avg': {'$divide': ['$sum', '$count']}}})
+
+    return UpdateOne({
+        **get_series_filter(flight_id, p_index, m_index),
+        '_start_time': datetime.fromtimestamp(bucket_start, tz=timezone.utc),
+    }, pipeline, upsert=True)
+
+def get_rollup_document(key: tuple[UUID, int, int, int], bucket: RollupBucket) -> dict:
+    """The stored bucket, as the upserts of `get_rollup_update` leave it"""
+
+    flight_id, p_index, m_index, bucket_start = key
+
+    return {
+        'metadata': {'_flight_id': flight_id, 'p_index': p_index, 'm_index': m_index},
+        '_start_time': datetime.fromtimestamp(bucket_start, tz=timezone.utc),
+        'count': bucket.count,
+        'first': list(bucket.first),
+        'last': list(bucket.last),
+        **({'sum': bucket.sum, 'min': bucket.min, 'max': bucket.max, 'avg': bucket.sum/bucket.count} if bucket.numeric else {}),
+    }
+
+#endregion
+
+async def update_rollups(levels: RollupLevels, table: str = 'flight_data'):
+    """Merges the buckets of freshly inserted flight data documents into the rollup collections"""
+
+    for level, buckets in levels.items():
+
+        if len(buckets) < 1:
+            continue
+
+        collection = await get_or_init_rollup_collection(table, level)
+
+        await collection.bulk_write([get_rollup_update(k, b) for k, b in buckets.items()], ordered=False)
+
+async def bulk_delete_rollups_by_flight_ids(_ids: List[UUID], table: str = 'flight_data'):
+
+    for level in ROLLUP_LEVELS:
+        collection = await get_or_init_rollup_collection(table, level)
+        await collection.delete_many({'metadata._flight_id': {'$in': _ids}})
+
+    coverage = await get_or_init_coverage_collection(table)
+    await coverage.delete_many({'metadata._flight_id': {'$in': _ids}})
+
+    rollup_coverage.forget_flights(_ids, table)
+
+#region Coverage
+
+def matches_condition(condition: Any, value: Any) -> bool:
+    return (condition['$eq'] if isinstance(condition, dict) else condition) == value
+
+def series_matches(series: tuple[UUID, int, int], match: dict) -> bool:
+    """Whether a flight data `$match` (see `get_series_match_stage`) selects the series, ignoring the time range"""
+
+    flight_id, p_index, m_index = series
+
+    for field, value in (('metadata._flight_id', flight_id), ('metadata.p_index', p_index), ('metadata.m_index', m_index)):
+        if field in match and not matches_condition(match[field], value):
+            return False
+
+    if '$or' in match and not any(series_matches(series, m) for m in match['$or']):
+        return False
+
+    return True
+
+class RollupCoverage:
+    """
+    Tracks which series are completely contained in the rollups, aggregates are only read
+    from the rollups if all matched series are. Every series has a coverage document:
+
+    - series stored before the coverage was tracked are marked incomplete in the background
+      once the coverage collection exists (see `migrate`), until then no series is covered
+    - new series are registered as complete before their first batch is inserted
+    - a series is marked incomplete if merging a batch into the rollups failed
+
+    The incomplete series are kept in memory and loaded again after `ROLLUP_COVERAGE_TTL`,
+    as other processes can mark series incomplete. Incomplete series are rebuilt from the
+    flight data in the background once they received no data for `ROLLUP_BACKFILL_IDLE`
+    seconds (see `backfill`)
+    """
+
+    def __init__(self, ttl: float = ROLLUP_COVERAGE_TTL) -> None:
+
+        self.ttl = ttl
+
+        self.registered = set[tuple[str, UUID, int, int]]()
+        """(table, flight id, part index, measurement index) known to have a coverage document"""
+
+        self.incomplete = dict[str, set[tuple[UUID, int, int]]]()
+        """Incomplete series of every table"""
+
+        self.migrated = dict[str, bool]()
+        self.loaded = dict[str, float]()
+
+        self.backfilling = set[tuple[str, UUID, int, int]]()
+        self.migrating = set[str]()
+        self.tasks = set[asyncio.Task]()
+
+        self.write_failures = 0
+        self.unmarked_failures = 0
+        self.raw_fallbacks = 0
+        self.backfills = 0
+        self.backfill_failures = 0
+        self.migration_failures = 0
+        self.last_error: str | None = None
+
+    def start_task(self, coroutine):
+
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def register(self, table: str, series: set[tuple[UUID, int, int]]):
+        """Creates the coverage of series that were not seen before, called before their data is inserted"""
+
+        new = [s for s in series if (table, *s) not in self.registered]
+
+        if len(new) < 1:
+            return
+
+        coverage = await get_or_init_coverage_collection(table)
+
+        await coverage.bulk_write([UpdateOne(get_series_filter(*s), {'$setOnInsert': {'complete': True}}, upsert=True) for s in new], ordered=False)
+
+        self.registered.update((table, *s) for s in new)
+
+    async def mark_incomplete(self, table: str, series: set[tuple[UUID, int, int]], error: Exception):
+        """Records a failed rollup update, the series are aggregated from the flight data until they are rebuilt"""
+
+        self.write_failures += 1
+        self.last_error = f'{table}: {error}'
+
+        print(f'Failed to update the rollups of {table}, {len(series)} series are aggregated from the flight data until rebuilt: {error}')
+
+        if table in self.incomplete:
+            self.incomplete[table].update(series)
+
+        try:
+            coverage = await get_or_init_coverage_collection(table)
+            await coverage.bulk_write([UpdateOne(get_series_filter(*s), {'$set': {'complete': False}}, upsert=True) for s in series], ordered=False)
+        except Exception as e:
+            self.unmarked_failures += 1
+            print(f'Failed to mark the rollups of {table} as incomplete: {e}')
+
+    async def load(self, table: str, flight_data: AgnosticCollection):
+        """Loads the incomplete series of the table unless they were loaded within the ttl"""
+
+        loaded = self.loaded.get(table)
+
+        if loaded is not None and monotonic() - loaded < self.ttl:
+            return
+
+        coverage = await get_or_init_coverage_collection(table)
+
+        res = await coverage.find({'complete': False}).to_list(None)
+        migration = await coverage.find_one({'_id': COVERAGE_MIGRATION_ID})
+
+        self.incomplete[table] = {(r['metadata']['_flight_id'], r['metadata']['p_index'], r['metadata']['m_index']) for r in res}
+        self.migrated[table] = migration is not None and migration['done']
+        self.loaded[table] = monotonic()
+
+        if not self.migrated[table] and table not in self.migrating:
+            self.migrating.add(table)
+            self.start_task(self.run_migration(table, migration['before'] if migration is not None else ObjectId(), flight_data))
+
+    async def is_covered(self, table: str, match: dict, flight_data: AgnosticCollection) -> bool:
+        """Whether all matched series are in the rollups, schedules rebuilding the ones that are not"""
+
+        await self.load(table, flight_data)
+
+        incomplete = [s for s in self.incomplete[table] if series_matches(s, match)]
+
+        if self.migrated[table] and len(incomplete) < 1:
+            return True
+
+        self.raw_fallbacks += 1
+
+        for s in incomplete:
+            self.schedule_backfill(table, s, flight_data)
+
+        return False
+
+    async def run_migration(self, table: str, before: ObjectId, flight_data: AgnosticCollection):
+
+        try:
+            await self.migrate(table, before, flight_data)
+        except Exception as e:
+            self.migration_failures += 1
+            self.last_error = f'{table}: {e}'
+            print(f'Failed to mark the series of {table} stored before the rollup coverage: {e}')
+        finally:
+            self.migrating.discard(table)
+
+    async def migrate(self, table: str, before: ObjectId, flight_data: AgnosticCollection):
+        """
+        Marks the series with data stored before the coverage collection was created as
+        incomplete. Scans the whole flight data, so it runs in the background instead of
+        the ingest, until it is done aggregates are read from the flight data
+        """
+
+        existing = await flight_data.aggregate([
+            {'$match': {'_id': {'$lt': before}}},
+            {'$group': {'_id': {'f': '$metadata._flight_id', 'p': '$metadata.p_index', 'm': '$metadata.m_index'}}}
+        ], allowDiskUse=True).to_list(None)
+
+        coverage = await get_or_init_coverage_collection(table)
+
+        if len(existing) > 0:
+            await coverage.bulk_write([UpdateOne(
+                get_series_filter(e['_id']['f'], e['_id']['p'], e['_id']['m']),
+                {'$set': {'complete': False}},
+                upsert=True
+            ) for e in existing], ordered=False)
+
+        await coverage.update_one({'_id': COVERAGE_MIGRATION_ID}, {'$set': {'done': True}}, upsert=True)
+
+        # Picked up with the next read
+        self.loaded.pop(table, None)
+
+    def schedule_backfill(self, table: str, series: tuple[UUID, int, int], flight_data: AgnosticCollection):
+
+        key = (table, *series)
+
+        if key in self.backfilling:
+            return
+
+        self.backfilling.add(key)
+        self.start_task(self.run_backfill(table, series, flight_data))
+
+    async def run_backfill(self, table: str, series: tuple[UUID, int, int], flight_data: AgnosticCollection):
+
+        try:
+            if await self.backfill(table, series, flight_data):
+                self.backfills += 1
+                self.incomplete.get(table, set()).discard(series)
+        except Exception as e:
+            self.backfill_failures += 1
+            self.last_error = f'{table}: {e}'
+            print(f'Failed to rebuild the rollups of {table} for {series}: {e}')
+        finally:
+            self.backfilling.discard((table, *series))
+
+    async def backfill(self, table: str, series: tuple[UUID, int, int], flight_data: AgnosticCollection) -> bool:
+        """
+        Rebuilds the rollups of a series from its flight data and marks it complete. Series that
+        received data within `ROLLUP_BACKFILL_IDLE` seconds are left for later, as batches merged
+        while the rollups are rebuilt could be counted twice. Returns whether it was rebuilt
+        """
+
+        series_filter = get_series_filter(*series)
+
+        latest = await flight_data.find_one(series_filter, sort=[('_start_time', DESCENDING)])
+
+        if latest is not None and (datetime.now(timezone.utc) - latest['_id'].generation_time).total_seconds() < ROLLUP_BACKFILL_IDLE:
+            return False
+
+        levels = create_rollup_levels()
+
+        async for d in flight_data.find(series_filter).batch_size(ROLLUP_BACKFILL_BATCH_SIZE):
+            add_document_buckets(levels, d)
+
+        for level, buckets in levels.items():
+
+            collection = await get_or_init_rollup_collection(table, level)
+
+            await collection.delete_many(series_filter)
+
+            if len(buckets) > 0:
+                await collection.insert_many([get_rollup_document(k, b) for k, b in buckets.items()])
+
+        coverage = await get_or_init_coverage_collection(table)
+        await coverage.update_one(series_filter, {'$set': {'complete': True}}, upsert=True)
+
+        return True
+
+    def forget_flights(self, flight_ids: List[UUID], table: str):
+
+        removed = set(flight_ids)
+
+        self.registered = {s for s in self.registered if s[0] != table or s[1] not in removed}
+
+        if table in self.incomplete:
+            self.incomplete[table] = {s for s in self.incomplete[table] if s[0] not in removed}
+
+    def get_metrics(self) -> dict[str, int | str | None]:
+        return {
+            'registered_series': len(self.registered),
+            'write_failures': self.write_failures,
+            'unmarked_failures': self.unmarked_failures,
+            'raw_fallbacks': self.raw_fallbacks,
+            'backfills': self.backfills,
+            'backfills_running': len(self.backfilling),
+            'backfill_failures': self.backfill_failures,
+            'migrations_running': len(self.migrating),
+            'migration_failures': self.migration_failures,
+            'last_error': self.last_error,
+        }
+
+rollup_coverage = RollupCoverage()
+
+#endregion
@@ -1,22 +1,143 @@
-from functools import lru_cache
+import asyncio
+from threading import Lock
 from fastapi import FastAPI
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
 
 from app.config import get_settings
 
+DATABASE_NAME = 'rocketry5'
+
 connection_string = None
 
 # Provide the mongodb atlas url to connect python to mongodb using pymongo
 full_connection_string = None
 
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool statistics of all mongo clients created by
+    this module. Used to size the pool through the health endpoint
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts_started = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkins = 0
+        self.pool_clears = 0
+
+    def _inc(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def pool_created(self, event): pass
+
+    def pool_ready(self, event): pass
+
+    def pool_cleared(self, event): self._inc('pool_clears')
+
+    def pool_closed(self, event): pass
+
+    def connection_created(self, event): self._inc('connections_created')
+
+    def connection_ready(self, event): pass
+
+    def connection_closed(self, event): self._inc('connections_closed')
+
+    def connection_check_out_started(self, event): self._inc('checkouts_started')
+
+    def connection_check_out_failed(self, event): self._inc('checkout_failures')
+
+    def connection_checked_out(self, event): self._inc('checkouts')
+
+    def connection_checked_in(self, event): self._inc('checkins')
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                'connections_open': self.connections_created - self.connections_closed,
+                'connections_created': self.connections_created,
+                'connections_closed': self.connections_closed,
+                'checked_out': self.checkouts - self.checkins,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                # Checkouts that started but neither succeeded nor failed yet are waiting for a free connection
+                'waiting': self.checkouts_started - self.checkouts - self.checkout_failures,
+                'pool_clears': self.pool_clears,
+            }
+
+pool_metrics = PoolMetricsListener()
+
+# Motor binds a client to the event loop it is first used on, so one
+# client is kept per running loop. In production this is a single client
+# that lives as long as the app (see init_db_client/close_db_client)
+clients = dict[asyncio.AbstractEventLoop, AsyncIOMotorClient]()
+clients_lock = Lock()
+
+def create_client() -> AsyncIOMotorClient:
+    settings = get_settings()
+    return AsyncIOMotorClient(
+        full_connection_string,
+        uuidRepresentation='standard',
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        event_listeners=[pool_metrics]
+    )
+
+def get_client() -> AsyncIOMotorClient:
+    """
+    Returns the shared mongo client of the current event loop, creating it
+    if this is the first time the loop accesses the database
+    """
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = asyncio.get_event_loop()
+
+    client = clients.get(loop)
+
+    if client is not None:
+        return client
+
+    with clients_lock:
+
+        # Clients of loops that don't exist anymore can't be used again
+        for closed_loop in [l for l in clients if l.is_closed()]:
+            clients.pop(closed_loop).close()
+
+        if loop not in clients:
+            clients[loop] = create_client()
+
+        return clients[loop]
+
 def get_db() -> AsyncIOMotorDatabase: # type: ignore
+    return get_client()[DATABASE_NAME]
 
-    # Case for when there is no global context available
-    # e.g. during setup
-    client = AsyncIOMotorClient(full_connection_string, uuidRepresentation='standard')
-    return client['rocketry5']
+def get_pool_metrics() -> dict[str, int]:
+    return {**pool_metrics.snapshot(), 'clients': len(clients)}
 
-def init_app(app: FastAPI):
+async def init_db_client():
+    """Creates the shared client for the app's event loop"""
+
+    get_client()
+
+def close_db_client():
+
+    with clients_lock:
+        for client in clients.values():
+            client.close()
+        clients.clear()
+
+def init_connection_string():
     global full_connection_string
     connection_string = get_settings().connection_string
     full_connection_string = f"{connection_string}/rocketDatabase1"
+
+def init_app(app: FastAPI):
+    init_connection_string()
@@ -1,6 +1,7 @@
 import json
 from typing import Union
 from uuid import UUID
+from blinker import NamedSignal, Namespace
 from motor.core import AgnosticCollection
 
 from app.models.vessel import Vessel, VesselHistoric, VesselHistoricKey
@@ -8,6 +9,17 @@ from app.services.data_access.flight import bulk_delete_flights_by_ids, get_all_
 from .mongodb.mongodb_connection import get_db
 import asyncio
 
+VESSEL_UPDATE = 'VESSEL_UPDATE'
+VESSEL_DELETE = 'VESSEL_DELETE'
+
+vessel_signals = Namespace()
+
+def get_vessel_update_signal() -> NamedSignal:
+    return vessel_signals.signal(VESSEL_UPDATE)
+
+def get_vessel_delete_signal() -> NamedSignal:
+    return vessel_signals.signal(VESSEL_DELETE)
+
 def get_vessel_collection() -> AgnosticCollection:
     db = get_db()
     return db['vessels']
@@ -21,6 +33,8 @@ async def update_vessel_without_version_change(vessel: Vessel):
 
     result = await vessel_collection.replace_one({'_id': vessel.id}, vessel.model_dump(by_alias=True), upsert = True) # type: ignore
 
+    get_vessel_update_signal().send(None, vessel = vessel) # type: ignore
+
 
 # Creates or updates the vessel and returns the value written to the database
 async def create_or_update_vessel(vessel: Vessel) -> Vessel:
@@ -60,6 +74,8 @@ async def create_or_update_vessel(vessel: Vessel) -> Vessel:
     # Update or create the current vessel
     result = await vessel_collection.replace_one({'_id': vessel.id}, vessel.model_dump(by_alias=True), upsert = True) # type: ignore
 
+    get_vessel_update_signal().send(None, vessel = vessel) # type: ignore
+
     return vessel
 
 # Get a list of all vessels
@@ -105,6 +121,8 @@ async def delete_vessel_by_id(_id:UUID) -> bool:
         delete_all_historic_vessels(_id),
         vessel_collection.delete_one({'_id': _id})
     )
+
+    get_vessel_delete_signal().send(None, vessel_id = _id) # type: ignore
    
     return results[1].deleted_count > 0
 
@@ -0,0 +1,97 @@
+from time import monotonic
+from uuid import UUID
+
+from app.models.flight import Flight
+from app.models.vessel import Vessel
+from app.services.data_access.flight import get_flight, get_flight_new_signal, get_flight_update_signal
+from app.services.data_access.vessel import get_vessel, get_vessel_delete_signal, get_vessel_update_signal
+
+FLIGHT_ACCESS_CACHE_TTL = 5
+"""Seconds a flight and its vessel are used to authorize requests before they are loaded again"""
+
+
+class FlightAccessCache:
+    """
+    In process cache of the flight and vessel needed to check the permissions of a request
+    on a flight. Polling clients read the same flight every few seconds, on a hit no
+    metadata is queried. Entries are dropped once a flight or vessel was written or deleted
+    (through the signals of `create_or_update_flight`, the vessel writes and deletes), and
+    expire after the ttl in case another process changed them
+    """
+
+    def __init__(self, ttl: float = FLIGHT_ACCESS_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self.entries = dict[UUID, tuple[float, Flight, Vessel]]()
+        self.hits = 0
+        self.misses = 0
+
+        self.generation = 0
+        """Incremented on every invalidation, loads that overlap one are not cached"""
+
+    async def get(self, flight_id: UUID) -> tuple[Flight | None, Vessel | None]:
+        """Returns the flight and its vessel, either is `None` if it doesn't exist"""
+
+        entry = self.entries.get(flight_id)
+
+        if entry is not None and monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1], entry[2]
+
+        self.misses += 1
+
+        generation = self.generation
+
+        flight = await get_flight(flight_id)
+
+        if flight is None:
+            self.entries.pop(flight_id, None)
+            return None, None
+
+        vessel = await get_vessel(flight.vessel_id)
+
+        if vessel is None:
+            self.entries.pop(flight_id, None)
+            return flight, None
+
+        # The flight or vessel might have been read before a write that invalidated them
+        if generation == self.generation:
+            self.entries[flight_id] = (monotonic(), flight, vessel)
+
+        return flight, vessel
+
+    def invalidate_flight(self, flight_id: UUID):
+        self.generation += 1
+        self.entries.pop(flight_id, None)
+
+    def invalidate_vessel(self, vessel_id: UUID):
+
+        self.generation += 1
+
+        for flight_id in [k for k, (_, _, vessel) in self.entries.items() if vessel.id == vessel_id]:
+            del self.entries[flight_id]
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_metrics(self) -> dict[str, int]:
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+flight_access_cache = FlightAccessCache()
+
+def on_flight_changed(sender, flight: Flight):
+    flight_access_cache.invalidate_flight(flight.id)
+
+def on_vessel_changed(sender, vessel: Vessel):
+    flight_access_cache.invalidate_vessel(vessel.id)
+
+def on_vessel_deleted(sender, vessel_id: UUID):
+    flight_access_cache.invalidate_vessel(vessel_id)
+
+get_flight_new_signal().connect(on_flight_changed)
+get_flight_update_signal().connect(on_flight_changed)
+get_vessel_update_signal().connect(on_vessel_changed)
+get_vessel_delete_signal().connect(on_vessel_deleted)
@@ -0,0 +1,313 @@
+from functools import lru_cache
+import io
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Literal
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.helper.batch_decoder import get_struct_fields
+from app.helper.measurement_encoding import get_stored_batch
+from app.helper.ndjson import json_default
+from app.models.flight import Flight
+from app.services.data_access.flight_data import get_stored_measurements
+
+ExportFormat = Literal['arrow', 'parquet']
+
+EXPORT_MEDIA_TYPES: dict[str, str] = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+EXPORT_FILE_EXTENSIONS: dict[str, str] = {
+    'arrow': 'arrows',
+    'parquet': 'parquet',
+}
+
+EXPORT_BATCH_ROWS = 64*1024
+"""Rows collected before a record batch (or parquet row group) is written"""
+
+#region Schema
+
+ValueExtractor = Callable[[list], pa.Array]
+"""Builds a column from the values of a stored batch"""
+
+ValueColumn = tuple[str, pa.DataType, ValueExtractor, str | None]
+"""Name suffix, type, extractor and the field of the decoded rows (see `DecodedBatch`) the column is read from"""
+
+class SeriesColumns:
+    """Columns of one measurement series and how they are filled from the stored values"""
+
+    def __init__(self, p_index: int, m_index: int, fields: list[pa.Field], extractors: list[ValueExtractor], row_fields: list[str | None]) -> None:
+        self.p_index = p_index
+        self.m_index = m_index
+        self.fields = fields
+        self.extractors = extractors
+
+        self.row_fields = row_fields
+        """Field of the decoded rows of every column, None if the column can't be read from rows"""
+
+def get_arrow_type(struct_type: str) -> pa.DataType:
+
+    # Python floats can't be converted to half floats
+    if struct_type.endswith('f2'):
+        return pa.float32()
+
+    return pa.from_numpy_dtype(np.dtype(struct_type).newbyteorder('='))
+
+def extract_single(data_type: pa.DataType) -> ValueExtractor:
+    return lambda values: pa.array(values, type=data_type)
+
+def extract_field(index: int, data_type: pa.DataType) -> ValueExtractor:
+    return lambda values: pa.array([v[index] for v in values], type=data_type)
+
+def extract_json(index: int | None = None) -> ValueExtractor:
+
+    if index is None:
+        return lambda values: pa.array([json.dumps(v, default=json_default) for v in values], type=pa.string())
+
+    return lambda values: pa.array([json.dumps(v[index], default=json_default) for v in values], type=pa.string())
+
+def get_value_columns(shape: str | list[tuple[str, str]]) -> list[ValueColumn]:
+    """
+    Derives the typed columns (see `ValueColumn`) of a measurement type. Fields without a
+    fixed arrow type (nested arrays, structs of structs) are exported as json
+    """
+
+    if isinstance(shape, str):
+
+        if shape.startswith('!'):
+            shape = shape[1:]
+
+        if shape == '[str]':
+            return [('', pa.string(), extract_single(pa.string()), None)]
+
+        if shape.startswith('['):
+            element_fields = get_struct_fields(shape[1:-1])
+
+            if element_fields is not None and len(element_fields) == 1:
+                data_type = pa.list_(get_arrow_type(element_fields[0]))
+                return [('', data_type, extract_single(data_type), 'value')]
+
+            return [('', pa.string(), extract_json(), None)]
+
+        fields = get_struct_fields(shape)
+
+        if fields is None:
+            return [('', pa.string(), extract_json(), None)]
+
+        if len(fields) == 1:
+            data_type = get_arrow_type(fields[0])
+            return [('', data_type, extract_single(data_type), 'value')]
+
+        return [(str(i), get_arrow_type(f), extract_field(i, get_arrow_type(f)), f'v{i}') for i, f in enumerate(fields)]
+
+    columns = list[ValueColumn]()
+
+    # Shapes with named fields are not decoded into rows
+    for i, (name, field_shape) in enumerate(shape):
+
+        fields = get_struct_fields(field_shape.lstrip('!')) if isinstance(field_shape, str) and not field_shape.startswith('[') else None
+
+        if fields is not None and len(fields) == 1:
+            columns.append((name, get_arrow_type(fields[0]), extract_field(i, get_arrow_type(fields[0])), None))
+        else:
+            columns.append((name, pa.string(), extract_json(i), None))
+
+    return columns
+
+def get_export_schema(flight: Flight, series: list[tuple[int, int]]) -> tuple[pa.Schema, dict[tuple[int, int], SeriesColumns]]:
+    """
+    Creates the schema of an export. Every series gets its own typed columns named
+    `<part id>.<series name>[.<field>]`, rows of other series leave them empty
+    """
+
+    fields = [
+        pa.field('time', pa.timestamp('us', tz='UTC'), nullable=False),
+        pa.field('part_id', pa.dictionary(pa.int32(), pa.string()), nullable=False),
+        pa.field('series_name', pa.dictionary(pa.int32(), pa.string()), nullable=False),
+    ]
+
+    series_columns = dict[tuple[int, int], SeriesColumns]()
+
+    for p_index, m_index in series:
+
+        part_id = flight.measured_part_ids[p_index]
+        descriptor = flight.measured_parts[part_id][m_index]
+
+        column_fields = list[pa.Field]()
+        extractors = list[ValueExtractor]()
+        row_fields = list[str | None]()
+
+        for suffix, data_type, extractor, row_field in get_value_columns(descriptor.type):
+            name = f'{part_id}.{descriptor.name}' + (f'.{suffix}' if suffix != '' else '')
+            column_fields.append(pa.field(name, data_type))
+            extractors.append(extractor)
+            row_fields.append(row_field)
+
+        series_columns[(p_index, m_index)] = SeriesColumns(p_index, m_index, column_fields, extractors, row_fields)
+        fields.extend(column_fields)
+
+    return pa.schema(fields), series_columns
+
+#endregion
+
+#region Writing
+
+class ChunkedSink(io.RawIOBase):
+    """Write target of the arrow writers, the written bytes are taken out after every batch"""
+
+    def __init__(self) -> None:
+        self.chunks = list[bytes]()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = list()
+        return data
+
+@lru_cache
+def get_numpy_dtype(data_type: pa.DataType) -> np.dtype:
+    """Native numpy type of a primitive arrow type (e.g. half floats are exported as float32)"""
+    return pa.array([], type=data_type).to_numpy(zero_copy_only=False).dtype
+
+def get_row_column(rows: np.ndarray, field: str, data_type: pa.DataType) -> pa.Array:
+    """Column of a field of the rows, only converted to the native byte order and type of the column"""
+
+    column = rows[field]
+
+    if pa.types.is_list(data_type):
+        count, size = column.shape
+        values = np.ascontiguousarray(column.reshape(-1), dtype=get_numpy_dtype(data_type.value_type))
+        return pa.ListArray.from_arrays(pa.array(np.arange(count + 1, dtype=np.int32)*size), pa.array(values, type=data_type.value_type))
+
+    return pa.array(np.ascontiguousarray(column, dtype=get_numpy_dtype(data_type)), type=data_type)
+
+def create_series_arrays(flight: Flight, columns: SeriesColumns, times: np.ndarray) -> dict[str, pa.Array]:
+
+    count = len(times)
+
+    part_id = flight.measured_part_ids[columns.p_index]
+    series_name = flight.measured_parts[part_id][columns.m_index].name
+
+    return {
+        'time': pa.array((times.astype(np.float64)*1_000_000).astype(np.int64), type=pa.timestamp('us', tz='UTC')),
+        'part_id': pa.DictionaryArray.from_arrays(pa.array(np.zeros(count, dtype=np.int32)), pa.array([part_id])),
+        'series_name': pa.DictionaryArray.from_arrays(pa.array(np.zeros(count, dtype=np.int32)), pa.array([series_name])),
+    }
+
+def to_record_batch(schema: pa.Schema, arrays: dict[str, pa.Array], count: int) -> pa.RecordBatch:
+    """The columns of all other series are null"""
+    return pa.record_batch([arrays[f.name] if f.name in arrays else pa.nulls(count, type=f.type) for f in schema], schema=schema)
+
+def create_rows_record_batch(schema: pa.Schema, flight: Flight, columns: SeriesColumns, rows: np.ndarray) -> pa.RecordBatch | None:
+    """Creates the rows of a decoded batch from its numpy columns, None if a column can't be read from the rows"""
+
+    names = rows.dtype.names or ()
+
+    if any(f is None or f not in names for f in columns.row_fields):
+        return None
+
+    arrays = create_series_arrays(flight, columns, rows['time'])
+
+    for field, row_field in zip(columns.fields, columns.row_fields):
+        arrays[field.name] = get_row_column(rows, row_field, field.type) # type: ignore
+
+    return to_record_batch(schema, arrays, len(rows))
+
+def create_record_batch(schema: pa.Schema, flight: Flight, columns: SeriesColumns, measurements: list) -> pa.RecordBatch:
+    """Creates the rows of a stored batch of (time, value) measurements"""
+
+    count = len(measurements)
+    times = np.fromiter((m[0] for m in measurements), dtype=np.float64, count=count)
+    values = [m[1] for m in measurements]
+
+    arrays = create_series_arrays(flight, columns, times)
+
+    for field, extractor in zip(columns.fields, columns.extractors):
+        arrays[field.name] = extractor(values)
+
+    return to_record_batch(schema, arrays, count)
+
+def create_document_record_batch(schema: pa.Schema, flight: Flight, columns: SeriesColumns, d: dict) -> pa.RecordBatch | None:
+    """Reads the batch from its decoded rows if possible, otherwise from its measurements"""
+
+    stored_batch = get_stored_batch(d)
+
+    if stored_batch is not None:
+        batch = create_rows_record_batch(schema, flight, columns, stored_batch.rows)
+
+        if batch is not None:
+            return batch
+
+    measurements = get_stored_measurements(d)
+
+    if len(measurements) < 1:
+        return None
+
+    return create_record_batch(schema, flight, columns, measurements)
+
+async def export_flight_data(flight: Flight, series: list[tuple[int, int]], documents: AsyncIterable[dict], format: ExportFormat) -> AsyncIterator[bytes]:
+    """
+    Writes the stored batches of the series as an arrow ipc stream or a parquet file.
+    Rows are written in batches of about `EXPORT_BATCH_ROWS`, the encoded bytes are
+    yielded after every batch
+    """
+
+    schema, series_columns = get_export_schema(flight, series)
+
+    sink = ChunkedSink()
+    writer: Any = pa.ipc.new_stream(sink, schema) if format == 'arrow' else pq.ParquetWriter(sink, schema)
+
+    pending = list[pa.RecordBatch]()
+    pending_rows = 0
+
+    def write_pending():
+        table = pa.Table.from_batches(pending, schema=schema).combine_chunks()
+
+        if format == 'arrow':
+            writer.write_table(table)
+        else:
+            writer.write_table(table, row_group_size=EXPORT_BATCH_ROWS)
+
+    async for d in documents:
+
+        columns = series_columns.get((d['metadata']['p_index'], d['metadata']['m_index']))
+
+        if columns is None:
+            continue
+
+        batch = create_document_record_batch(schema, flight, columns, d)
+
+        if batch is None:
+            continue
+
+        pending.append(batch)
+        pending_rows += batch.num_rows
+
+        if pending_rows >= EXPORT_BATCH_ROWS:
+            write_pending()
+            pending = list()
+            pending_rows = 0
+            yield sink.take()
+
+    if len(pending) > 0:
+        write_pending()
+
+    writer.close()
+
+    yield sink.take()
+
+#endregion
@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timezone
+from threading import Lock
+from time import time
+from uuid import UUID
+
+from pymongo import UpdateOne
+
+from app.models.flight import FLIGHT_DEFAULT_HEAD_TIME, FLIGHT_MINIMUM_HEAD_TIME
+from app.services.data_access.flight import get_flight_collection
+
+FLIGHT_HEARTBEAT_INTERVAL = 5
+"""Seconds between two writes of the end times of all active flights"""
+
+
+class FlightHeartbeat:
+    """
+    Keeps flights that still receive data alive. The ingest only records when it last
+    saw data for a flight, the end times of all active flights are then extended
+    periodically with a single bulk write. The `$max` update makes the write
+    independent of concurrent writers (e.g. the flight data and the commands ingest)
+    """
+
+    def __init__(self, interval: float = FLIGHT_HEARTBEAT_INTERVAL) -> None:
+        self.interval = interval
+        self.last_seen = dict[UUID, float]()
+        self.lock = Lock()
+        self.task: asyncio.Task | None = None
+        self.flushes = 0
+        self.extended = 0
+
+    def beat(self, flight_id: UUID, seen: float | None = None):
+        """Records that data for the flight was received. Safe to call from any thread"""
+
+        seen = seen or time()
+
+        with self.lock:
+            if self.last_seen.get(flight_id, 0) < seen:
+                self.last_seen[flight_id] = seen
+
+    async def flush(self):
+        """Extends the end of all flights seen since the last flush, if the write fails they are kept for the next one"""
+
+        with self.lock:
+            pending, self.last_seen = self.last_seen, dict()
+
+        if len(pending) < 1:
+            return
+
+        updates = list()
+
+        for flight_id, seen in pending.items():
+            seen_time = datetime.fromtimestamp(seen, tz=timezone.utc)
+
+            # Only extend flights with an end, that is about to be reached
+            updates.append(UpdateOne(
+                {'_id': flight_id, 'end': {'$ne': None, '$lt': seen_time + FLIGHT_MINIMUM_HEAD_TIME}},
+                {'$max': {'end': seen_time + FLIGHT_DEFAULT_HEAD_TIME}}
+            ))
+
+        try:
+            result = await get_flight_collection().bulk_write(updates, ordered=False)
+        except Exception:
+            # Kept for the next flush, unless the flight was seen again in the meantime
+            with self.lock:
+                for flight_id, seen in pending.items():
+                    if self.last_seen.get(flight_id, 0) < seen:
+                        self.last_seen[flight_id] = seen
+            raise
+
+        self.flushes += 1
+        self.extended += result.modified_count
+
+    async def try_flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f'Failed to extend flights: {e}')
+
+    async def run(self):
+
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.try_flush()
+
+    def start(self):
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        await self.try_flush()
+
+    def get_metrics(self) -> dict[str, int]:
+        return {
+            'pending': len(self.last_seen),
+            'flushes': self.flushes,
+            'extended': self.extended,
+        }
+
+flight_heartbeat = FlightHeartbeat()
@@ -0,0 +1,67 @@
+from time import monotonic
+from uuid import UUID
+
+from app.models.flight import Flight
+from app.services.data_access.flight import get_flight, get_flight_new_signal, get_flight_update_signal
+
+FLIGHT_SCHEMA_CACHE_TTL = 30
+"""Seconds a cached flight is used before it is loaded from the database again"""
+
+
+class FlightSchemaCache:
+    """
+    In process cache of flights for the ingest path. The ingest only needs the
+    measurement schema of a flight (`measured_part_ids`, `measured_parts`,
+    `available_commands`), which doesn't change after the flight was created.
+    Entries are replaced whenever the flight is written through
+    `create_or_update_flight` and expire after the ttl in case another process changed it
+    """
+
+    def __init__(self, ttl: float = FLIGHT_SCHEMA_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self.entries = dict[UUID, tuple[float, Flight]]()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, flight_id: UUID) -> Flight | None:
+
+        entry = self.entries.get(flight_id)
+
+        if entry is not None and monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+
+        flight = await get_flight(flight_id)
+
+        if flight is None:
+            self.entries.pop(flight_id, None)
+            return None
+
+        self.set(flight)
+        return flight
+
+    def set(self, flight: Flight):
+        self.entries[flight.id] = (monotonic(), flight)
+
+    def invalidate(self, flight_id: UUID):
+        self.entries.pop(flight_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_metrics(self) -> dict[str, int]:
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+flight_schema_cache = FlightSchemaCache()
+
+def on_flight_changed(sender, flight: Flight):
+    flight_schema_cache.set(flight)
+
+get_flight_new_signal().connect(on_flight_changed)
+get_flight_update_signal().connect(on_flight_changed)
@@ -4,6 +4,8 @@ from uuid import UUID
 
 from app.services.data_access.flight import bulk_delete_flights_by_ids
 from app.services.data_access.flight_data import bulk_delete_flight_commands_by_flight_ids, bulk_delete_flight_data_by_flight_ids
+from app.services.flight_access_cache import flight_access_cache
+from app.services.flight_schema_cache import flight_schema_cache
 
 
 class FlightService:
@@ -15,4 +17,8 @@ class FlightService:
             bulk_delete_flights_by_ids(_ids)
         )
 
+        for _id in _ids:
+            flight_schema_cache.invalidate(_id)
+            flight_access_cache.invalidate_flight(_id)
+
         return results[2]
\ No newline at end of file
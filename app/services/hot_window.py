@@ -0,0 +1,401 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import math
+from uuid import UUID
+import numpy as np
+
+from app.config import get_settings
+from app.helper.batch_decoder import DecodedBatch, rows_to_tuples
+
+"""
+### Hot window:
+
+The most recent decoded samples of every (flight, part, measurement) ingested by this
+process are kept in ring buffers, so reads of the last seconds of a live flight don't go
+to the database. A flight is covered from the first sample this process ingested for it,
+a series additionally only after the samples it dropped (window, capacity). Ranges that
+start before the coverage are read from the database
+"""
+
+INITIAL_SERIES_CAPACITY = 1024
+"""Rows a ring buffer starts with, it doubles while it is full and within the limits"""
+
+MAX_SERIES_BYTES = 16*1024*1024
+"""Limit of a single ring buffer, the oldest rows are overwritten beyond it"""
+
+DROP_SCAN_ROWS = 64
+"""Rows at the head of a ring checked at once for rows that left the window"""
+
+HOT_WINDOW_RESOLUTIONS: dict[str, int] = {
+    'decisecond': 100,
+    'second': 1000,
+    'minute': 60_000,
+    'hour': 3_600_000,
+    'day': 86_400_000,
+}
+"""Width in milliseconds of the resolutions that can be aggregated, months and years are left to the database"""
+
+def to_timestamp(dt: datetime) -> float:
+    """Dates without a timezone are UTC, like the dates of the database"""
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+
+    return dt.timestamp()
+
+def to_datetime(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+
+class SeriesRing:
+    """Ring buffer of the decoded rows of one series, rows are kept in the order they were received"""
+
+    def __init__(self, dtype: np.dtype, single_value: bool, capacity: int) -> None:
+        self.rows = np.empty(capacity, dtype=dtype)
+        self.single_value = single_value
+        self.start = 0
+        self.size = 0
+
+        self.newest = -math.inf
+
+        self.dropped_until = -math.inf
+        """Latest time of a dropped row, the ring only holds all rows after it"""
+
+    @property
+    def capacity(self) -> int:
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.rows.nbytes
+
+    def get_rows(self) -> np.ndarray:
+        """Returns a copy of the rows from oldest to newest"""
+
+        end = self.start + self.size
+
+        if end <= self.capacity:
+            return self.rows[self.start:end].copy()
+
+        return np.concatenate([self.rows[self.start:], self.rows[:end - self.capacity]])
+
+    def resize(self, capacity: int):
+
+        rows = self.get_rows()
+        self.rows = np.empty(capacity, dtype=self.rows.dtype)
+        self.rows[:len(rows)] = rows
+        self.start = 0
+
+    def drop_oldest(self, count: int):
+
+        if count < 1:
+            return
+
+        end = self.start + count
+
+        if end <= self.capacity:
+            dropped = self.rows['time'][self.start:end]
+        else:
+            dropped = np.concatenate([self.rows['time'][self.start:], self.rows['time'][:end - self.capacity]])
+
+        self.dropped_until = max(self.dropped_until, float(dropped.max()))
+        self.start = end % self.capacity
+        self.size -= count
+
+    def append(self, rows: np.ndarray, window: float):
+        """Appends the rows of a batch, overwrites the oldest rows if full and drops the rows older than the window"""
+
+        if len(rows) < 1:
+            return
+
+        if len(rows) > self.capacity:
+            self.dropped_until = max(self.dropped_until, float(rows['time'][:-self.capacity].max()))
+            rows = rows[-self.capacity:]
+
+        self.drop_oldest(self.size + len(rows) - self.capacity)
+
+        end = (self.start + self.size) % self.capacity
+        first = min(len(rows), self.capacity - end)
+
+        self.rows[end:end+first] = rows[:first]
+        self.rows[:len(rows)-first] = rows[first:]
+        self.size += len(rows)
+
+        self.newest = max(self.newest, float(rows['time'].max()))
+
+        self.drop_outdated(self.newest - window)
+
+    def drop_outdated(self, cutoff: float):
+        """
+        Drops the oldest received rows until one is at or after `cutoff`, late rows stay until
+        they are reached. Only the head of the ring is scanned, in growing chunks, so the
+        work is bounded by the rows that are dropped instead of the whole window
+        """
+
+        chunk = DROP_SCAN_ROWS
+
+        while self.size > 0:
+
+            # Up to the end of the buffer at most, the next chunk continues after the wrap
+            end = min(self.start + self.size, self.capacity, self.start + chunk)
+            kept = np.flatnonzero(self.rows['time'][self.start:end] >= cutoff)
+
+            if len(kept) > 0:
+                self.drop_oldest(int(kept[0]))
+                return
+
+            self.drop_oldest(end - self.start)
+            chunk *= 2
+
+class FlightWindow:
+
+    def __init__(self, covered_from: float) -> None:
+
+        self.covered_from = covered_from
+        """Time from which all samples of the flight went through this process"""
+
+        self.series = dict[tuple[int, int], SeriesRing]()
+
+        self.uncovered_until = dict[tuple[int, int], float]()
+        """Series that can't be kept in a ring buffer (not fixed width, raw storage), up to which time"""
+
+    @property
+    def nbytes(self) -> int:
+        return sum(r.nbytes for r in self.series.values())
+
+    def covers(self, p_index: int | None, m_index: int | None, start: float) -> bool:
+
+        if start < self.covered_from:
+            return False
+
+        for (p, m), ring in self.series.items():
+            if (p_index is None or p == p_index) and (m_index is None or m == m_index) and start <= ring.dropped_until:
+                return False
+
+        for (p, m), until in self.uncovered_until.items():
+            if (p_index is None or p == p_index) and (m_index is None or m == m_index) and start <= until:
+                return False
+
+        return True
+
+class HotWindow:
+    """
+    Ring buffers of the recent samples of all flights, see above. Flights are evicted
+    least recently written first once the buffers exceed `max_bytes`
+    """
+
+    def __init__(self, window: float, max_bytes: int) -> None:
+        self.window = window
+        self.max_bytes = max_bytes
+        self.flights = OrderedDict[tuple[str, UUID], FlightWindow]()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_bytes > 0
+
+    def get_flight_window(self, table: str, flight_id: UUID, start: float) -> FlightWindow:
+
+        key = (table, flight_id)
+        flight_window = self.flights.get(key)
+
+        if flight_window is None:
+            flight_window = FlightWindow(start)
+            self.flights[key] = flight_window
+        else:
+            self.flights.move_to_end(key)
+
+        return flight_window
+
+    def reserve(self, nbytes: int, keep: tuple[str, UUID]) -> bool:
+        """Evicts flights until `nbytes` more fit into the limit, returns whether they fit"""
+
+        for key in list(self.flights):
+
+            if self.nbytes + nbytes <= self.max_bytes:
+                break
+
+            if key != keep:
+                self.evict(key)
+
+        return self.nbytes + nbytes <= self.max_bytes
+
+    def evict(self, key: tuple[str, UUID]):
+
+        flight_window = self.flights.pop(key, None)
+
+        if flight_window is not None:
+            self.nbytes -= flight_window.nbytes
+
+    def append(self, table: str, flight_id: UUID, p_index: int, m_index: int, batch: DecodedBatch):
+        """Adds a decoded batch of a series"""
+
+        if not self.enabled:
+            return
+
+        key = (table, flight_id)
+        flight_window = self.get_flight_window(table, flight_id, batch.start)
+        ring = flight_window.series.get((p_index, m_index))
+
+        if ring is not None and ring.rows.dtype != batch.rows.dtype:
+            # The layout changed, nothing before this batch is kept
+            self.nbytes -= ring.nbytes
+            del flight_window.series[(p_index, m_index)]
+            flight_window.uncovered_until[(p_index, m_index)] = max(ring.newest, flight_window.uncovered_until.get((p_index, m_index), -math.inf))
+            ring = None
+
+        if ring is None:
+            capacity = max(INITIAL_SERIES_CAPACITY, 1 << (2*len(batch.rows) - 1).bit_length())
+            capacity = min(capacity, max(1, MAX_SERIES_BYTES // batch.rows.dtype.itemsize))
+
+            if not self.reserve(capacity*batch.rows.dtype.itemsize, key):
+                self.mark_uncovered(table, flight_id, p_index, m_index, batch.end)
+                return
+
+            ring = SeriesRing(batch.rows.dtype, batch.single_value, capacity)
+            flight_window.series[(p_index, m_index)] = ring
+            self.nbytes += ring.nbytes
+
+        # Grow instead of overwriting as long as the limits allow it
+        while ring.size + len(batch.rows) > ring.capacity and 2*ring.nbytes <= MAX_SERIES_BYTES and self.reserve(ring.nbytes, key):
+            self.nbytes += ring.nbytes
+            ring.resize(2*ring.capacity)
+
+        ring.append(batch.rows, self.window)
+
+    def mark_uncovered(self, table: str, flight_id: UUID, p_index: int, m_index: int, end: float):
+        """Records that samples of a series up to `end` are not kept, ranges of it before are read from the database"""
+
+        if not self.enabled:
+            return
+
+        flight_window = self.get_flight_window(table, flight_id, end)
+        flight_window.uncovered_until[(p_index, m_index)] = max(end, flight_window.uncovered_until.get((p_index, m_index), -math.inf))
+
+    def remove_flights(self, flight_ids: list[UUID], table: str):
+
+        for flight_id in flight_ids:
+            self.evict((table, flight_id))
+
+    def get_covered_rows(self, table: str, flight_id: UUID, p_index: int | None, m_index: int | None, start: datetime, end: datetime) -> list[tuple[int, int, SeriesRing, np.ndarray]] | None:
+        """Returns the rows in the range of every matching series, `None` if the range is not covered"""
+
+        flight_window = self.flights.get((table, flight_id))
+        start_time = to_timestamp(start)
+
+        if flight_window is None or not flight_window.covers(p_index, m_index, start_time):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        end_time = to_timestamp(end)
+        res = list()
+
+        for (p, m), ring in flight_window.series.items():
+
+            if (p_index is not None and p != p_index) or (m_index is not None and m != m_index):
+                continue
+
+            rows = ring.get_rows()
+            rows = rows[(rows['time'] >= start_time) & (rows['time'] < end_time)]
+
+            if len(rows) > 0:
+                res.append((p, m, ring, rows[np.argsort(rows['time'], kind='stable')]))
+
+        return res
+
+    def get_range(self, table: str, flight_id: UUID, p_index: int | None, start: datetime, end: datetime, m_index: int | None = None) -> list[dict] | None:
+        """
+        Returns the samples in the range as one document per series with the fields of
+        `FlightMeasurementDB`, `None` if the range is not covered
+        """
+
+        covered = self.get_covered_rows(table, flight_id, p_index, m_index, start, end)
+
+        if covered is None:
+            return None
+
+        documents = list()
+
+        for p, m, ring, rows in covered:
+
+            batch = DecodedBatch(rows, ring.single_value)
+            agg = batch.aggregate()
+
+            documents.append({
+                'p_index': p,
+                'm_index': m,
+                'measurements': batch.to_tuples(),
+                '_start_time': to_datetime(batch.start),
+                '_end_time': to_datetime(batch.end),
+                'min': agg[0],
+                'avg': agg[1],
+                'max': agg[2],
+            })
+
+        return sorted(documents, key=lambda d: d['_start_time'])
+
+    def get_aggregated(self, table: str, flight_id: UUID, p_index: int | None, m_index: int | None, start: datetime, end: datetime, resolution: str) -> list[dict] | None:
+        """
+        Aggregates the samples in the range at the resolution with the fields of
+        `FlightMeasurementAggregated`, `None` if the range is not covered or the resolution
+        is not supported
+        """
+
+        width = HOT_WINDOW_RESOLUTIONS.get(resolution)
+
+        if width is None:
+            return None
+
+        covered = self.get_covered_rows(table, flight_id, p_index, m_index, start, end)
+
+        if covered is None:
+            return None
+
+        res = list()
+
+        for p, m, ring, rows in covered:
+
+            times = rows['time']
+            buckets = np.round(times*1000).astype(np.int64) // width
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+            ends = np.concatenate([starts[1:], [len(rows)]])
+
+            values = rows['value'] if ring.single_value and rows['value'].ndim == 1 else None
+
+            if values is not None and values.dtype == np.bool_:
+                values = values.astype(np.int8)
+
+            tuples = rows_to_tuples(rows, ring.single_value)
+
+            for i, (s, e) in enumerate(zip(starts.tolist(), ends.tolist())):
+                res.append({
+                    'p_index': p,
+                    'm_index': m,
+                    'measurements': [],
+                    '_start_time': to_datetime(float(times[s])),
+                    '_end_time': to_datetime(float(times[e-1])),
+                    'min': values[s:e].min().item() if values is not None else None,
+                    'avg': float(values[s:e].mean(dtype=np.float64)) if values is not None else None,
+                    'max': values[s:e].max().item() if values is not None else None,
+                    'count': e - s,
+                    'first': tuples[s],
+                    'last': tuples[e-1],
+                    'series_name': None,
+                    'part_id': None,
+                })
+
+        return sorted(res, key=lambda d: d['_start_time'])
+
+    def get_metrics(self) -> dict[str, int]:
+        return {
+            'flights': len(self.flights),
+            'series': sum(len(f.series) for f in self.flights.values()),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+hot_window = HotWindow(get_settings().hot_window_seconds, get_settings().hot_window_max_bytes)
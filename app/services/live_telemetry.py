@@ -0,0 +1,193 @@
+import asyncio
+from uuid import UUID
+import numpy as np
+
+from app.config import get_settings
+from app.models.flight import Flight
+
+LIVE_QUEUE_SIZE = 64
+"""Messages queued per subscription, the oldest are dropped if a client doesn't keep up"""
+
+LIVE_KEEPALIVE_INTERVAL = 15
+"""Seconds after which an idle live stream sends a keepalive"""
+
+LIVE_UNAVAILABLE_MESSAGE = 'Live measurements are not available, the measurements are ingested by external workers'
+
+def is_live_available() -> bool:
+    """
+    The hub is only fed by the ingest of this process. External ingest workers (see
+    `app.mqtt.ingest_worker`) run in other processes, so live subscriptions are rejected
+    instead of never receiving anything
+    """
+    return get_settings().ingest_mode == 'in_process'
+
+#region Decimation
+
+def get_decimation(times: np.ndarray, rate: float | None) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Returns the indices of the samples to send at a rate of at most `rate` samples per
+    second, the first sample of every 1/rate long slot is kept. The result only depends on
+    the rate, so it is computed once for all subscribers with the same rate. The slots of
+    the kept samples are returned to skip slots a subscriber already got from the last batch
+    """
+
+    if rate is None:
+        return np.arange(len(times)), None
+
+    slots, indices = np.unique(np.floor(times*rate).astype(np.int64), return_index=True)
+
+    return indices, slots
+
+#endregion
+
+class LiveSubscription:
+    """
+    Live measurements of a flight for one client. `series` are the (part index, measurement
+    index) pairs to receive, `None` receives all. Messages are queued until the client
+    takes them, if more than `max_queued` are waiting the oldest are dropped
+    """
+
+    def __init__(self, flight_id: UUID, series: set[tuple[int, int]] | None, rate: float | None, max_queued: int = LIVE_QUEUE_SIZE) -> None:
+        self.flight_id = flight_id
+        self.series = series
+        self.rate = rate
+
+        self.queue = asyncio.Queue[dict](max_queued)
+        self.dropped = 0
+        self.dropped_since_last = 0
+
+        self.last_slots = dict[tuple[int, int], int]()
+        """Last decimation slot sent of every series"""
+
+    def matches(self, p_index: int, m_index: int) -> bool:
+        return self.series is None or (p_index, m_index) in self.series
+
+    def push(self, message: dict):
+
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.dropped_since_last += 1
+
+        self.queue.put_nowait(message)
+
+    async def get(self) -> dict:
+        """Waits for the next message, it carries the number of messages dropped before it"""
+
+        message = await self.queue.get()
+
+        message['dropped'] = self.dropped_since_last
+        self.dropped_since_last = 0
+
+        return message
+
+class LiveTelemetryHub:
+    """
+    Fans out the measurements flushed by the ingest to the live subscriptions of a flight.
+    A batch is decoded once and decimated once per requested rate, no matter how many
+    clients are subscribed
+    """
+
+    def __init__(self) -> None:
+        self.subscriptions = dict[UUID, set[LiveSubscription]]()
+        self.published = 0
+
+    def subscribe(self, subscription: LiveSubscription):
+        self.subscriptions.setdefault(subscription.flight_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription: LiveSubscription):
+
+        subscriptions = self.subscriptions.get(subscription.flight_id)
+
+        if subscriptions is None:
+            return
+
+        subscriptions.discard(subscription)
+
+        if len(subscriptions) < 1:
+            del self.subscriptions[subscription.flight_id]
+
+    def has_subscribers(self, flight_id: UUID) -> bool:
+        return flight_id in self.subscriptions
+
+    def publish(self, flight: Flight, p_index: int, m_index: int, measurements: list):
+        """Sends the (time, value) measurements of a series to every subscription that matches"""
+
+        subscriptions = [s for s in self.subscriptions.get(flight.id, ()) if s.matches(p_index, m_index)]
+
+        if len(subscriptions) < 1 or len(measurements) < 1:
+            return
+
+        part_id = flight.measured_part_ids[p_index]
+        series_name = flight.measured_parts[part_id][m_index].name
+
+        times = np.fromiter((m[0] for m in measurements), dtype=np.float64, count=len(measurements))
+        decimations = dict[float | None, tuple[np.ndarray, np.ndarray | None]]()
+
+        for subscription in subscriptions:
+
+            if subscription.rate not in decimations:
+                decimations[subscription.rate] = get_decimation(times, subscription.rate)
+
+            indices, slots = decimations[subscription.rate]
+
+            if slots is not None:
+
+                # Skip the slots that were already sent with the last batch
+                last_slot = subscription.last_slots.get((p_index, m_index))
+                skip = int(np.searchsorted(slots, last_slot, side='right')) if last_slot is not None else 0
+
+                if skip >= len(slots):
+                    continue
+
+                indices = indices[skip:]
+                subscription.last_slots[(p_index, m_index)] = int(slots[-1])
+
+            subscription.push({
+                'flight_id': str(flight.id),
+                'part_id': part_id,
+                'series_name': series_name,
+                'measurements': [measurements[i] for i in indices],
+            })
+
+        self.published += 1
+
+    def get_metrics(self) -> dict[str, int | bool]:
+
+        subscriptions = [s for flight_subscriptions in self.subscriptions.values() for s in flight_subscriptions]
+
+        return {
+            'available': is_live_available(),
+            'flights': len(self.subscriptions),
+            'subscriptions': len(subscriptions),
+            'published': self.published,
+            'dropped': sum(s.dropped for s in subscriptions),
+        }
+
+live_telemetry = LiveTelemetryHub()
+
+def get_live_series(flight: Flight, part_id: str | None, series_name: str | None) -> set[tuple[int, int]] | None:
+    """
+    Resolves the series of a subscription to their (part index, measurement index), `None`
+    if all series of the flight are subscribed. Raises a `ValueError` if the part or series
+    is not measured in the flight
+    """
+
+    if part_id is None:
+        if series_name is not None:
+            raise ValueError('A series can only be selected together with its part')
+
+        return None
+
+    if part_id not in flight.measured_parts or part_id not in flight.measured_part_ids:
+        raise ValueError(f'Part {part_id} is not measured in the flight')
+
+    p_index = flight.measured_part_ids.index(part_id)
+    descriptors = flight.measured_parts[part_id]
+
+    series = {(p_index, j) for j, d in enumerate(descriptors) if series_name is None or d.name == series_name}
+
+    if len(series) < 1:
+        raise ValueError(f'Series {series_name} is not measured in the flight')
+
+    return series
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+from fastapi.testclient import TestClient
+import jwt
+import pytest
+from app.services.data_access.flight_data import build_flight_data_document, insert_flight_data_documents
+from tests.auth_helper import get_auth_headers
+
+
+def create_flight_with_parts(test_client: TestClient, bearer: str, measured_parts: dict):
+
+    create_vessel_response = test_client.post('/v1/vessels/', headers=get_auth_headers(bearer), json={'name': 'Batch Query Vessel'})
+    assert create_vessel_response.status_code == 200
+    vessel = create_vessel_response.json()
+
+    auth_code_response = test_client.post(
+        f"/v1/vessels/{vessel['_id']}/auth_codes",
+        headers=get_auth_headers(bearer),
+        json={'valid_until': (datetime.now(timezone.utc) + timedelta(1)).isoformat()}
+    )
+    assert auth_code_response.status_code == 200
+
+    vessel_bearer_response = test_client.post('/auth/authorization_code_flow', json={'token': auth_code_response.json()['_id']})
+    assert vessel_bearer_response.status_code == 200
+    vessel_bearer_token = vessel_bearer_response.json()['token']
+
+    token_id = jwt.decode(vessel_bearer_token, options={"verify_signature": False})['uid']
+
+    register_vessel_response = test_client.post(
+        '/v1/vessels/register',
+        json={'parts': [], 'no_auth_permission': None, '_id': token_id},
+        headers=get_auth_headers(vessel_bearer_token)
+    )
+    assert register_vessel_response.status_code == 200
+
+    flight = {
+        'start': datetime.now(timezone.utc).isoformat(),
+        '_vessel_id': vessel['_id'],
+        '_vessel_version': vessel['_version'],
+        'name': 'Batch Query Flight',
+        'measured_parts': measured_parts,
+        'measured_part_ids': list(measured_parts),
+        'available_commands': {}
+    }
+
+    create_flight_response = test_client.post('/v1/flights/', json=flight, headers=get_auth_headers(vessel_bearer_token))
+    assert create_flight_response.status_code == 200
+
+    return create_flight_response.json()
+
+@pytest.mark.asyncio
+async def test_v1_flight_data_batch(test_client: TestClient, test_user_bearer):
+
+    bearer = await test_user_bearer
+
+    part_a, part_b = str(uuid4()), str(uuid4())
+
+    flight = create_flight_with_parts(test_client, bearer, {
+        part_a: [{'name': 'altitude', 'type': 'f'}, {'name': 'speed', 'type': 'f'}],
+        part_b: [{'name': 'temperature', 'type': 'f'}],
+    })
+
+    flight_id = UUID(flight['_id'])
+    start = datetime.now(timezone.utc).replace(microsecond=0)
+    t = start.timestamp()
+
+    await insert_flight_data_documents([
+        build_flight_data_document(flight_id, 0, 0, [(t, 1.0), (t + 0.5, 3.0)], start, start, 1.0, 2.0, 3.0),
+        build_flight_data_document(flight_id, 0, 1, [(t, 10.0)], start, start, 10.0, 10.0, 10.0),
+        build_flight_data_document(flight_id, 1, 0, [(t, 20.0)], start, start, 20.0, 20.0, 20.0),
+    ])
+
+    query = {
+        'series': [
+            {'part_id': part_a, 'series_name': 'altitude'},
+            {'part_id': part_b, 'series_name': 'temperature'},
+            {'part_id': part_b, 'series_name': 'unknown'},
+        ],
+        'start': (start - timedelta(minutes=1)).isoformat(),
+        'end': (start + timedelta(minutes=1)).isoformat(),
+        'resolution': 'minute'
+    }
+
+    response = test_client.post(f'/v1/flights/{flight_id}/data', json=query, headers=get_auth_headers(bearer))
+
+    assert response.status_code == 200
+
+    series = {(r['part_id'], r['series_name']): r for r in response.json()}
+
+    assert set(series) == {(part_a, 'altitude'), (part_b, 'temperature')}
+    assert series[(part_a, 'altitude')]['count'] == 2
+    assert series[(part_a, 'altitude')]['avg'] == 2.0
+
+@pytest.mark.asyncio
+async def test_v1_flight_data_batch_invalid_resolution(test_client: TestClient, test_user_bearer):
+
+    bearer = await test_user_bearer
+
+    flight = create_flight_with_parts(test_client, bearer, {})
+
+    query = {
+        'series': [],
+        'start': datetime.now(timezone.utc).isoformat(),
+        'end': datetime.now(timezone.utc).isoformat(),
+        'resolution': 'week'
+    }
+
+    response = test_client.post(f"/v1/flights/{flight['_id']}/data", json=query, headers=get_auth_headers(bearer))
+
+    assert response.status_code == 400
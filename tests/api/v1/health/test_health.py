@@ -0,0 +1,38 @@
+from uuid import uuid4
+from fastapi.testclient import TestClient
+import pytest
+from tests.auth_helper import create_api_user, get_auth_headers, get_bearer_for_user
+
+
+def test_v1_health(test_client: TestClient):
+
+    response = test_client.get('/v1/health/')
+
+    assert response.status_code == 200
+    assert response.json()['status'] == 'ok'
+
+@pytest.mark.asyncio
+async def test_v1_health_metrics(test_client: TestClient):
+
+    admin = await create_api_user(uuid4(), ['admin'])
+    bearer = await get_bearer_for_user(admin, test_client)
+
+    # Make sure the pool was used at least once
+    test_client.get('/v1/health/')
+
+    response = test_client.get('/v1/health/metrics', headers=get_auth_headers(bearer))
+
+    assert response.status_code == 200
+
+    pool = response.json()['mongo_pool']
+
+    assert pool['checkouts'] > 0
+    assert pool['waiting'] >= 0
+
+@pytest.mark.asyncio
+async def test_v1_health_metrics_requires_admin(test_client: TestClient, test_user_bearer):
+
+    bearer = await test_user_bearer
+
+    assert test_client.get('/v1/health/metrics').status_code == 401
+    assert test_client.get('/v1/health/metrics', headers=get_auth_headers(bearer)).status_code == 403
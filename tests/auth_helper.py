@@ -13,13 +13,13 @@ from app.services.data_access.user import create_or_update_user
 def get_auth_headers(token):
     return {'Authorization': f'Bearer {token}'}
 
-async def create_api_user(uuid: UUID):
+async def create_api_user(uuid: UUID, roles: list[str] | None = None):
     new_user = User(
         _id=uuid, 
         pw=None, 
         unique_name=str(uuid), 
         name='Test user', 
-        roles=[])
+        roles=roles or [])
 
     await create_or_update_user(new_user)
 
@@ -0,0 +1,25 @@
+class FakeCursor:
+    """Stands in for a motor cursor, returns the given documents"""
+
+    def __init__(self, results) -> None:
+        self.results = results
+
+    def sort(self, sort):
+        return self
+
+    async def to_list(self, length):
+        return self.results
+
+class FakeCollection:
+    """Stands in for a motor collection, every query returns the given documents. The pipelines passed to `aggregate` are recorded"""
+
+    def __init__(self, results) -> None:
+        self.results = results
+        self.pipelines = list()
+
+    def find(self, query):
+        return FakeCursor(self.results)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return FakeCursor(self.results)
@@ -0,0 +1,33 @@
+import struct
+import pytest
+from app.helper.batch_decoder import decode_batch
+from app.helper.binary_format_encoder import decode_payload, get_codec
+from app.mqtt.measurments import aggregate_measurements
+
+
+@pytest.mark.parametrize('shape,fmt,values', [
+    ('f', 'f', [(1.5,), (2.5,), (-3.0,)]),
+    ('?', '?', [(True,), (False,), (True,)]),
+    ('fff', 'fff', [(1, 2, 3), (4, 5, 6), (7, 8, 9)]),
+    ('fi', 'fi', [(1.5, 2), (3.5, 4)]),
+    ('[d]', 'ddd', [(1, 2, 3), (4, 5, 6)]),
+])
+def test_batch_matches_single_decoding(shape, fmt, values):
+
+    payloads = [struct.pack(f'!d{fmt}', float(i), *v) for i, v in enumerate(values)]
+    expected = [decode_payload(shape, p) for p in payloads]
+
+    batch = decode_batch(get_codec(shape), payloads)
+
+    assert batch is not None
+    assert batch.to_tuples() == expected
+    assert batch.start == 0
+    assert batch.end == len(values) - 1
+    assert batch.aggregate() == pytest.approx(aggregate_measurements(shape, expected))
+
+def test_batch_falls_back_for_variable_length():
+
+    payloads = [struct.pack('!ddd', 0, 1, 2), struct.pack('!dd', 1, 1)]
+
+    assert decode_batch(get_codec('[d]'), payloads) is None
+    assert decode_batch(get_codec('[str]'), [struct.pack('!d3s', 0, b'abc')]) is None
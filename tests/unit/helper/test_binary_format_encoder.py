@@ -0,0 +1,41 @@
+import struct
+import pytest
+from app.helper.binary_format_encoder import DOUBLE_SIZE, decode_payload, decode_payload_internal, get_codec
+
+
+def decode_interpreted(shape, payload: bytes):
+    time = struct.unpack_from('!d', payload, 0)[0]
+    res, offset = decode_payload_internal(shape, payload, DOUBLE_SIZE)
+    return time, res
+
+def packet(fmt: str, *values):
+    return struct.pack(f'!d{fmt}', 12.25, *values)
+
+@pytest.mark.parametrize('shape,payload', [
+    ('f', packet('f', 1.5)),
+    ('?', packet('?', True)),
+    ('fff', packet('fff', 1.0, 2.0, 3.0)),
+    ('[d]', packet('ddd', 1.0, 2.0, 4.5)),
+    ('[d]', packet('')),
+    ('[ff]', packet('ffff', 1.0, 2.0, 3.0, 4.0)),
+    ('[str]', packet('5s', b'hello')),
+    ([('a', 'f'), ('b', '[str]'), ('c', '[i]')], packet('fi4si3i', 1.5, 4, b'text', 3, 1, 2, 3)),
+])
+def test_codec_matches_interpreted_decoding(shape, payload):
+
+    expected = decode_interpreted(shape, payload)
+
+    assert get_codec(shape).decode(payload) == expected
+    assert decode_payload(shape, payload) == expected
+
+def test_codec_is_cached():
+
+    shape = [('x', 'd'), ('y', 'd')]
+
+    assert get_codec(shape) is get_codec([('x', 'd'), ('y', 'd')])
+    assert get_codec('fff') is get_codec('fff')
+
+def test_codec_packet_size():
+
+    assert get_codec('fff').packet_size == DOUBLE_SIZE + 12
+    assert get_codec('[d]').packet_size is None
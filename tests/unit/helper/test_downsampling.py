@@ -0,0 +1,47 @@
+import numpy as np
+from app.helper.downsampling import downsample_lttb, downsample_measurements, downsample_min_max
+
+
+def test_min_max_keeps_peaks():
+
+    times = np.arange(1000, dtype=np.float64)
+    values = np.zeros(1000)
+    values[123] = 50
+    values[777] = -50
+
+    indices = downsample_min_max(times, values, 20)
+
+    assert len(indices) <= 20
+    assert 123 in indices and 777 in indices
+    assert np.all(np.diff(indices) > 0)
+
+def test_lttb_keeps_endpoints():
+
+    times = np.arange(1000, dtype=np.float64)
+    values = np.sin(times/50)
+
+    indices = downsample_lttb(times, values, 50)
+
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+
+def test_downsample_measurements():
+
+    measurements = [(float(t), float(t % 7)) for t in range(100)]
+
+    assert downsample_measurements(measurements[:10], 20) == measurements[:10]
+
+    reduced = downsample_measurements(list(reversed(measurements)), 20, 'lttb')
+
+    assert len(reduced) == 20
+    assert reduced[0] == measurements[0] and reduced[-1] == measurements[-1]
+
+def test_downsample_not_numeric():
+
+    measurements = [(float(t), str(t)) for t in range(100)]
+
+    reduced = downsample_measurements(measurements, 10)
+
+    assert len(reduced) == 10
+    assert reduced[0] == measurements[0] and reduced[-1] == measurements[-1]
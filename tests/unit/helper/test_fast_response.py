@@ -0,0 +1,53 @@
+from datetime import datetime
+import json
+from uuid import uuid4
+import cbor2
+import msgpack
+from app.helper.fast_response import encode_content, get_response_format
+from app.models.flight_measurement import FlightMeasurementDB
+
+
+def test_get_response_format():
+
+    assert get_response_format(None) == 'json'
+    assert get_response_format('*/*') == 'json'
+    assert get_response_format('application/msgpack') == 'msgpack'
+    assert get_response_format('application/x-msgpack, application/json;q=0.5') == 'msgpack'
+    assert get_response_format('application/cbor;q=0.2, application/json') == 'json'
+    assert get_response_format('text/html, application/cbor;q=0.9') == 'cbor'
+    assert get_response_format('application/msgpack;q=0') == 'json'
+    assert get_response_format('application/cbor;q=0, application/msgpack;q=0.1') == 'msgpack'
+
+def test_encode_content_matches_model():
+
+    document = {
+        'p_index': 1,
+        'm_index': 0,
+        'measurements': [(0.1, 1.5), (0.2, 2.5)],
+        '_start_time': datetime(2024, 1, 1, 12, 0, 0, 250000),
+        '_end_time': datetime(2024, 1, 1, 12, 0, 1),
+        'min': 1.5,
+        'avg': 2.0,
+        'max': 2.5,
+    }
+
+    expected = json.loads(FlightMeasurementDB(**document).model_dump_json(by_alias=True))
+
+    assert json.loads(encode_content([document], 'json')) == [expected]
+    assert msgpack.unpackb(encode_content([document], 'msgpack')) == [expected]
+
+def test_encode_content_binary_formats():
+
+    part_id = uuid4()
+    content = {'part_id': part_id, 'time': datetime(2024, 1, 1), 'values': [1, 2.5, True, 'a']}
+
+    unpacked = msgpack.unpackb(encode_content(content, 'msgpack'))
+
+    assert unpacked['part_id'] == str(part_id)
+    assert unpacked['time'] == '2024-01-01T00:00:00'
+    assert unpacked['values'] == [1, 2.5, True, 'a']
+
+    decoded = cbor2.loads(encode_content(content, 'cbor'))
+
+    assert decoded['part_id'] == str(part_id)
+    assert decoded['values'] == [1, 2.5, True, 'a']
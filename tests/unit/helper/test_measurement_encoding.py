@@ -0,0 +1,63 @@
+import struct
+import bson
+import numpy as np
+import pytest
+from app.helper.batch_decoder import decode_batch
+from app.helper.binary_format_encoder import get_codec
+from app.helper.measurement_encoding import decode_measurement_batch, encode_measurement_batch, get_stored_measurements
+
+
+def encode_and_decode(shape: str, payloads: list[bytes]):
+
+    batch = decode_batch(get_codec(shape), payloads)
+    assert batch is not None
+
+    # Stored and read back like a document
+    encoding = bson.decode(bson.encode({'encoding': encode_measurement_batch(batch)}))['encoding']
+
+    return batch, get_stored_measurements({'encoding': encoding})
+
+@pytest.mark.parametrize('shape,fmt,values', [
+    ('f', 'f', [(1.5,), (2.5,), (-3.0,), (float('nan'),)]),
+    ('?', '?', [(True,), (False,), (True,)]),
+    ('q', 'q', [(-2**63,), (2**63 - 1,), (0,)]),
+    ('fi', 'fi', [(1.5, 2), (3.5, -4), (0.0, 7)]),
+    ('[d]', 'ddd', [(1, 2, 3), (4, 5, 6)]),
+    ('f', 'f', [(1.0,)]),
+])
+def test_round_trip(shape, fmt, values):
+
+    payloads = [struct.pack(f'!d{fmt}', 1000.0 + i*0.01, *v) for i, v in enumerate(values)]
+
+    batch, decoded = encode_and_decode(shape, payloads)
+
+    expected = batch.to_tuples()
+
+    assert len(decoded) == len(expected)
+
+    for (t, v), (et, ev) in zip(decoded, expected):
+        assert t == et
+        np.testing.assert_equal(v, ev)
+
+def test_steady_series_compresses():
+
+    payloads = [struct.pack('!df', 1700000000.0 + i*0.01, 20.0 + (i % 10)*0.1) for i in range(10_000)]
+
+    batch = decode_batch(get_codec('f'), payloads)
+    assert batch is not None
+
+    encoded = encode_measurement_batch(batch)
+    plain = bson.encode({'measurements': batch.to_tuples()})
+
+    assert len(encoded['data'])*10 < len(plain)
+
+def test_unknown_version():
+
+    batch = decode_batch(get_codec('f'), [struct.pack('!df', 1.0, 1.0)])
+    assert batch is not None
+
+    with pytest.raises(ValueError):
+        decode_measurement_batch({**encode_measurement_batch(batch), 'version': 99})
+
+def test_plain_documents():
+    assert get_stored_measurements({'measurements': [(1.0, 2.0)]}) == [(1.0, 2.0)]
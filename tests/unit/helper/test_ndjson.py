@@ -0,0 +1,71 @@
+from datetime import datetime
+import json
+from uuid import uuid4
+from bson import ObjectId
+import pytest
+from app.controller import flight_data_controller
+from app.helper.ndjson import decode_continuation_token, encode_continuation_token, encode_ndjson
+
+
+async def iterate(values):
+    for v in values:
+        yield v
+
+@pytest.mark.asyncio
+async def test_encode_ndjson_chunks():
+
+    documents = [{'i': i, 'time': datetime(2024, 1, 1, 0, 0, i)} for i in range(5)]
+
+    chunks = [c async for c in encode_ndjson(iterate(documents), lambda d: d, 2, lambda: {'end': True})]
+
+    assert len(chunks) == 3
+
+    lines = b''.join(chunks).decode().splitlines()
+
+    assert [json.loads(l) for l in lines] == [{'i': i, 'time': f'2024-01-01T00:00:0{i}'} for i in range(5)] + [{'end': True}]
+
+@pytest.mark.asyncio
+async def test_encode_ndjson_empty():
+    assert [c async for c in encode_ndjson(iterate([]), lambda d: d, 2, lambda: None)] == []
+
+def test_continuation_token():
+
+    start_time = datetime(2024, 1, 1, 12, 30, 1, 500)
+    _id = ObjectId()
+
+    assert decode_continuation_token(encode_continuation_token(start_time, _id)) == (start_time, _id)
+
+def test_invalid_continuation_token():
+    with pytest.raises(ValueError):
+        decode_continuation_token('not a token')
+
+async def read_stream_range(monkeypatch, count: int, limit: int | None) -> list[dict]:
+
+    documents = [{'i': i, '_start_time': datetime(2024, 1, 1, 0, 0, i), '_id': ObjectId()} for i in range(count)]
+
+    async def stream(flight_id, part_index, start, end, batch_size, limit, after):
+        for d in documents[:limit]:
+            yield d
+
+    monkeypatch.setattr(flight_data_controller, 'stream_flight_data_in_range', stream)
+    monkeypatch.setattr(flight_data_controller, 'to_flight_data_output', lambda d: {'i': d['i']})
+
+    response = flight_data_controller.stream_range(uuid4(), 0, datetime(2024, 1, 1), datetime(2024, 1, 2), 2, limit, None)
+    body = b''.join([c async for c in response.body_iterator]) # type: ignore
+
+    return [json.loads(l) for l in body.decode().splitlines()]
+
+@pytest.mark.asyncio
+async def test_stream_range_continuation(monkeypatch):
+
+    lines = await read_stream_range(monkeypatch, 5, 3)
+
+    assert lines[:3] == [{'i': 0}, {'i': 1}, {'i': 2}]
+    assert decode_continuation_token(lines[3]['continuation_token'])[0] == datetime(2024, 1, 1, 0, 0, 2)
+
+@pytest.mark.asyncio
+async def test_stream_range_without_more_documents(monkeypatch):
+
+    # Exactly the limit left, there is no next page
+    assert await read_stream_range(monkeypatch, 3, 3) == [{'i': 0}, {'i': 1}, {'i': 2}]
+    assert await read_stream_range(monkeypatch, 3, None) == [{'i': 0}, {'i': 1}, {'i': 2}]
@@ -0,0 +1,48 @@
+import struct
+import pytest
+from app.helper.binary_format_encoder import decode_payload, get_codec
+from app.helper.payload_batch import decode_payloads, get_stored_shape, pack_payloads, summarize_payloads, unpack_payloads
+
+
+def test_pack_fixed_size():
+
+    payloads = [struct.pack('!df', float(i), i*2) for i in range(4)]
+
+    data, payload_size, payload_sizes = pack_payloads(payloads)
+
+    assert (payload_size, payload_sizes) == (12, None)
+    assert unpack_payloads(data, payload_size, payload_sizes) == payloads
+
+def test_pack_variable_size():
+
+    payloads = [struct.pack('!d', 1.0) + b'ab', struct.pack('!d', 2.0) + b'abcd']
+
+    data, payload_size, payload_sizes = pack_payloads(payloads)
+
+    assert payload_size is None
+    assert unpack_payloads(data, payload_size, payload_sizes) == payloads
+
+@pytest.mark.parametrize('shape,payloads', [
+    ('f', [struct.pack('!df', 1.0, 1.5), struct.pack('!df', 2.0, -2.5)]),
+    ('fi', [struct.pack('!dfi', 1.0, 1.5, 3), struct.pack('!dfi', 2.0, 2.5, 4)]),
+    ('[str]', [struct.pack('!d', 1.0) + b'on', struct.pack('!d', 2.0) + b'off']),
+    ([('a', 'f'), ('b', 'i')], [struct.pack('!dfi', 1.0, 1.5, 3)]),
+])
+def test_decode_payloads(shape, payloads):
+
+    data, payload_size, payload_sizes = pack_payloads(payloads)
+
+    # Named fields come back from the database as lists
+    stored_shape = get_stored_shape([list(f) for f in shape] if isinstance(shape, list) else shape)
+
+    assert decode_payloads(stored_shape, data, payload_size, payload_sizes) == [decode_payload(shape, p) for p in payloads]
+
+def test_summarize_payloads():
+
+    payloads = [struct.pack('!df', 2.0, 1.0), struct.pack('!df', 1.0, 3.0), struct.pack('!df', 3.0, 2.0)]
+
+    start, end, agg, first, last = summarize_payloads(get_codec('f'), payloads)
+
+    assert (start, end) == (1.0, 3.0)
+    assert agg == (1.0, 2.0, 3.0)
+    assert (first, last) == ((2.0, 1.0), (3.0, 2.0))
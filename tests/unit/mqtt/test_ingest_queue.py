@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from app.mqtt.ingest_queue import IngestQueue
+
+
+def create_queue(tmp_path, policy, **kwargs):
+
+    written = list[str]()
+    release = asyncio.Event()
+
+    async def handler(flight_uuid, buffer):
+        await release.wait()
+        written.append(flight_uuid)
+
+    queue = IngestQueue('flight_data', handler, 1, policy=policy, spill_path=str(tmp_path), **kwargs)
+    queue.start()
+
+    return queue, written, release
+
+@pytest.mark.asyncio
+async def test_block_policy_signals_backpressure(tmp_path):
+
+    queue, written, release = create_queue(tmp_path, 'block', max_batches=2)
+
+    backpressure = list[bool]()
+    queue.on_backpressure = backpressure.append
+
+    queue.put('a', {}, 1)
+    queue.put('b', {}, 1)
+
+    assert backpressure == [True]
+
+    release.set()
+    await queue.join()
+
+    assert written == ['a', 'b']
+    assert backpressure == [True, False]
+
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy(tmp_path):
+
+    queue, written, release = create_queue(tmp_path, 'drop_oldest', max_batches=2)
+
+    queue.put('a', {}, 1)
+    await asyncio.sleep(0) # 'a' is now being written
+    queue.put('b', {}, 1)
+    queue.put('c', {}, 1)
+
+    release.set()
+    await queue.join()
+
+    assert written == ['a', 'c']
+    assert queue.get_metrics()['dropped_batches'] == 1
+
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy_keeps_limit_while_writing(tmp_path):
+
+    queue, written, release = create_queue(tmp_path, 'drop_oldest', max_batches=1)
+
+    done = list[str]()
+    queue.on_batch_done = lambda batch: done.append(batch.flight_uuid)
+
+    queue.put('a', {}, 1)
+    await asyncio.sleep(0) # 'a' is now being written, nothing is waiting
+    queue.put('b', {}, 1)
+
+    assert queue.get_metrics()['in_flight_batches'] == 1
+    assert done == ['b']
+
+    release.set()
+    await queue.join()
+
+    assert written == ['a']
+    assert queue.get_metrics()['dropped_batches'] == 1
+
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_spill_policy(tmp_path):
+
+    queue, written, release = create_queue(tmp_path, 'spill', max_batches=1)
+
+    queue.put('a', {}, 1)
+    queue.put('b', {'0': {'0': [b'payload']}}, 7)
+
+    assert queue.get_metrics()['spilled_pending'] == 1
+
+    release.set()
+    await queue.join()
+
+    assert written == ['a', 'b']
+    assert list((tmp_path / 'flight_data').iterdir()) == []
+
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_spill_policy_keeps_order(tmp_path):
+
+    queue, written, release = create_queue(tmp_path, 'spill', max_batches=1)
+
+    queue.put('a', {}, 1)
+    queue.put('b', {}, 1)
+
+    # Room in memory, but 'b' is still on disk, so 'c' is spilled and both are loaded in order
+    queue.max_batches = 10
+    queue.put('c', {}, 1)
+
+    assert queue.get_metrics()['spilled_batches'] == 2
+
+    release.set()
+    await queue.join()
+
+    assert written == ['a', 'b', 'c']
+
+    await queue.stop()
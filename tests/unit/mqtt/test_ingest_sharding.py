@@ -0,0 +1,31 @@
+from uuid import uuid4
+import pytest
+from app.mqtt import init_mqtt
+
+
+@pytest.fixture
+def reset_shard():
+    yield
+    init_mqtt.shard = None
+
+def test_every_flight_has_exactly_one_worker(reset_shard):
+
+    flights = [str(uuid4()) for _ in range(50)]
+
+    owners = dict[str, int]()
+
+    for index in range(3):
+        init_mqtt.shard = (index, 3)
+        for flight in flights:
+            if init_mqtt.is_own_flight(flight):
+                assert flight not in owners
+                owners[flight] = index
+
+    assert len(owners) == len(flights)
+    assert len(set(owners.values())) == 3
+
+def test_without_workers_all_flights_are_processed():
+
+    assert init_mqtt.shard is None
+    assert init_mqtt.is_own_flight(str(uuid4()))
+    assert init_mqtt.get_subscriptions() == [('#', 0)]
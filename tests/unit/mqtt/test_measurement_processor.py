@@ -0,0 +1,211 @@
+import asyncio
+from datetime import datetime, timezone
+import struct
+from uuid import uuid4
+import pytest
+from app.models.flight import Flight
+from app.models.flight_measurement import FlightMeasurementDescriptor
+from app.mqtt import measurments
+from app.mqtt.measurments import MeasurmentProcessor
+from app.services.data_access.flight_data import get_stored_measurements
+from app.services.hot_window import HotWindow
+from app.services.live_telemetry import LiveSubscription
+
+
+@pytest.fixture
+def ingest_flight(monkeypatch):
+    """A flight with one float series, the documents inserted by the processor are collected"""
+
+    flight = Flight(start=datetime.now(timezone.utc), measured_part_ids=[str(uuid4())])
+    flight.measured_parts[flight.measured_part_ids[0]] = [FlightMeasurementDescriptor(name='altitude', type='f')]
+
+    async def get_flight(flight_id):
+        return flight
+
+    inserted = list[tuple[list[dict], str, dict]]()
+
+    async def insert_documents(documents, table, preparation_time = 0, rollups = None):
+        inserted.append((documents, table, rollups))
+
+    monkeypatch.setattr(measurments.flight_schema_cache, 'get', get_flight)
+    monkeypatch.setattr(measurments, 'insert_flight_data_documents', insert_documents)
+
+    # Keeps the global hot window free of the test flights
+    monkeypatch.setattr(measurments, 'hot_window', HotWindow(60, 1024*1024))
+
+    return flight, inserted
+
+PAYLOADS = [struct.pack('!df', 10.0, 1.0), struct.pack('!df', 11.0, 3.0)]
+
+def create_processor(**kwargs):
+
+    processor = MeasurmentProcessor('flight_data', False, **kwargs)
+    flushed = list[tuple[str, int]]()
+
+    async def clear_measurement_buffer(flight_uuid, vessel_buffer):
+        flushed.append((flight_uuid, sum(len(m) for part in vessel_buffer.values() for m in part.values())))
+
+    processor.clear_measurement_buffer = clear_measurement_buffer # type: ignore
+    processor.start()
+
+    return processor, flushed
+
+@pytest.mark.asyncio
+async def test_flush_on_packet_threshold():
+
+    processor, flushed = create_processor(max_buffered_packets=3)
+
+    for _ in range(4):
+        processor.process_measurements('flight', '0', '0', b'packet')
+
+    await processor.ingest_queue.join()
+
+    assert flushed == [('flight', 3)]
+
+    await processor.stop()
+
+@pytest.mark.asyncio
+async def test_flush_on_byte_threshold():
+
+    processor, flushed = create_processor(max_buffered_bytes=10)
+
+    processor.process_measurements('flight', '0', '0', b'x'*6)
+    processor.process_measurements('flight', '0', '1', b'x'*6)
+
+    await processor.ingest_queue.join()
+
+    assert flushed == [('flight', 2)]
+
+    await processor.stop()
+
+@pytest.mark.asyncio
+async def test_flush_on_tick_without_new_packets():
+
+    processor, flushed = create_processor(flush_interval=0.05)
+
+    processor.process_measurements('flight', '0', '0', b'packet')
+
+    await asyncio.sleep(0.2)
+
+    assert flushed == [('flight', 1)]
+
+    await processor.stop()
+
+@pytest.mark.asyncio
+async def test_drain_flushes_everything():
+
+    processor, flushed = create_processor()
+
+    processor.process_measurements('flight_a', '0', '0', b'packet')
+    processor.process_measurements('flight_b', '0', '0', b'packet')
+
+    await processor.stop()
+
+    assert sorted(flushed) == [('flight_a', 1), ('flight_b', 1)]
+
+@pytest.mark.asyncio
+async def test_clear_measurement_buffer_builds_documents(ingest_flight):
+
+    flight, inserted = ingest_flight
+
+    processor = MeasurmentProcessor('flight_data', False)
+
+    await processor.clear_measurement_buffer(str(flight.id), {'0': {'0': PAYLOADS}})
+
+    documents, table, _ = inserted[0]
+
+    assert table == 'flight_data'
+    assert documents == [{
+        'measurements': [(10.0, 1.0), (11.0, 3.0)],
+        '_start_time': datetime.fromtimestamp(10.0, tz=timezone.utc),
+        '_end_time': datetime.fromtimestamp(11.0, tz=timezone.utc),
+        'min': 1.0,
+        'avg': 2.0,
+        'max': 3.0,
+        'count': 2,
+        'sum': 4.0,
+        'metadata': {'_flight_id': flight.id, 'p_index': 0, 'm_index': 0}
+    }]
+
+@pytest.mark.asyncio
+async def test_clear_measurement_buffer_raw_storage(ingest_flight):
+
+    flight, inserted = ingest_flight
+    flight.storage_mode = 'raw'
+
+    processor = MeasurmentProcessor('flight_data', False)
+
+    await processor.clear_measurement_buffer(str(flight.id), {'0': {'0': PAYLOADS}})
+
+    document = inserted[0][0][0]
+
+    assert 'measurements' not in document
+    assert bytes(document['payloads']) == b''.join(PAYLOADS)
+    assert (document['count'], document['min'], document['avg'], document['max']) == (2, 1.0, 2.0, 3.0)
+    assert get_stored_measurements(document) == [(10.0, 1.0), (11.0, 3.0)]
+
+    # Raw batches are rolled up at ingest as well
+    minute = inserted[0][2]['1min'][(flight.id, 0, 0, 0)]
+    assert (minute.count, minute.sum, minute.min, minute.max) == (2, 4.0, 1.0, 3.0)
+
+@pytest.mark.asyncio
+async def test_clear_measurement_buffer_compressed(ingest_flight):
+
+    flight, inserted = ingest_flight
+
+    processor = MeasurmentProcessor('flight_data', False, compress_measurements=True)
+
+    await processor.clear_measurement_buffer(str(flight.id), {'0': {'0': PAYLOADS}})
+
+    document = inserted[0][0][0]
+
+    assert 'measurements' not in document
+    assert (document['first'], document['last']) == ((10.0, 1.0), (11.0, 3.0))
+    assert get_stored_measurements(document) == [(10.0, 1.0), (11.0, 3.0)]
+
+@pytest.mark.asyncio
+async def test_clear_measurement_buffer_publishes_live(ingest_flight):
+
+    flight, _ = ingest_flight
+    flight.storage_mode = 'raw'
+
+    subscription = LiveSubscription(flight.id, None, None)
+    measurments.live_telemetry.subscribe(subscription)
+
+    try:
+        processor = MeasurmentProcessor('flight_data', False)
+
+        await processor.clear_measurement_buffer(str(flight.id), {'0': {'0': PAYLOADS}})
+    finally:
+        measurments.live_telemetry.unsubscribe(subscription)
+
+    message = await subscription.get()
+
+    assert message['series_name'] == 'altitude'
+    assert message['measurements'] == [(10.0, 1.0), (11.0, 3.0)]
+
+@pytest.mark.asyncio
+async def test_clear_measurement_buffer_hot_window_after_insert(ingest_flight, monkeypatch):
+
+    flight, _ = ingest_flight
+
+    processor = MeasurmentProcessor('flight_data', False)
+
+    await processor.clear_measurement_buffer(str(flight.id), {'0': {'0': PAYLOADS}})
+
+    flight_window = measurments.hot_window.flights[('flight_data', flight.id)]
+
+    assert flight_window.series[(0, 0)].size == 2
+    assert flight_window.covers(0, 0, 10.0)
+
+    async def fail(documents, table, preparation_time = 0, rollups = None):
+        raise RuntimeError('not reachable')
+
+    monkeypatch.setattr(measurments, 'insert_flight_data_documents', fail)
+
+    with pytest.raises(RuntimeError):
+        await processor.clear_measurement_buffer(str(flight.id), {'0': {'0': [struct.pack('!df', 12.0, 5.0)]}})
+
+    # The failed batch is not kept, so the series is read from the database
+    assert flight_window.series[(0, 0)].size == 2
+    assert not flight_window.covers(0, 0, 12.0)
@@ -0,0 +1,152 @@
+import asyncio
+import socket
+import paho.mqtt.client as mqtt
+import pytest
+from app.mqtt import init_mqtt
+from app.mqtt.init_mqtt import AsyncioMqttHelper
+
+
+class FakeClient:
+
+    def __init__(self, keepalive: int = 60) -> None:
+        self.keepalive = keepalive
+        self.sock: socket.socket | None = None
+        self.read = list[bytes]()
+        self.writes = 0
+
+    def loop_read(self):
+        assert self.sock is not None
+        self.read.append(self.sock.recv(1024))
+
+    def loop_write(self):
+        self.writes += 1
+
+    def loop_misc(self):
+        return mqtt.MQTT_ERR_SUCCESS
+
+async def connect(client: FakeClient) -> tuple[AsyncioMqttHelper, socket.socket]:
+
+    helper = AsyncioMqttHelper(asyncio.get_running_loop(), client) # type: ignore
+
+    sock, broker = socket.socketpair()
+    sock.setblocking(False)
+    client.sock = sock
+
+    helper.on_socket_open(client, None, sock)
+
+    return helper, broker
+
+async def receive(broker: socket.socket, data: bytes):
+    broker.send(data)
+    await asyncio.sleep(0.05)
+
+@pytest.mark.asyncio
+async def test_reads_until_paused():
+
+    client = FakeClient()
+    helper, broker = await connect(client)
+
+    await receive(broker, b'first')
+
+    helper.set_reading_paused(True)
+    await receive(broker, b'second')
+
+    assert client.read == [b'first']
+
+    helper.set_reading_paused(False)
+    await asyncio.sleep(0.05)
+
+    assert client.read == [b'first', b'second']
+
+    helper.on_socket_close(client, None, client.sock)
+
+@pytest.mark.asyncio
+async def test_paused_before_connect():
+
+    client = FakeClient()
+    helper = AsyncioMqttHelper(asyncio.get_running_loop(), client) # type: ignore
+    helper.set_reading_paused(True)
+
+    sock, broker = socket.socketpair()
+    sock.setblocking(False)
+    client.sock = sock
+    helper.on_socket_open(client, None, sock)
+
+    await receive(broker, b'first')
+
+    assert client.read == []
+
+    helper.set_reading_paused(False)
+    await asyncio.sleep(0.05)
+
+    assert client.read == [b'first']
+
+    helper.on_socket_close(client, None, sock)
+
+@pytest.mark.asyncio
+async def test_register_write():
+
+    client = FakeClient()
+    helper, _ = await connect(client)
+
+    helper.on_socket_register_write(client, None, client.sock)
+    await asyncio.sleep(0.05)
+
+    assert client.writes > 0
+
+    helper.on_socket_unregister_write(client, None, client.sock)
+    writes = client.writes
+    await asyncio.sleep(0.05)
+
+    assert client.writes == writes
+
+    helper.on_socket_close(client, None, client.sock)
+
+@pytest.mark.asyncio
+async def test_unregister_on_disconnect():
+
+    client = FakeClient()
+    helper, broker = await connect(client)
+
+    misc_task = helper.misc_task
+    helper.on_socket_close(client, None, client.sock)
+    await receive(broker, b'after close')
+
+    assert client.read == []
+    assert helper.disconnected.done()
+    assert misc_task is not None and misc_task.cancelled()
+
+@pytest.mark.asyncio
+async def test_reads_while_paused_for_the_keepalive(monkeypatch):
+
+    now = [100.0]
+    monkeypatch.setattr(init_mqtt, 'monotonic', lambda: now[0])
+
+    client = FakeClient(keepalive=10)
+    helper, broker = await connect(client)
+
+    helper.set_reading_paused(True)
+    await receive(broker, b'ping response')
+
+    now[0] = 104.0
+    helper.keep_alive_while_paused()
+    await asyncio.sleep(0.05)
+
+    assert client.read == []
+
+    # Half the keepalive passed, read for one interval
+    now[0] = 105.0
+    helper.keep_alive_while_paused()
+    await asyncio.sleep(0.05)
+
+    assert client.read == [b'ping response']
+    assert helper.keepalive_reads == 1
+
+    now[0] = 106.0
+    helper.keep_alive_while_paused()
+    await receive(broker, b'packet')
+
+    assert client.read == [b'ping response']
+    assert helper.paused_since == 106.0
+
+    helper.on_socket_close(client, None, client.sock)
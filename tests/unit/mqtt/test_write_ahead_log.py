@@ -0,0 +1,199 @@
+import os
+import pytest
+from app.mqtt.write_ahead_log import WriteAheadLog
+
+
+def replay_all(wal: WriteAheadLog):
+
+    records = list[tuple[str, bytes, tuple[int, int]]]()
+
+    def handle_record(topic: str, payload: bytes, record: tuple[int, int]):
+        records.append((topic, payload, record))
+        return True
+
+    wal.replay(handle_record)
+
+    return records
+
+@pytest.mark.asyncio
+async def test_replay_after_crash(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.open()
+
+    wal.append('flight/m/0/0', b'first')
+    wal.append('flight/m/0/1', b'second')
+    await wal.commit()
+
+    # Not committed, lost like in a real crash
+    wal.append('flight/m/0/0', b'third')
+
+    restarted = WriteAheadLog(str(tmp_path))
+    restarted.open()
+
+    records = replay_all(restarted)
+
+    assert [(t, p) for t, p, _ in records] == [('flight/m/0/0', b'first'), ('flight/m/0/1', b'second')]
+
+    # Once the replayed records are in the database the segment is removed
+    restarted.release({records[0][2][0]: [r[1] for _, _, r in records]})
+
+    assert list(tmp_path.iterdir()) == []
+
+@pytest.mark.asyncio
+async def test_replay_stops_at_torn_record(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.open()
+
+    segment, _ = wal.append('flight/m/0/0', b'complete')
+    wal.append('flight/m/0/0', b'torn')
+    await wal.commit()
+    wal.close_file()
+
+    path = wal.segment_path(segment)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-2])
+
+    restarted = WriteAheadLog(str(tmp_path))
+    restarted.open()
+
+    assert [p for _, p, _ in replay_all(restarted)] == [b'complete']
+
+@pytest.mark.asyncio
+async def test_segments_rotate_and_truncate(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path), segment_bytes=64)
+    wal.open()
+
+    first, _ = wal.append('flight/m/0/0', b'x'*40)
+    second, _ = wal.append('flight/m/0/0', b'x'*40)
+    await wal.commit()
+
+    assert first != second
+    assert len(list(tmp_path.iterdir())) == 2
+
+    wal.release({first: [0]})
+
+    assert [p.name for p in tmp_path.iterdir()] == [f'{second:020d}.wal']
+
+    # The current segment is rotated once it is released, later records go to the next one
+    wal.release({second: [0]})
+
+    assert list(tmp_path.iterdir()) == []
+    assert wal.append('flight/m/0/0', b'x') == (second + 1, 0)
+
+@pytest.mark.asyncio
+async def test_released_records_are_not_replayed(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.open()
+
+    records = [wal.append('flight/m/0/0', bytes([i])) for i in range(3)]
+    await wal.commit()
+
+    wal.release({0: [records[0][1], records[2][1]]})
+    await wal.commit()
+
+    # Crash without stopping
+    restarted = WriteAheadLog(str(tmp_path))
+    restarted.open()
+
+    assert [(p, r) for _, p, r in replay_all(restarted)] == [(bytes([1]), (0, 1))]
+
+@pytest.mark.asyncio
+async def test_released_segment_is_not_replayed(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.open()
+
+    records = [wal.append('flight/m/0/0', bytes([i])) for i in range(3)]
+    await wal.commit()
+
+    wal.release({0: [r[1] for r in records]})
+
+    restarted = WriteAheadLog(str(tmp_path))
+    restarted.open()
+
+    assert replay_all(restarted) == []
+
+@pytest.mark.asyncio
+async def test_packets_are_passed_on_after_commit(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.open()
+
+    durable = list[bytes]()
+    wal.on_durable = lambda topic, payload, record: durable.append(payload)
+
+    wal.append('flight/m/0/0', b'first')
+
+    assert durable == []
+
+    await wal.commit()
+
+    assert durable == [b'first']
+
+    restarted = WriteAheadLog(str(tmp_path))
+    restarted.open()
+
+    assert [p for _, p, _ in replay_all(restarted)] == [b'first']
+
+@pytest.mark.asyncio
+async def test_failed_commit_is_retried(tmp_path, monkeypatch):
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.open()
+
+    durable = list[bytes]()
+    wal.on_durable = lambda topic, payload, record: durable.append(payload)
+
+    wal.append('flight/m/0/0', b'first')
+
+    fsync = os.fsync
+
+    def failing_fsync(fd):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'fsync', failing_fsync)
+
+    with pytest.raises(OSError):
+        await wal.commit()
+
+    assert durable == []
+
+    monkeypatch.setattr(os, 'fsync', fsync)
+
+    wal.append('flight/m/0/0', b'second')
+    await wal.commit()
+
+    assert durable == [b'first', b'second']
+
+    # The failed write was cut off the segment, nothing is replayed twice
+    restarted = WriteAheadLog(str(tmp_path))
+    restarted.open()
+
+    assert [(p, r) for _, p, r in replay_all(restarted)] == [(b'first', (0, 0)), (b'second', (0, 1))]
+
+@pytest.mark.asyncio
+async def test_release_during_commit_waits_for_it(tmp_path):
+
+    wal = WriteAheadLog(str(tmp_path), segment_bytes=64)
+    wal.open()
+
+    first, _ = wal.append('flight/m/0/0', b'x'*40)
+    await wal.commit()
+
+    second, _ = wal.append('flight/m/0/0', b'x'*40)
+
+    async with wal.commit_lock:
+        # The writer thread would be switching files right now
+        wal.release({first: [0]})
+
+        assert wal.segment_path(first) in [str(p) for p in tmp_path.iterdir()]
+
+    await wal.commit()
+
+    assert [p.name for p in tmp_path.iterdir()] == [f'{second:020d}.wal']
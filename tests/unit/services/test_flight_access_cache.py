@@ -0,0 +1,124 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+import pytest
+from app.models.flight import Flight
+from app.models.vessel import Vessel
+from app.services import flight_access_cache as cache_module
+from app.services.auth.permission_service import modify_flight_permission, modify_vessel_permission
+from app.services.data_access.flight import get_flight_update_signal
+from app.services.data_access.vessel import get_vessel_delete_signal, get_vessel_update_signal
+from app.services.flight_access_cache import FlightAccessCache
+
+
+def patch_database(monkeypatch, flight: Flight, vessel: Vessel) -> list[str]:
+
+    queries = list[str]()
+
+    async def get_flight(flight_id):
+        queries.append('flight')
+        return flight if flight_id == flight.id else None
+
+    async def get_vessel(vessel_id):
+        queries.append('vessel')
+        return vessel if vessel_id == vessel.id else None
+
+    monkeypatch.setattr(cache_module, 'get_flight', get_flight)
+    monkeypatch.setattr(cache_module, 'get_vessel', get_vessel)
+
+    return queries
+
+def create_flight_and_vessel() -> tuple[Flight, Vessel]:
+    vessel = Vessel(_id=uuid4())
+    flight = Flight(start=datetime.now(timezone.utc), _vessel_id=vessel.id)
+    return flight, vessel
+
+@pytest.mark.asyncio
+async def test_flight_access_cache_hit(monkeypatch):
+
+    flight, vessel = create_flight_and_vessel()
+    queries = patch_database(monkeypatch, flight, vessel)
+
+    cache = FlightAccessCache()
+
+    assert await cache.get(flight.id) == (flight, vessel)
+    assert await cache.get(flight.id) == (flight, vessel)
+
+    assert queries == ['flight', 'vessel']
+    assert cache.get_metrics() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+@pytest.mark.asyncio
+async def test_flight_access_cache_missing(monkeypatch):
+
+    flight, vessel = create_flight_and_vessel()
+    patch_database(monkeypatch, flight, vessel)
+
+    cache = FlightAccessCache()
+
+    assert await cache.get(uuid4()) == (None, None)
+    assert cache.get_metrics()['entries'] == 0
+
+@pytest.mark.asyncio
+async def test_flight_access_cache_expires(monkeypatch):
+
+    flight, vessel = create_flight_and_vessel()
+    queries = patch_database(monkeypatch, flight, vessel)
+
+    cache = FlightAccessCache(ttl=0)
+
+    await cache.get(flight.id)
+    await cache.get(flight.id)
+
+    assert queries == ['flight', 'vessel', 'flight', 'vessel']
+
+@pytest.mark.asyncio
+async def test_writes_invalidate(monkeypatch):
+
+    flight, vessel = create_flight_and_vessel()
+    patch_database(monkeypatch, flight, vessel)
+
+    monkeypatch.setattr(cache_module.flight_access_cache, 'entries', dict())
+
+    await cache_module.flight_access_cache.get(flight.id)
+
+    # Only dropped once the change is written
+    modify_flight_permission(flight, 'read', uuid4())
+
+    assert flight.id in cache_module.flight_access_cache.entries
+
+    get_flight_update_signal().send(None, flight=flight)
+
+    assert flight.id not in cache_module.flight_access_cache.entries
+
+    await cache_module.flight_access_cache.get(flight.id)
+
+    modify_vessel_permission(vessel, 'owner', uuid4())
+    get_vessel_update_signal().send(None, vessel=vessel)
+
+    assert flight.id not in cache_module.flight_access_cache.entries
+
+    await cache_module.flight_access_cache.get(flight.id)
+
+    get_vessel_delete_signal().send(None, vessel_id=vessel.id)
+
+    assert flight.id not in cache_module.flight_access_cache.entries
+
+@pytest.mark.asyncio
+async def test_load_overlapping_invalidation_is_not_cached(monkeypatch):
+
+    flight, vessel = create_flight_and_vessel()
+
+    cache = FlightAccessCache()
+
+    async def get_flight(flight_id):
+        # The permission change is written while the old flight is loaded
+        cache.invalidate_flight(flight_id)
+        return flight
+
+    async def get_vessel(vessel_id):
+        return vessel
+
+    monkeypatch.setattr(cache_module, 'get_flight', get_flight)
+    monkeypatch.setattr(cache_module, 'get_vessel', get_vessel)
+
+    assert await cache.get(flight.id) == (flight, vessel)
+    assert cache.get_metrics()['entries'] == 0
@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+import pytest
+from app.services.data_access.flight_data import aggregate_series, get_series_match_stage, raw_accumulators
+from tests.unit.collection_helper import FakeCollection
+
+
+def create_group(p_index, m_index, start):
+    return {
+        '_id': {'p_index': p_index, 'm_index': m_index, 'date': start},
+        '_start_time': start,
+        '_end_time': start,
+        'min': 1.0,
+        'avg': 2.0,
+        'max': 3.0,
+        'count': 4,
+        'sum': 8.0,
+        'first': (1.0, 1.0),
+        'last': (2.0, 3.0),
+    }
+
+def test_series_match_stage():
+
+    flight_id = uuid4()
+    start = datetime(2024, 1, 1)
+    end = datetime(2024, 1, 2)
+
+    assert list(get_series_match_stage(flight_id, None, None, start, end)['$match']) == ['metadata._flight_id', '_start_time']
+    assert list(get_series_match_stage(flight_id, 1, 2, start, end)['$match']) == ['metadata._flight_id', 'metadata.p_index', 'metadata.m_index', '_start_time']
+
+@pytest.mark.asyncio
+async def test_aggregate_series_keeps_series_apart():
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    collection = FakeCollection([create_group(0, 0, start), create_group(0, 1, start), create_group(1, 0, start)])
+
+    res = await aggregate_series(collection, get_series_match_stage(uuid4(), None, None, start, start), 'minute', raw_accumulators)
+
+    group_id = collection.pipelines[0][2]['$group']['_id']
+
+    assert group_id['p_index'] == '$metadata.p_index'
+    assert group_id['m_index'] == '$metadata.m_index'
+    assert [(r['p_index'], r['m_index'], r['count']) for r in res] == [(0, 0, 4), (0, 1, 4), (1, 0, 4)]
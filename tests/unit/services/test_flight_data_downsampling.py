@@ -0,0 +1,80 @@
+from datetime import datetime
+from uuid import uuid4
+import numpy as np
+import pytest
+from app.helper.batch_decoder import DecodedBatch
+from app.helper.measurement_encoding import encode_measurement_batch
+from app.services.data_access import flight_data
+from app.services.data_access.flight_data import build_encoded_flight_data_document, build_flight_data_document, get_downsampled_flight_data
+from app.services.hot_window import HotWindow, to_datetime
+from tests.unit.collection_helper import FakeCollection
+
+
+DTYPE = np.dtype([('time', '<f8'), ('value', '<f4')])
+
+def create_batch(start: int, count: int) -> DecodedBatch:
+
+    rows = np.empty(count, dtype=DTYPE)
+    rows['time'] = np.arange(start, start + count, dtype=np.float64)
+    rows['value'] = rows['time'] % 7
+    rows['value'][rows['time'] == 150] = 50
+
+    return DecodedBatch(rows, True)
+
+def create_encoded_document(flight_id, batch: DecodedBatch) -> dict:
+    start, end = to_datetime(batch.start), to_datetime(batch.end)
+    return build_encoded_flight_data_document(flight_id, 0, 0, encode_measurement_batch(batch), start, end, *batch.aggregate(), batch.get_tuple(0), batch.get_tuple(-1))
+
+def create_list_document(flight_id, batch: DecodedBatch) -> dict:
+    start, end = to_datetime(batch.start), to_datetime(batch.end)
+    return build_flight_data_document(flight_id, 0, 0, batch.to_tuples(), start, end, *batch.aggregate())
+
+async def downsample(monkeypatch, documents: list[dict]) -> dict:
+
+    async def get_collection(table):
+        return FakeCollection(documents)
+
+    monkeypatch.setattr(flight_data, 'get_or_init_flight_data_collection', get_collection)
+    monkeypatch.setattr(flight_data, 'hot_window', HotWindow(60, 1024*1024))
+
+    res = await get_downsampled_flight_data(uuid4(), 0, 0, datetime(1970, 1, 1), datetime(1970, 1, 2), 20)
+
+    assert len(res) == 1
+
+    return res[0]
+
+@pytest.mark.asyncio
+async def test_downsample_decoded_rows(monkeypatch):
+
+    flight_id = uuid4()
+
+    # Stored out of order, the rows are sorted by time before they are downsampled
+    res = await downsample(monkeypatch, [create_encoded_document(flight_id, create_batch(100, 100)), create_encoded_document(flight_id, create_batch(0, 100))])
+
+    assert len(res['measurements']) <= 20
+    assert (150.0, 50.0) in res['measurements']
+    assert res['measurements'] == sorted(res['measurements'])
+    assert (res['min'], res['max']) == (0, 50)
+
+    # Documents storing lists are read as tuples, with the same result
+    assert await downsample(monkeypatch, [create_list_document(flight_id, create_batch(100, 100)), create_encoded_document(flight_id, create_batch(0, 100))]) == res
+
+@pytest.mark.asyncio
+async def test_downsample_hot_window(monkeypatch):
+
+    flight_id = uuid4()
+
+    async def get_collection(table):
+        raise AssertionError('Covered by the hot window')
+
+    hot_window = HotWindow(1000, 1024*1024)
+    hot_window.append('flight_data', flight_id, 0, 0, create_batch(0, 200))
+
+    monkeypatch.setattr(flight_data, 'get_or_init_flight_data_collection', get_collection)
+    monkeypatch.setattr(flight_data, 'hot_window', hot_window)
+
+    res = await get_downsampled_flight_data(flight_id, 0, 0, to_datetime(0), to_datetime(1000), 20, 'lttb')
+
+    assert len(res[0]['measurements']) == 20
+    assert res[0]['measurements'][0] == (0.0, 0.0)
+    assert (150.0, 50.0) in res[0]['measurements']
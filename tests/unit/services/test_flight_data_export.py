@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+import io
+import struct
+from uuid import uuid4
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from app.helper.batch_decoder import decode_batch
+from app.helper.binary_format_encoder import get_codec
+from app.helper.measurement_encoding import encode_measurement_batch
+from app.helper.payload_batch import pack_payloads
+from app.models.flight import Flight
+from app.models.flight_measurement import FlightMeasurementDescriptor
+from app.services.data_access.flight_data import build_encoded_flight_data_document, build_raw_flight_data_document
+from app.services.flight_data_export import export_flight_data, get_value_columns
+
+
+def create_flight():
+
+    part_id = str(uuid4())
+
+    flight = Flight(start=datetime.now(timezone.utc), measured_part_ids=[part_id])
+    flight.measured_parts[part_id] = [
+        FlightMeasurementDescriptor(name='altitude', type='f'),
+        FlightMeasurementDescriptor(name='position', type='ddd'),
+        FlightMeasurementDescriptor(name='status', type='[str]'),
+    ]
+
+    return flight, part_id
+
+async def iterate(values):
+    for v in values:
+        yield v
+
+def create_document(p_index, m_index, measurements):
+    return {'metadata': {'p_index': p_index, 'm_index': m_index}, 'measurements': measurements}
+
+@pytest.mark.parametrize('shape,types', [
+    ('f', [pa.float32()]),
+    ('!i', [pa.int32()]),
+    ('?', [pa.bool_()]),
+    ('fd', [pa.float32(), pa.float64()]),
+    ('[H]', [pa.list_(pa.uint16())]),
+    ('[str]', [pa.string()]),
+    ([('a', 'f'), ('b', '[f]')], [pa.float32(), pa.string()]),
+])
+def test_value_columns(shape, types):
+    assert [t for _, t, _, _ in get_value_columns(shape)] == types
+
+async def export(format: str):
+
+    flight, part_id = create_flight()
+
+    documents = [
+        create_document(0, 0, [[1.0, 1.5], [2.0, 2.5]]),
+        create_document(0, 1, [[1.0, [1.0, 2.0, 3.0]]]),
+        create_document(0, 2, [[3.0, 'ok']]),
+    ]
+
+    data = b''.join([c async for c in export_flight_data(flight, [(0, 0), (0, 1), (0, 2)], iterate(documents), format)]) # type: ignore
+
+    return data, part_id
+
+@pytest.mark.asyncio
+async def test_export_arrow():
+
+    data, part_id = await export('arrow')
+
+    table = pa.ipc.open_stream(data).read_all()
+
+    assert table.num_rows == 4
+    assert table.column(f'{part_id}.altitude').to_pylist() == [1.5, 2.5, None, None]
+    assert table.column(f'{part_id}.position.1').to_pylist() == [None, None, 2.0, None]
+    assert table.column(f'{part_id}.status').to_pylist() == [None, None, None, 'ok']
+    assert table.column('series_name').to_pylist() == ['altitude', 'altitude', 'position', 'status']
+    assert table.column('time').to_pylist()[0] == datetime.fromtimestamp(1.0, tz=timezone.utc)
+
+@pytest.mark.asyncio
+async def test_export_parquet():
+
+    data, part_id = await export('parquet')
+
+    table = pq.read_table(io.BytesIO(data))
+
+    assert table.num_rows == 4
+    assert table.column(f'{part_id}.altitude').to_pylist() == [1.5, 2.5, None, None]
+
+@pytest.mark.asyncio
+async def test_export_decoded_rows():
+
+    part_id = str(uuid4())
+
+    flight = Flight(start=datetime.now(timezone.utc), measured_part_ids=[part_id])
+    flight.measured_parts[part_id] = [
+        FlightMeasurementDescriptor(name='altitude', type='e'),
+        FlightMeasurementDescriptor(name='position', type='ddd'),
+        FlightMeasurementDescriptor(name='cells', type='[H]'),
+    ]
+
+    altitude = decode_batch(get_codec('e'), [struct.pack('!de', 1.0, 1.5), struct.pack('!de', 2.0, 2.5)])
+    assert altitude is not None
+
+    now = datetime.now(timezone.utc)
+
+    position, size, sizes = pack_payloads([struct.pack('!dddd', 3.0, 1.0, 2.0, 3.0)])
+    cells, cells_size, cells_sizes = pack_payloads([struct.pack('!dHH', 4.0, 7, 8)])
+
+    documents = [
+        build_encoded_flight_data_document(flight.id, 0, 0, encode_measurement_batch(altitude), now, now, *altitude.aggregate(), altitude.get_tuple(0), altitude.get_tuple(-1)),
+        build_raw_flight_data_document(flight.id, 0, 1, 'ddd', position, size, sizes, 1, now, now, None, None, None, (3.0, (1.0, 2.0, 3.0)), (3.0, (1.0, 2.0, 3.0))),
+        build_raw_flight_data_document(flight.id, 0, 2, '[H]', cells, cells_size, cells_sizes, 1, now, now, None, None, None, (4.0, [7, 8]), (4.0, [7, 8])),
+    ]
+
+    data = b''.join([c async for c in export_flight_data(flight, [(0, 0), (0, 1), (0, 2)], iterate(documents), 'arrow')])
+
+    table = pa.ipc.open_stream(data).read_all()
+
+    assert table.column(f'{part_id}.altitude').to_pylist() == [1.5, 2.5, None, None]
+    assert table.column(f'{part_id}.position.2').to_pylist() == [None, None, 3.0, None]
+    assert table.column(f'{part_id}.cells').to_pylist() == [None, None, None, [7, 8]]
+    assert table.column('time').to_pylist()[3] == datetime.fromtimestamp(4.0, tz=timezone.utc)
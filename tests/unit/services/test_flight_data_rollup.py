@@ -0,0 +1,196 @@
+import asyncio
+from datetime import datetime, timezone
+import struct
+from uuid import uuid4
+import numpy as np
+import pytest
+from app.helper.batch_decoder import DecodedBatch, decode_batch
+from app.helper.binary_format_encoder import get_codec
+from app.helper.measurement_encoding import encode_measurement_batch
+from app.helper.payload_batch import pack_payloads
+from app.services.data_access import flight_data_rollup
+from app.services.data_access.flight_data import build_encoded_flight_data_document, build_flight_data_document, build_raw_flight_data_document, get_series_match_stage
+from app.services.data_access.flight_data_rollup import COVERAGE_MIGRATION_ID, RollupCoverage, add_batch_buckets, compute_rollup_buckets, create_rollup_levels, get_rollup_level, series_matches
+from tests.unit.collection_helper import FakeCursor
+
+
+def create_document(flight_id, measurements, numeric = True):
+
+    values = [v for _, v in measurements]
+
+    return build_flight_data_document(
+        flight_id, 0, 1, measurements,
+        datetime.fromtimestamp(measurements[0][0], tz=timezone.utc),
+        datetime.fromtimestamp(measurements[-1][0], tz=timezone.utc),
+        min(values) if numeric else None,
+        sum(values)/len(values) if numeric else None,
+        max(values) if numeric else None
+    )
+
+@pytest.mark.parametrize('resolution,level', [
+    ('decisecond', None),
+    ('second', '1s'),
+    ('minute', '1min'),
+    ('hour', '1min'),
+    ('month', '1min'),
+])
+def test_rollup_level(resolution, level):
+    assert get_rollup_level(resolution) == level
+
+def test_compute_rollup_buckets():
+
+    flight_id = uuid4()
+
+    documents = [
+        create_document(flight_id, [(60.2, 1.0), (60.7, 3.0), (61.1, 5.0)]),
+        create_document(flight_id, [(71.5, -1.0), (121.0, 10.0)]),
+    ]
+
+    levels = compute_rollup_buckets(documents)
+
+    assert sorted(k[3] for k in levels['1s']) == [60, 61, 71, 121]
+
+    first_second = levels['1s'][(flight_id, 0, 1, 60)]
+    assert (first_second.count, first_second.sum, first_second.min, first_second.max) == (2, 4.0, 1.0, 3.0)
+
+    assert sorted(k[3] for k in levels['10s']) == [60, 70, 120]
+
+    minute = levels['1min'][(flight_id, 0, 1, 60)]
+    assert (minute.count, minute.sum, minute.min, minute.max) == (4, 8.0, -1.0, 5.0)
+    assert minute.first == (60.2, 1.0)
+    assert minute.last == (71.5, -1.0)
+
+def test_compute_rollup_buckets_non_numeric():
+
+    flight_id = uuid4()
+
+    levels = compute_rollup_buckets([create_document(flight_id, [(1.0, 'a'), (1.5, 'b')], numeric=False)])
+
+    bucket = levels['1min'][(flight_id, 0, 1, 0)]
+    assert (bucket.count, bucket.sum, bucket.min, bucket.max) == (2, None, None, None)
+    assert bucket.last == (1.5, 'b')
+
+def test_batch_buckets_match_documents():
+
+    flight_id = uuid4()
+    measurements = [(60.2, 1.0), (60.7, 3.0), (61.1, 5.0), (71.5, -1.0), (121.0, 10.0)]
+
+    rows = np.array(measurements, dtype=[('time', '>f8'), ('value', '>f4')])
+
+    levels = create_rollup_levels()
+    add_batch_buckets(levels, flight_id, 0, 1, DecodedBatch(rows, True))
+
+    expected = compute_rollup_buckets([create_document(flight_id, measurements)])
+
+    for level in levels:
+        assert {k: (b.count, b.sum, b.min, b.max, b.first, b.last) for k, b in levels[level].items()} == {k: (b.count, b.sum, b.min, b.max, b.first, b.last) for k, b in expected[level].items()}
+
+def test_compute_rollup_buckets_stored_batches():
+
+    flight_id = uuid4()
+    payloads = [struct.pack('!df', 1.0, 2.0), struct.pack('!df', 1.5, 4.0)]
+    batch = decode_batch(get_codec('f'), payloads)
+
+    assert batch is not None
+
+    encoded = build_encoded_flight_data_document(flight_id, 0, 0, encode_measurement_batch(batch), datetime.now(timezone.utc), datetime.now(timezone.utc), *batch.aggregate(), batch.get_tuple(0), batch.get_tuple(-1))
+
+    # Not fixed width, only the first and last of every bucket are decoded
+    data, size, sizes = pack_payloads([struct.pack('!d', 2.0) + b'a', struct.pack('!d', 2.5) + b'bc'])
+    raw = build_raw_flight_data_document(flight_id, 0, 1, '[str]', data, size, sizes, 2, datetime.now(timezone.utc), datetime.now(timezone.utc), None, None, None, (2.0, 'a'), (2.5, 'bc'))
+
+    levels = compute_rollup_buckets([encoded, raw])
+
+    numbers = levels['1s'][(flight_id, 0, 0, 1)]
+    assert (numbers.count, numbers.sum, numbers.min, numbers.max) == (2, 6.0, 2.0, 4.0)
+
+    text = levels['1s'][(flight_id, 0, 1, 2)]
+    assert (text.count, text.sum, text.first, text.last) == (2, None, (2.0, 'a'), (2.5, 'bc'))
+
+def test_series_matches():
+
+    flight_id = uuid4()
+
+    match = get_series_match_stage(flight_id, 0, None, datetime(2024, 1, 1), datetime(2024, 1, 2))['$match']
+
+    assert series_matches((flight_id, 0, 3), match)
+    assert not series_matches((flight_id, 1, 3), match)
+    assert not series_matches((uuid4(), 0, 3), match)
+
+    multi = {'metadata._flight_id': {'$eq': flight_id}, '$or': [{'metadata.p_index': 0, 'metadata.m_index': 1}]}
+
+    assert series_matches((flight_id, 0, 1), multi)
+    assert not series_matches((flight_id, 0, 2), multi)
+
+class FakeCoverage:
+
+    def __init__(self, incomplete, migrated) -> None:
+        self.incomplete = incomplete
+        self.migrated = migrated
+        self.loads = 0
+
+    def find(self, query):
+        self.loads += 1
+        documents = [{'metadata': {'_flight_id': f, 'p_index': p, 'm_index': m}} for f, p, m in self.incomplete]
+        return FakeCursor(documents)
+
+    async def find_one(self, query):
+        return {'_id': COVERAGE_MIGRATION_ID, 'done': self.migrated, 'before': None}
+
+    async def bulk_write(self, requests, ordered=True):
+        pass
+
+@pytest.mark.asyncio
+async def test_coverage_is_cached(monkeypatch):
+
+    flight_id = uuid4()
+    coverage_collection = FakeCoverage([(flight_id, 0, 1)], True)
+
+    async def get_coverage(table):
+        return coverage_collection
+
+    monkeypatch.setattr(flight_data_rollup, 'get_or_init_coverage_collection', get_coverage)
+
+    coverage = RollupCoverage()
+    monkeypatch.setattr(coverage, 'schedule_backfill', lambda table, series, flight_data: None)
+
+    match = get_series_match_stage(flight_id, 0, None, datetime(2024, 1, 1), datetime(2024, 1, 2))['$match']
+    other = get_series_match_stage(flight_id, 1, None, datetime(2024, 1, 1), datetime(2024, 1, 2))['$match']
+
+    assert not await coverage.is_covered('flight_data', match, None) # type: ignore
+    assert await coverage.is_covered('flight_data', other, None) # type: ignore
+    assert coverage_collection.loads == 1
+
+    # Known without loading again
+    await coverage.mark_incomplete('flight_data', {(flight_id, 1, 0)}, RuntimeError('write failed'))
+
+    assert not await coverage.is_covered('flight_data', other, None) # type: ignore
+    assert coverage_collection.loads == 1
+    assert coverage.get_metrics()['raw_fallbacks'] == 2
+
+@pytest.mark.asyncio
+async def test_nothing_covered_until_migrated(monkeypatch):
+
+    coverage_collection = FakeCoverage([], False)
+
+    async def get_coverage(table):
+        return coverage_collection
+
+    migrations = list()
+
+    async def migrate(table, before, flight_data):
+        migrations.append(table)
+
+    monkeypatch.setattr(flight_data_rollup, 'get_or_init_coverage_collection', get_coverage)
+
+    coverage = RollupCoverage()
+    monkeypatch.setattr(coverage, 'migrate', migrate)
+
+    match = get_series_match_stage(uuid4(), 0, None, datetime(2024, 1, 1), datetime(2024, 1, 2))['$match']
+
+    assert not await coverage.is_covered('flight_data', match, None) # type: ignore
+
+    # The migration runs in the background
+    await asyncio.gather(*coverage.tasks)
+
+    assert migrations == ['flight_data']
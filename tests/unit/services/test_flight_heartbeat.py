@@ -0,0 +1,96 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from app.models.flight import FLIGHT_DEFAULT_HEAD_TIME, FLIGHT_MINIMUM_HEAD_TIME
+from app.services import flight_heartbeat as heartbeat_module
+from app.services.flight_heartbeat import FlightHeartbeat
+
+
+class FakeFlightCollection:
+
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.writes = list[list]()
+
+    async def bulk_write(self, updates, ordered=True):
+
+        if self.fail:
+            raise RuntimeError('not reachable')
+
+        self.writes.append(updates)
+        return SimpleNamespace(modified_count=len(updates))
+
+def patch_collection(monkeypatch, collection: FakeFlightCollection):
+    monkeypatch.setattr(heartbeat_module, 'get_flight_collection', lambda: collection)
+
+@pytest.mark.asyncio
+async def test_flush_extends_with_max(monkeypatch):
+
+    collection = FakeFlightCollection()
+    patch_collection(monkeypatch, collection)
+
+    heartbeat = FlightHeartbeat()
+    flight_id = uuid4()
+
+    heartbeat.beat(flight_id, 1000.0)
+    heartbeat.beat(flight_id, 1005.0)
+    heartbeat.beat(flight_id, 1002.0)
+
+    await heartbeat.flush()
+
+    seen = datetime.fromtimestamp(1005.0, tz=timezone.utc)
+    update = collection.writes[0][0]
+
+    assert len(collection.writes[0]) == 1
+    assert update._filter == {'_id': flight_id, 'end': {'$ne': None, '$lt': seen + FLIGHT_MINIMUM_HEAD_TIME}}
+    assert update._doc == {'$max': {'end': seen + FLIGHT_DEFAULT_HEAD_TIME}}
+    assert heartbeat.get_metrics() == {'pending': 0, 'flushes': 1, 'extended': 1}
+
+    # Nothing seen since
+    await heartbeat.flush()
+
+    assert len(collection.writes) == 1
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_beats(monkeypatch):
+
+    collection = FakeFlightCollection(fail=True)
+    patch_collection(monkeypatch, collection)
+
+    heartbeat = FlightHeartbeat()
+    flight_id = uuid4()
+
+    heartbeat.beat(flight_id, 1000.0)
+
+    with pytest.raises(RuntimeError):
+        await heartbeat.flush()
+
+    assert heartbeat.last_seen == {flight_id: 1000.0}
+
+    # Failures of the timer are only printed
+    await heartbeat.try_flush()
+
+    assert heartbeat.get_metrics() == {'pending': 1, 'flushes': 0, 'extended': 0}
+
+    collection.fail = False
+    await heartbeat.flush()
+
+    assert len(collection.writes) == 1
+    assert heartbeat.get_metrics()['pending'] == 0
+
+@pytest.mark.asyncio
+async def test_stop_flushes(monkeypatch):
+
+    collection = FakeFlightCollection()
+    patch_collection(monkeypatch, collection)
+
+    heartbeat = FlightHeartbeat(interval=3600)
+    heartbeat.start()
+
+    heartbeat.beat(uuid4())
+
+    await heartbeat.stop()
+
+    assert heartbeat.task is None
+    assert len(collection.writes) == 1
@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+import pytest
+from app.models.flight import Flight
+from app.services import flight_schema_cache as cache_module
+from app.services import flight_service
+from app.services.data_access.flight import get_flight_new_signal, get_flight_update_signal
+from app.services.flight_schema_cache import FlightSchemaCache
+from app.services.flight_service import FlightService
+
+
+def patch_database(monkeypatch, flights: list[Flight]) -> list:
+
+    queries = list()
+
+    async def get_flight(flight_id):
+        queries.append(flight_id)
+        return next((f for f in flights if f.id == flight_id), None)
+
+    monkeypatch.setattr(cache_module, 'get_flight', get_flight)
+
+    return queries
+
+def patch_clock(monkeypatch, now: list[float]):
+    monkeypatch.setattr(cache_module, 'monotonic', lambda: now[0])
+
+def create_flight() -> Flight:
+    return Flight(start=datetime.now(timezone.utc), _vessel_id=uuid4())
+
+@pytest.mark.asyncio
+async def test_flight_schema_cache_hit_and_miss(monkeypatch):
+
+    flight = create_flight()
+    queries = patch_database(monkeypatch, [flight])
+
+    cache = FlightSchemaCache()
+
+    assert await cache.get(flight.id) == flight
+    assert await cache.get(flight.id) == flight
+    assert await cache.get(uuid4()) is None
+
+    assert queries[0] == flight.id and len(queries) == 2
+    assert cache.get_metrics() == {'entries': 1, 'hits': 1, 'misses': 2}
+
+@pytest.mark.asyncio
+async def test_flight_schema_cache_expires(monkeypatch):
+
+    flight = create_flight()
+    queries = patch_database(monkeypatch, [flight])
+
+    now = [100.0]
+    patch_clock(monkeypatch, now)
+
+    cache = FlightSchemaCache(ttl=30)
+
+    await cache.get(flight.id)
+
+    now[0] = 129.0
+    await cache.get(flight.id)
+
+    assert len(queries) == 1
+
+    now[0] = 130.0
+    await cache.get(flight.id)
+
+    assert len(queries) == 2
+    assert cache.get_metrics() == {'entries': 1, 'hits': 1, 'misses': 2}
+
+@pytest.mark.asyncio
+async def test_flight_schema_cache_dropped_when_missing(monkeypatch):
+
+    flight = create_flight()
+    patch_database(monkeypatch, [])
+
+    now = [100.0]
+    patch_clock(monkeypatch, now)
+
+    cache = FlightSchemaCache(ttl=30)
+    cache.set(flight)
+
+    # Deleted by another process
+    now[0] = 200.0
+
+    assert await cache.get(flight.id) is None
+    assert cache.get_metrics()['entries'] == 0
+
+@pytest.mark.asyncio
+async def test_flight_schema_cache_replaced_on_write(monkeypatch):
+
+    flight = create_flight()
+    queries = patch_database(monkeypatch, [])
+
+    monkeypatch.setattr(cache_module.flight_schema_cache, 'entries', dict())
+
+    get_flight_new_signal().send(None, flight=flight)
+
+    assert await cache_module.flight_schema_cache.get(flight.id) is flight
+
+    updated = flight.model_copy()
+    get_flight_update_signal().send(None, flight=updated)
+
+    assert await cache_module.flight_schema_cache.get(flight.id) is updated
+    assert queries == []
+
+@pytest.mark.asyncio
+async def test_flight_schema_cache_invalidated_on_delete(monkeypatch):
+
+    flight = create_flight()
+
+    async def delete(_ids):
+        return True
+
+    for name in ['bulk_delete_flight_data_by_flight_ids', 'bulk_delete_flight_commands_by_flight_ids', 'bulk_delete_flights_by_ids']:
+        monkeypatch.setattr(flight_service, name, delete)
+
+    monkeypatch.setattr(cache_module.flight_schema_cache, 'entries', dict())
+    cache_module.flight_schema_cache.set(flight)
+
+    assert await FlightService.bulk_delete_flights_by_ids([flight.id])
+    assert flight.id not in cache_module.flight_schema_cache.entries
@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+import numpy as np
+from app.helper.batch_decoder import DecodedBatch
+from app.services.hot_window import HotWindow, SeriesRing
+
+
+DTYPE = np.dtype([('time', '<f8'), ('value', '<f4')])
+
+def create_batch(times: list[float], values: list[float] | None = None) -> DecodedBatch:
+
+    rows = np.empty(len(times), dtype=DTYPE)
+    rows['time'] = times
+    rows['value'] = values if values is not None else times
+
+    return DecodedBatch(rows, True)
+
+def to_date(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+
+def test_series_ring_wraps_and_trims():
+
+    ring = SeriesRing(DTYPE, True, 4)
+
+    ring.append(create_batch([1, 2, 3]).rows, 100)
+    ring.append(create_batch([4, 5]).rows, 100)
+
+    assert ring.get_rows()['time'].tolist() == [2, 3, 4, 5]
+    assert ring.dropped_until == 1
+
+    ring.append(create_batch([9]).rows, 5)
+
+    assert ring.get_rows()['time'].tolist() == [4, 5, 9]
+    assert ring.dropped_until == 3
+
+def test_series_ring_drops_across_wrap():
+
+    ring = SeriesRing(DTYPE, True, 256)
+
+    ring.append(create_batch(list(range(200))).rows, 1000)
+    ring.append(create_batch(list(range(200, 300))).rows, 1000)
+
+    assert ring.start == 44
+    assert ring.dropped_until == 43
+
+    # The outdated rows reach over the end of the buffer
+    ring.append(create_batch([1000, 1100]).rows, 150)
+
+    assert ring.get_rows()['time'].tolist() == [1000, 1100]
+    assert ring.dropped_until == 299
+
+    # The late row stays behind a row within the window
+    ring.append(create_batch([1200, 900]).rows, 150)
+
+    assert ring.get_rows()['time'].tolist() == [1100, 1200, 900]
+    assert ring.dropped_until == 1000
+
+def test_get_range_within_window():
+
+    hot_window = HotWindow(60, 1024*1024)
+    flight_id = uuid4()
+
+    hot_window.append('flight_data', flight_id, 0, 0, create_batch([100, 101, 102]))
+    hot_window.append('flight_data', flight_id, 0, 1, create_batch([100.5, 101.5], [7, 8]))
+    hot_window.append('flight_data', flight_id, 1, 0, create_batch([100, 101]))
+
+    documents = hot_window.get_range('flight_data', flight_id, 0, to_date(101), to_date(103))
+
+    assert documents is not None
+    assert [(d['p_index'], d['m_index'], d['measurements']) for d in documents] == [(0, 0, [(101.0, 101.0), (102.0, 102.0)]), (0, 1, [(101.5, 8.0)])]
+    assert (documents[0]['min'], documents[0]['avg'], documents[0]['max']) == (101.0, 101.5, 102.0)
+
+    # Starts before the first sample this process has seen of the flight
+    assert hot_window.get_range('flight_data', flight_id, 0, to_date(99), to_date(103)) is None
+    assert hot_window.get_range('flight_data', uuid4(), 0, to_date(101), to_date(103)) is None
+
+def test_get_range_after_dropped_samples():
+
+    hot_window = HotWindow(10, 1024*1024)
+    flight_id = uuid4()
+
+    hot_window.append('flight_data', flight_id, 0, 0, create_batch([100, 101]))
+    hot_window.append('flight_data', flight_id, 0, 0, create_batch([112]))
+
+    assert hot_window.get_range('flight_data', flight_id, 0, to_date(101), to_date(120)) is None
+    assert hot_window.get_range('flight_data', flight_id, 0, to_date(102), to_date(120)) is not None
+
+def test_uncovered_series():
+
+    hot_window = HotWindow(60, 1024*1024)
+    flight_id = uuid4()
+
+    hot_window.append('flight_data', flight_id, 0, 0, create_batch([100, 101]))
+    hot_window.mark_uncovered('flight_data', flight_id, 0, 1, 105)
+
+    assert hot_window.get_range('flight_data', flight_id, 0, to_date(101), to_date(110)) is None
+    assert hot_window.get_range('flight_data', flight_id, 0, to_date(106), to_date(110)) is not None
+    assert hot_window.get_aggregated('flight_data', flight_id, 0, 0, to_date(101), to_date(110), 'second') is not None
+
+def test_get_aggregated():
+
+    hot_window = HotWindow(60, 1024*1024)
+    flight_id = uuid4()
+
+    hot_window.append('flight_data', flight_id, 0, 0, create_batch([100, 100.3, 100.6, 101.2], [1, 2, 3, 5]))
+
+    res = hot_window.get_aggregated('flight_data', flight_id, 0, 0, to_date(100), to_date(102), 'second')
+
+    assert res is not None
+    assert [(r['count'], r['min'], r['avg'], r['max'], r['first'], r['last']) for r in res] == [
+        (3, 1.0, 2.0, 3.0, (100.0, 1.0), (100.6, 3.0)),
+        (1, 5.0, 5.0, 5.0, (101.2, 5.0), (101.2, 5.0)),
+    ]
+
+    assert hot_window.get_aggregated('flight_data', flight_id, 0, 0, to_date(100), to_date(102), 'month') is None
+
+def test_memory_limit_evicts_least_recently_written():
+
+    hot_window = HotWindow(60, 1024*DTYPE.itemsize)
+    first, second = uuid4(), uuid4()
+
+    hot_window.append('flight_data', first, 0, 0, create_batch([100]))
+    hot_window.append('flight_data', second, 0, 0, create_batch([100]))
+
+    assert hot_window.get_range('flight_data', first, 0, to_date(100), to_date(101)) is None
+    assert hot_window.get_range('flight_data', second, 0, to_date(100), to_date(101)) is not None
+    assert hot_window.get_metrics()['bytes'] <= 1024*DTYPE.itemsize
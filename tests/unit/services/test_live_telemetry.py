@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+from types import SimpleNamespace
+from fastapi import HTTPException
+import numpy as np
+import pytest
+from app.controller import live_controller
+from app.models.flight import Flight
+from app.models.flight_measurement import FlightMeasurementDescriptor
+from app.services import live_telemetry as live_telemetry_module
+from app.services.live_telemetry import LiveSubscription, LiveTelemetryHub, get_decimation, get_live_series
+
+
+def create_flight() -> Flight:
+    flight = Flight(start=datetime.now(timezone.utc), measured_part_ids=[str(uuid4()), str(uuid4())])
+    flight.measured_parts[flight.measured_part_ids[0]] = [FlightMeasurementDescriptor(name='altitude', type='f'), FlightMeasurementDescriptor(name='speed', type='f')]
+    flight.measured_parts[flight.measured_part_ids[1]] = [FlightMeasurementDescriptor(name='temperature', type='f')]
+    return flight
+
+def test_get_decimation():
+
+    times = np.array([0.0, 0.3, 0.6, 1.1, 1.2, 2.9])
+
+    indices, slots = get_decimation(times, 1)
+
+    assert indices.tolist() == [0, 3, 5]
+    assert slots.tolist() == [0, 1, 2] # type: ignore
+
+    indices, slots = get_decimation(times, None)
+
+    assert indices.tolist() == [0, 1, 2, 3, 4, 5]
+    assert slots is None
+
+def test_get_live_series():
+
+    flight = create_flight()
+    part_id = flight.measured_part_ids[0]
+
+    assert get_live_series(flight, None, None) is None
+    assert get_live_series(flight, part_id, None) == {(0, 0), (0, 1)}
+    assert get_live_series(flight, part_id, 'speed') == {(0, 1)}
+
+    with pytest.raises(ValueError):
+        get_live_series(flight, str(uuid4()), None)
+
+    with pytest.raises(ValueError):
+        get_live_series(flight, part_id, 'temperature')
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_decimated():
+
+    flight = create_flight()
+    hub = LiveTelemetryHub()
+
+    everything = LiveSubscription(flight.id, None, None)
+    decimated = LiveSubscription(flight.id, {(0, 0)}, 1)
+    other_series = LiveSubscription(flight.id, {(1, 0)}, None)
+
+    for s in [everything, decimated, other_series]:
+        hub.subscribe(s)
+
+    hub.publish(flight, 0, 0, [(10.0, 1), (10.5, 2), (11.0, 3)])
+    hub.publish(flight, 0, 0, [(11.5, 4), (12.0, 5)])
+
+    assert (await everything.get())['measurements'] == [(10.0, 1), (10.5, 2), (11.0, 3)]
+    assert (await everything.get())['measurements'] == [(11.5, 4), (12.0, 5)]
+
+    first = await decimated.get()
+
+    assert first['series_name'] == 'altitude'
+    assert first['measurements'] == [(10.0, 1), (11.0, 3)]
+
+    # The slot of 11.5 was already sent with the first batch
+    assert (await decimated.get())['measurements'] == [(12.0, 5)]
+
+    assert other_series.queue.empty()
+
+    for s in [everything, decimated, other_series]:
+        hub.unsubscribe(s)
+
+    assert not hub.has_subscribers(flight.id)
+
+@pytest.mark.asyncio
+async def test_subscription_drops_oldest():
+
+    flight = create_flight()
+    hub = LiveTelemetryHub()
+
+    subscription = LiveSubscription(flight.id, None, None, max_queued=2)
+    hub.subscribe(subscription)
+
+    for i in range(5):
+        hub.publish(flight, 0, 0, [(float(i), i)])
+
+    message = await subscription.get()
+
+    assert message['measurements'] == [(3.0, 3)]
+    assert message['dropped'] == 3
+    assert (await subscription.get())['dropped'] == 0
+    assert hub.get_metrics()['dropped'] == 3
+
+@pytest.mark.asyncio
+async def test_live_rejected_with_external_ingest(monkeypatch):
+
+    monkeypatch.setattr(live_telemetry_module, 'get_settings', lambda: SimpleNamespace(ingest_mode='external'))
+
+    flight = create_flight()
+
+    with pytest.raises(HTTPException) as e:
+        await live_controller.get_live_measurements(flight.id, (flight, None), None, None, None) # type: ignore
+
+    assert e.value.status_code == 503
+
+    ack = await live_controller.subscribe('sid', {'flight_id': str(flight.id)})
+
+    assert ack == {'error': live_telemetry_module.LIVE_UNAVAILABLE_MESSAGE}
+    assert live_telemetry_module.live_telemetry.get_metrics()['available'] is False
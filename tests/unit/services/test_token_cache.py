@@ -0,0 +1,78 @@
+import time
+import pytest
+from app.services.auth import token_cache
+from app.services.auth.token_cache import VerifiedTokenCache
+
+
+def patch_validation(monkeypatch, exp: float) -> list[str]:
+
+    validated = list[str]()
+
+    def validate_access_token(token: str):
+        if token == 'invalid':
+            raise ValueError('Signature verification failed')
+
+        validated.append(token)
+        return {'uid': token, 'name': 'user', 'roles': ['user'], 'exp': exp}
+
+    monkeypatch.setattr(token_cache, 'validate_access_token', validate_access_token)
+
+    return validated
+
+def test_verified_token_cache_hit(monkeypatch):
+
+    validated = patch_validation(monkeypatch, time.time() + 60)
+
+    cache = VerifiedTokenCache(16)
+
+    first = cache.get('a')
+    second = cache.get('a')
+
+    assert first is second
+    assert first._id == 'a'
+    assert validated == ['a']
+
+    metrics = cache.get_metrics()
+
+    assert metrics['hits'] == 1
+    assert metrics['misses'] == 1
+    assert metrics['hit_rate'] == 0.5
+    assert metrics['verifications'] == 1
+
+def test_verified_token_cache_respects_exp(monkeypatch):
+
+    validated = patch_validation(monkeypatch, time.time() - 1)
+
+    cache = VerifiedTokenCache(16)
+
+    cache.get('a')
+    cache.get('a')
+
+    assert validated == ['a', 'a']
+
+def test_verified_token_cache_evicts_least_recently_used(monkeypatch):
+
+    validated = patch_validation(monkeypatch, time.time() + 60)
+
+    cache = VerifiedTokenCache(2)
+
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    cache.get('c')
+    cache.get('a')
+    cache.get('b')
+
+    assert validated == ['a', 'b', 'c', 'b']
+
+def test_verified_token_cache_invalid(monkeypatch):
+
+    patch_validation(monkeypatch, time.time() + 60)
+
+    cache = VerifiedTokenCache(16)
+
+    with pytest.raises(ValueError):
+        cache.get('invalid')
+
+    assert cache.get_metrics()['entries'] == 0
+    assert cache.get_metrics()['verifications'] == 1